@@ -0,0 +1,94 @@
+"""Статистика рынка для администратора.
+
+Считается по сводкам market_stats, market_prices и seller_stats, которые
+ведут триггеры (см. миграцию add_market_stats), поэтому открытие статистики
+читает несколько тысяч строк сводок, а не группирует всю таблицу cars.
+Медиана и перцентили цены берутся по корзинам шириной около 2% и отличаются
+от точных примерно на 1%.
+"""
+import math
+from bisect import bisect_left
+from collections import namedtuple
+from itertools import accumulate
+
+from migrations import PRICE_BUCKET_SCALE
+
+
+# Какие перцентили цены показывать, по возрастанию
+PERCENTILES = (0.5, 0.9)
+
+# Сколько продавцов с наибольшими продажами показывать
+SELLER_LIMIT = 200
+
+# year равен None в строке итога по марке
+MarketGroup = namedtuple("MarketGroup", "make year available sold average median p90")
+SellerSales = namedtuple("SellerSales", "login on_sale sold revenue")
+
+
+def bucket_price(bucket):
+    """Цена в середине корзины."""
+    return math.exp(bucket / PRICE_BUCKET_SCALE)
+
+
+def percentiles(buckets, counts, fractions=PERCENTILES):
+    """Перцентили цены (по ближайшему рангу) по корзинам в порядке
+    возрастания и числу машин в каждой."""
+    seen = list(accumulate(counts))
+    total = seen[-1] if seen else 0
+    return [bucket_price(buckets[bisect_left(seen, max(1, math.ceil(fraction * total)))]) if total else None
+            for fraction in fractions]
+
+
+class MarketReport:
+    """Статистика по маркам, по маркам и годам и по продавцам."""
+
+    def __init__(self, groups, makes, sellers):
+        self.groups = groups
+        self.makes = makes
+        self.sellers = sellers
+        self.available = sum(group.available for group in makes)
+        self.sold = sum(group.sold for group in makes)
+
+    @property
+    def cars(self):
+        return self.available + self.sold
+
+    @property
+    def sold_share(self):
+        return self.sold / self.cars if self.cars else 0.0
+
+
+def _group(make, year, totals, buckets, counts):
+    available, sold, price_sum = totals
+    cars = available + sold
+    return MarketGroup(make, year, available, sold, price_sum / cars if cars else 0.0,
+                       *percentiles(buckets, counts))
+
+
+def market_report(db, seller_limit=SELLER_LIMIT):
+    """Собирает MarketReport из сводок базы; удобно вызывать в фоновом потоке."""
+    rows, price_groups, prices, sellers = db.market_summary(seller_limit)
+
+    totals = {}
+    for make, year, available, cars, price_sum in rows:
+        for key in ((make, year), (make, None)):
+            entry = totals.setdefault(key, [0, 0, 0.0])
+            entry[0 if available else 1] += cars
+            entry[2] += price_sum
+
+    groups, makes = [], []
+    make_counts = {}
+    start = 0
+    for number, (make, year, size) in enumerate(price_groups):
+        buckets, counts = zip(*prices[start:start + size])
+        start += size
+        groups.append(_group(make, year, totals[make, year], buckets, counts))
+        # Корзины марки складываются по всем ее годам
+        for bucket, cars in zip(buckets, counts):
+            make_counts[bucket] = make_counts.get(bucket, 0) + cars
+        if number == len(price_groups) - 1 or price_groups[number + 1][0] != make:
+            buckets, counts = zip(*sorted(make_counts.items()))
+            makes.append(_group(make, None, totals[make, None], buckets, counts))
+            make_counts = {}
+
+    return MarketReport(groups, makes, [SellerSales(*row) for row in sellers])
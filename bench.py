@@ -0,0 +1,735 @@
+"""Микро-бенчмарки слоя данных.
+
+Запуск: python bench.py [--rows N] [--iterations N]
+Планы запросов панелей проверяет tests/test_query_plans.py.
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+import profiling
+from analytics import market_report
+from credentials import Credentials
+from database import AVAILABLE, CAR_COLUMNS, PURCHASED, SOLD, SYNCHRONOUS_MODES, Database
+from events import CarChange
+from filter_index import CatalogueIndex, open_filter_pager, snapshot_path
+from inventory import export_file, import_file
+from migrations import MARKET_STATS_REFRESH, PRICE_HISTORY_REFRESH
+from paging import KeysetPager, PagerCache, open_pager
+
+
+MODELS = {
+    "Lada": ["Vesta", "Granta", "Niva", "Largus", "XRAY"],
+    "Toyota": ["Camry", "Corolla", "RAV4", "LandCruiser", "Prius"],
+    "Kia": ["Rio", "Sportage", "Ceed", "Sorento", "Optima"],
+    "Hyundai": ["Solaris", "Creta", "Tucson", "Elantra", "SantaFe"],
+    "Volkswagen": ["Polo", "Tiguan", "Passat", "Golf", "Touareg"],
+    "BMW": ["X5", "X3", "320i", "520d", "X6"],
+    "Mercedes": ["E200", "C180", "GLC", "GLE", "S500"],
+    "Skoda": ["Octavia", "Rapid", "Kodiaq", "Superb", "Karoq"],
+    "Renault": ["Logan", "Duster", "Sandero", "Kaptur", "Arkana"],
+    "Nissan": ["Qashqai", "XTrail", "Almera", "Juke", "Murano"],
+}
+
+WORDS = [
+    "отличное", "состояние", "один", "владелец", "пробег", "небольшой", "автомат", "механика",
+    "полный", "привод", "кожаный", "салон", "зимняя", "резина", "гаражное", "хранение",
+    "не", "битая", "не", "крашеная", "сервисная", "книжка", "торг", "обмен", "срочно",
+]
+
+# Популярные марки встречаются чаще, как и в реальном каталоге
+MAKE_WEIGHTS = [30, 18, 12, 11, 8, 6, 5, 4, 3, 3]
+
+
+def generate_cars(rows, seed=42):
+    """Синтетические машины с правдоподобным распределением марок, цен и статусов."""
+    rng = random.Random(seed)
+    makes = list(MODELS)
+    for _ in range(rows):
+        make = rng.choices(makes, MAKE_WEIGHTS)[0]
+        year = min(2024, max(1950, int(rng.gauss(2012, 7))))
+        price = round(rng.lognormvariate(13.5, 0.6), -3)
+        description = " ".join(rng.sample(WORDS, 6))
+        if rng.random() < 0.8:
+            status, buyer = AVAILABLE, None
+        else:
+            status, buyer = SOLD, f"buyer{rng.randrange(5000)}"
+        yield (make, rng.choice(MODELS[make]), year, price, description,
+               f"seller{rng.randrange(2000)}", status, buyer)
+
+
+def fill_database(db, rows):
+    """Заполняет базу синтетическими машинами и пользователями."""
+    db.initialize()
+    with db.transaction(immediate=True) as connection:
+        # Как Database.add_cars: построчные триггеры отключены, индекс поиска,
+        # сводки статистики и история цен заполняются по всей пачке сразу
+        last_id = connection.execute("SELECT coalesce(max(id), 0) FROM cars").fetchone()[0]
+        connection.execute("INSERT INTO bulk_load (active) VALUES (1)")
+        connection.executemany(
+            "INSERT INTO cars (make, model, year, price, description, seller_login, status, buyer_login) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            generate_cars(rows),
+        )
+        connection.execute("DELETE FROM bulk_load")
+        connection.execute(
+            "INSERT INTO cars_fts (rowid, make, model, description) "
+            "SELECT id, make, model, description FROM cars WHERE id > ?", (last_id,)
+        )
+        for statement in MARKET_STATS_REFRESH + PRICE_HISTORY_REFRESH:
+            connection.execute(statement, (last_id,))
+        connection.execute("INSERT OR IGNORE INTO users (login, password, role) VALUES ('bench', '1', 'Покупатель')")
+
+
+def timed(func, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    elapsed = time.perf_counter() - start
+    return iterations / elapsed
+
+
+def bench_connections(path, iterations):
+    """Сравнивает connect/close на каждый запрос с переиспользуемым соединением."""
+    query = f"SELECT {CAR_COLUMNS} FROM cars WHERE id = ?"
+
+    def per_click():
+        connection = sqlite3.connect(path)
+        connection.execute(query, (1,)).fetchone()
+        connection.close()
+
+    db = Database(path)
+
+    def pooled():
+        db.fetchone(query, (1,))
+
+    results = {
+        "connect_per_click_ops": timed(per_click, iterations),
+        "pooled_ops": timed(pooled, iterations),
+    }
+    db.close()
+    return results
+
+
+def bench_first_page(path, iterations):
+    """Время до первых строк каталога: fetchall всей таблицы против первой keyset-страницы."""
+    db = Database(path)
+
+    def full_scan():
+        db.list_cars().fetchall()
+
+    def first_page():
+        KeysetPager(db, order="ASC", available_only=True).page(0)
+
+    iterations = max(1, iterations // 100)
+    results = {
+        "fetchall_ms": 1000 / timed(full_scan, iterations),
+        "keyset_first_page_ms": 1000 / timed(first_page, iterations),
+    }
+    db.close()
+    return results
+
+
+def bench_search(path, iterations):
+    """Первая страница поиска: LIKE '%…%' против FTS5 (префиксы, опечатки, описание)."""
+    db = Database(path)
+
+    def search(text, order=None):
+        return lambda: KeysetPager(db, order=order, available_only=True, search=text).page(0)
+
+    iterations = max(1, iterations // 100)
+    results = {
+        "like_ms": 1000 / timed(lambda: db.filter_cars(make="oyot").fetchmany(256), iterations),
+        "fts_ms": 1000 / timed(search("toyota"), iterations),
+        "fts_ranked_ms": 1000 / timed(search("toyota camry гаражное хранение"), iterations),
+        "fts_prefix_ms": 1000 / timed(search("toy cam"), iterations),
+        "fts_typo_ms": 1000 / timed(search("tayota"), iterations),
+        "fts_price_sorted_ms": 1000 / timed(search("гаражное хранение", "ASC"), iterations),
+    }
+    db.close()
+    return results
+
+
+def bench_live_filter(path):
+    """Живая фильтрация: построение индекса по базе против загрузки из снимка
+    и время на нажатие клавиши по индексу из снимка, включая первую страницу."""
+    db = Database(path)
+    start = time.perf_counter()
+    index = CatalogueIndex.build(db)
+    build_ms = (time.perf_counter() - start) * 1000
+
+    snapshot = snapshot_path(db)
+    start = time.perf_counter()
+    index.save(snapshot)
+    save_ms = (time.perf_counter() - start) * 1000
+    start = time.perf_counter()
+    index = CatalogueIndex.load(db)
+    load_ms = (time.perf_counter() - start) * 1000
+
+    # Догон снимка по журналу: покупки после записи снимка
+    car_ids = [car_id for car_id, in db.fetchall("SELECT id FROM cars WHERE status = 0 LIMIT 100")]
+    for car_id in car_ids:
+        db.buy_car(car_id, "bench")
+    start = time.perf_counter()
+    index = CatalogueIndex.load(db)
+    catch_up_ms = (time.perf_counter() - start) * 1000
+
+    keystrokes = [("b", None, None), ("bm", None, None), ("bmw", None, None), ("bmw", 1, None),
+                  ("bmw", 10, None), ("bmw", 100, None), ("bmw", 1000, None), ("bmw", 10000, None),
+                  ("bmw", 100000, None), ("bmw", 100000, 5), ("bmw", 100000, 50), ("bmw", 100000, 500),
+                  ("bmw", 100000, 5000), ("bmw", 100000, 500000), ("", 100000, 500000)]
+    latencies = []
+    for text, min_price, max_price in keystrokes:
+        start = time.perf_counter()
+        open_filter_pager(db, index.query(text, min_price, max_price))
+        latencies.append((time.perf_counter() - start) * 1000)
+    snapshot_mb = os.path.getsize(snapshot) / 2 ** 20
+    os.remove(snapshot)
+    db.close()
+    return {
+        "index_build_ms": build_ms,
+        "snapshot_save_ms": save_ms,
+        "snapshot_mb": snapshot_mb,
+        "snapshot_load_ms": load_ms,
+        "snapshot_catch_up_100_ms": catch_up_ms,
+        "keystroke_avg_ms": sum(latencies) / len(latencies),
+        "keystroke_max_ms": max(latencies),
+    }
+
+
+def bench_change_bus(path):
+    """Покупка одной машины: точечное применение изменения против перечитывания каталога."""
+    db = Database(path)
+    pager = open_pager(db, order="ASC", available_only=True)
+    for number in range(1, 4):
+        pager.page(number)
+    car_id = pager.page(1).ids[0]
+    db.buy_car(car_id, "bench")
+    changes = [CarChange(*row) for row in db.car_changes_since(db.last_change_seq() - 1)]
+
+    start = time.perf_counter()
+    touched = []
+    pager.apply_changes(changes, lambda *change: touched.append(change), lambda *change: None)
+    patch_ms = (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    open_pager(db, order="ASC", available_only=True)
+    reload_ms = (time.perf_counter() - start) * 1000
+    db.close()
+    return {"patch_ms": patch_ms, "rows_touched": len(touched), "reload_ms": reload_ms}
+
+
+def bench_result_cache(path, rounds=20):
+    """Переключение покупателя между одними и теми же фильтрами с PagerCache
+    и без него, в мс на переключение, плюс счетчики кэша."""
+    db = Database(path)
+    combos = [
+        dict(available_only=True, search="bmw x5"),
+        dict(available_only=True, search="toyota camry", min_price=300000.0),
+        dict(order=(("year", "DESC"),), available_only=True, search="kia rio"),
+        dict(order="ASC", available_only=True, search="mercedes", max_price=2000000.0),
+    ]
+
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for options in combos:
+            open_pager(db, **options)
+    results = {"uncached_flip_ms": (time.perf_counter() - start) * 1000 / (rounds * len(combos))}
+
+    cache = PagerCache(db)
+    current = None
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for options in combos:
+            key = PagerCache.key(**options)
+            pager = cache.take(key) or open_pager(db, **options)
+            if current is not None:
+                cache.put(*current, db.last_change_seq())
+            current = key, pager
+    results["cached_flip_ms"] = (time.perf_counter() - start) * 1000 / (rounds * len(combos))
+    results.update(cache.stats())
+    db.close()
+    return results
+
+
+def bench_profiling(path, iterations=2000):
+    """Стоимость инструментовки: страница каталога и вызов функции с @timed
+    при выключенных и включенных замерах, в мкс."""
+    @profiling.timed("render", "bench")
+    def render():
+        pass
+
+    results = {}
+    for state in ("off", "on"):
+        if state == "on":
+            profiling.profiler = profiling.Profiler()
+        db = Database(path)
+        db.car_page(limit=50, available_only=True)
+        results[f"car_page_{state}_us"] = 1e6 / timed(lambda: db.car_page(limit=50, available_only=True), iterations)
+        results[f"timed_call_{state}_us"] = 1e6 / timed(render, iterations * 50)
+        db.close()
+    profiling.profiler = None
+    return results
+
+
+def bench_inventory(path):
+    """Экспорт всего каталога в CSV и JSONL и импорт этих файлов в пустую базу."""
+    directory = os.path.dirname(path)
+    db = Database(path)
+    results = {}
+    for fmt in ("csv", "jsonl"):
+        file_path = os.path.join(directory, f"inventory.{fmt}")
+        start = time.perf_counter()
+        rows = export_file(db, file_path)
+        results[f"{fmt}_export_rows_per_s"] = rows / (time.perf_counter() - start)
+
+        target = Database(os.path.join(directory, f"import_{fmt}.db"))
+        target.initialize()
+        start = time.perf_counter()
+        report = import_file(target, file_path, "importer")
+        results[f"{fmt}_import_rows_per_s"] = report.imported / (time.perf_counter() - start)
+        target.close()
+
+    # Память импорта ограничена пачкой и не зависит от размера файла
+    target = Database(os.path.join(directory, "import_memory.db"))
+    target.initialize()
+    tracemalloc.start()
+    import_file(target, os.path.join(directory, "inventory.csv"), "importer")
+    results["import_peak_mb"] = tracemalloc.get_traced_memory()[1] / 2 ** 20
+    tracemalloc.stop()
+    target.close()
+    db.close()
+    return results
+
+
+def add_sold_history(db, rows, seed=7):
+    """Добавляет rows давно проданных машин, как массовый импорт (bulk_load)."""
+    with db.transaction(immediate=True) as connection:
+        last_id = connection.execute("SELECT coalesce(max(id), 0) FROM cars").fetchone()[0]
+        connection.execute("INSERT INTO bulk_load (active) VALUES (1)")
+        connection.executemany(
+            "INSERT INTO cars (make, model, year, price, description, seller_login, status, buyer_login, sold_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, 0)",
+            (car[:6] + (SOLD, f"buyer{car_id % 5000}")
+             for car_id, car in enumerate(generate_cars(rows, seed))),
+        )
+        connection.execute("DELETE FROM bulk_load")
+        connection.execute(
+            "INSERT INTO cars_fts (rowid, make, model, description) "
+            "SELECT id, make, model, description FROM cars WHERE id > ?", (last_id,)
+        )
+        for statement in MARKET_STATS_REFRESH:
+            connection.execute(statement, (last_id,))
+
+
+def bench_archive(path, history=3, runs=5):
+    """Запросы к машинам в продаже (лучшее из runs) до и после того, как история
+    продаж выросла в history раз от размера каталога, и после переноса ее в архив, в мс;
+    скорость переноса и размер файла после сжатия."""
+    source = Database(path)
+    rows = source.fetchone("SELECT count(*) FROM cars")[0]
+    copy_path = os.path.join(os.path.dirname(path), "archive.db")
+    db = Database(copy_path)
+    source.connection.backup(db.connection)
+    source.close()
+
+    def active_queries():
+        times = {}
+        for name, options in (("search", dict(available_only=True, search="автомат")),
+                              ("seller_list", dict(seller_login="seller1"))):
+            best = float("inf")
+            for _ in range(runs):
+                start = time.perf_counter()
+                open_pager(db, **options)
+                best = min(best, time.perf_counter() - start)
+            times[name] = best * 1000
+        return times
+
+    results = {f"{name}_ms": value for name, value in active_queries().items()}
+    add_sold_history(db, rows * history)
+    results.update({f"{name}_with_history_ms": value for name, value in active_queries().items()})
+
+    start = time.perf_counter()
+    archived = db.archive_sold_cars()
+    results["archive_cars_per_s"] = archived / (time.perf_counter() - start)
+    results.update({f"{name}_archived_ms": value for name, value in active_queries().items()})
+
+    size = os.path.getsize(copy_path)
+    start = time.perf_counter()
+    db.merge_search_index()
+    results["merge_search_index_ms"] = (time.perf_counter() - start) * 1000
+    start = time.perf_counter()
+    db.compact(None, rebuild=True)
+    results["compact_ms"] = (time.perf_counter() - start) * 1000
+    results.update({f"{name}_compacted_ms": value for name, value in active_queries().items()})
+    db.fetchall("PRAGMA wal_checkpoint(TRUNCATE)")
+    results["file_mb_before_compact"] = size / 2 ** 20
+    results["file_mb_after_compact"] = os.path.getsize(copy_path) / 2 ** 20
+    db.close()
+    return results
+
+
+# Та же статистика рынка группировкой всей таблицы cars на каждое открытие
+NAIVE_MARKET_QUERIES = (
+    """
+    SELECT make, year, sum(status = 0), sum(status != 0), avg(price)
+    FROM cars GROUP BY make, year
+    """,
+    """
+    SELECT make, year, price FROM (
+        SELECT make, year, price, row_number() OVER (PARTITION BY make, year ORDER BY price) AS position,
+               count(*) OVER (PARTITION BY make, year) AS cars
+        FROM cars
+    ) WHERE position IN ((cars + 1) / 2, max(1, CAST(ceil(cars * 0.9) AS INTEGER)))
+    """,
+    """
+    SELECT seller_login, sum(status = 0), sum(status != 0) AS sold,
+           total(CASE WHEN status != 0 THEN price END) AS revenue
+    FROM cars GROUP BY seller_login ORDER BY sold DESC, revenue DESC, seller_login LIMIT 200
+    """,
+)
+
+
+def bench_market_stats(path, runs=5):
+    """Открытие статистики рынка: по сводкам и группировкой всей таблицы, в мс."""
+    db = Database(path)
+
+    def best(func):
+        times = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            func()
+            times.append((time.perf_counter() - start) * 1000)
+        return min(times)
+
+    results = {
+        "summary_tables_ms": best(lambda: market_report(db)),
+        "naive_group_by_ms": best(lambda: [db.fetchall(query) for query in NAIVE_MARKET_QUERIES]),
+    }
+    db.close()
+    return results
+
+
+# Запуск приложения до показанного окна входа, как в main.main
+STARTUP_SCRIPT = """
+import sys, time
+start = time.perf_counter()
+from PyQt6.QtWidgets import QApplication
+import main
+app = QApplication(sys.argv[:1])
+db = main.Database(sys.argv[1])
+main.initialize_database(db)
+window = main.AuthRegApp(db)
+window.show()
+app.processEvents()
+print((time.perf_counter() - start) * 1000, flush=True)
+"""
+
+
+def bench_startup(path, runs=5):
+    """Холодный старт в отдельном процессе (offscreen): время до окна входа."""
+    env = dict(os.environ, QT_QPA_PLATFORM="offscreen")
+    directory = os.path.dirname(os.path.abspath(__file__))
+    in_process, total = [], []
+    for _ in range(runs):
+        start = time.perf_counter()
+        process = subprocess.Popen(
+            [sys.executable, "-c", STARTUP_SCRIPT, path], cwd=directory, env=env,
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True,
+        )
+        in_process.append(float(process.stdout.readline()))
+        total.append((time.perf_counter() - start) * 1000)
+        process.wait()
+    return {
+        "login_window_ms": statistics.median(in_process),
+        "with_interpreter_ms": statistics.median(total),
+        "first_run_ms": total[0],
+    }
+
+
+def bench_login(path, threads=4, logins=40):
+    """Вход: задержка проверки scrypt, вход из кэша и число входов в секунду из нескольких потоков."""
+    db = Database(path)
+    credentials = Credentials(db)
+    credentials.register("login_bench", "secret", "Покупатель")
+
+    def cold_login():
+        credentials.forget("login_bench")
+        credentials.authenticate("login_bench", "secret")
+
+    start = time.perf_counter()
+    for _ in range(5):
+        cold_login()
+    cold_ms = (time.perf_counter() - start) / 5 * 1000
+
+    cached = timed(lambda: credentials.authenticate("login_bench", "secret"), 1000)
+
+    # Без кэша входов: каждый вход вычисляет scrypt
+    uncached = Credentials(db, session_ttl=0)
+    with ThreadPoolExecutor(threads) as pool:
+        start = time.perf_counter()
+        list(pool.map(lambda _: uncached.authenticate("login_bench", "secret"), range(logins)))
+        parallel = logins / (time.perf_counter() - start)
+    db.close()
+    return {"login_ms": cold_ms, "cached_logins_per_s": cached, f"logins_per_s_{threads}_threads": parallel}
+
+
+def bench_users(path, users=200000, deleted=100):
+    """Список пользователей администратора: весь список против страницы, поиска
+    по началу логина и фильтра по роли; удаление пачки одной транзакцией
+    против удаления по одному."""
+    db = Database(path)
+    roles = ("Продавец", "Покупатель")
+    with db.transaction(immediate=True) as connection:
+        connection.executemany(
+            "INSERT OR IGNORE INTO users (login, password, role) VALUES (?, '1', ?)",
+            ((f"user{number:07d}", roles[number % 2]) for number in range(users)),
+        )
+    start = time.perf_counter()
+    db.list_users()
+    list_ms = (time.perf_counter() - start) * 1000
+    results = {
+        "list_users_ms": list_ms,
+        "first_page_ms": 1000 / timed(lambda: db.user_page(), 200),
+        "prefix_page_ms": 1000 / timed(lambda: db.user_page(prefix="user01234"), 200),
+        "role_page_2_ms": 1000 / timed(lambda: db.user_page("user0100000", role="Продавец"), 200),
+    }
+
+    def delete(count, batch):
+        ids = [user_id for user_id, _, _ in db.user_page(limit=count, prefix="user")]
+        start = time.perf_counter()
+        if batch:
+            db.delete_users(ids)
+        else:
+            for user_id in ids:
+                db.delete_user(user_id)
+        return (time.perf_counter() - start) * 1000
+
+    results[f"delete_{deleted}_one_by_one_ms"] = delete(deleted, False)
+    results[f"delete_{deleted}_batch_ms"] = delete(deleted, True)
+    with db.transaction() as connection:
+        connection.execute("DELETE FROM users WHERE login LIKE 'user%'")
+    db.close()
+    return results
+
+
+def bench_writes(path, writes=1000, batch=50):
+    """Записи продавца (добавление и снятие машин) в секунду при каждом режиме
+    synchronous: фиксация на каждую запись против group commit пачками по
+    batch записей (как в WriteQueue)."""
+    source = Database(path)
+    cars = [car[:5] + ("writer",) for car in generate_cars(writes // 2, seed=11)]
+    results = {}
+    for mode in SYNCHRONOUS_MODES:
+        copy_path = os.path.join(os.path.dirname(path), f"writes_{mode.lower()}.db")
+        db = Database(copy_path, synchronous=mode)
+        source.connection.backup(db.connection)
+
+        start = time.perf_counter()
+        ids = [db.add_car(*car) for car in cars]
+        for car_id in ids:
+            db.delete_seller_car(car_id, "writer")
+        results[f"{mode.lower()}_one_by_one_writes_per_s"] = 2 * len(cars) / (time.perf_counter() - start)
+
+        operations = [("add_car", car) for car in cars]
+        start = time.perf_counter()
+        ids = [car_id for first in range(0, len(operations), batch)
+               for car_id in db.write_batch(operations[first:first + batch])]
+        operations = [("delete_seller_car", (car_id, "writer")) for car_id in ids]
+        for first in range(0, len(operations), batch):
+            db.write_batch(operations[first:first + batch])
+        results[f"{mode.lower()}_batch_{batch}_writes_per_s"] = 2 * len(cars) / (time.perf_counter() - start)
+        db.close()
+        os.remove(copy_path)
+    source.close()
+    return results
+
+
+def add_price_events(db, events, days=365, seed=5):
+    """Заменяет историю цен машин каталога на events синтетических записей за
+    последние days дней: первая запись — начальная цена, дальше снижения и
+    повышения разностями, как пишут триггеры; сумма разностей — текущая цена.
+    Дневные сводки пополняются ценами этих записей. Возвращает число записей."""
+    rng = random.Random(seed)
+    cars = db.fetchall("SELECT id, make, price FROM cars")
+    now = int(time.time())
+    per_car = max(1, events // len(cars))
+
+    def history():
+        for car_id, make, price in cars:
+            moments = sorted(rng.sample(range(now - days * 86400, now - 3600), per_car))
+            price = round(price * 100)
+            deltas = [rng.choice((-1, -1, -1, 1)) * round(price * rng.uniform(0.01, 0.05))
+                      for _ in moments[1:]]
+            price -= sum(deltas)
+            yield car_id, make, moments[0], price, price
+            for at, delta in zip(moments[1:], deltas):
+                price += delta
+                yield car_id, make, at, delta, price
+
+    rows = history()
+    with db.transaction(immediate=True) as connection:
+        connection.execute("DELETE FROM price_history")
+        while True:
+            chunk = list(islice(rows, 100000))
+            if not chunk:
+                break
+            connection.executemany(
+                "INSERT INTO price_history VALUES (?, ?, ?, 0)", [(car_id, at, delta) for car_id, _, at, delta, _ in chunk]
+            )
+            connection.executemany("""
+                INSERT INTO price_days VALUES (?, ? / 86400, 1, ? / 100.0)
+                ON CONFLICT DO UPDATE SET offers = offers + 1, price_sum = price_sum + excluded.price_sum
+            """, [(make, at, price) for _, make, at, _, price in chunk])
+    return per_car * len(cars)
+
+
+def bench_price_history(path, events=2000000, runs=200):
+    """История цен на events записях: история одной машины и средние цены
+    марок за 30 дней, в мс (медиана из runs); размер записи истории и
+    скорость смены цены вместе с триггерами истории."""
+    source = Database(path)
+    copy_path = os.path.join(os.path.dirname(path), "history.db")
+    db = Database(copy_path)
+    source.connection.backup(db.connection)
+    source.close()
+
+    size = os.path.getsize(copy_path)
+    start = time.perf_counter()
+    added = add_price_events(db, events)
+    results = {"events_added_per_s": added / (time.perf_counter() - start)}
+    db.connection.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    results["bytes_per_event"] = (os.path.getsize(copy_path) - size) / added
+    results["history_events"] = db.fetchone("SELECT count(*) FROM price_history")[0]
+
+    car_ids = [row[0] for row in db.fetchall("SELECT id FROM cars ORDER BY random() LIMIT ?", (runs,))]
+    makes = [row[0] for row in db.fetchall("SELECT DISTINCT make FROM price_days")]
+
+    def median_ms(func, values):
+        times = []
+        for value in values:
+            start = time.perf_counter()
+            func(value)
+            times.append(time.perf_counter() - start)
+        return statistics.median(times) * 1000
+
+    results["car_history_ms"] = median_ms(db.price_history, car_ids)
+    results["make_average_30d_ms"] = median_ms(db.make_average_price, makes * (runs // len(makes)))
+    results["all_makes_average_30d_ms"] = median_ms(lambda _: db.make_average_prices(), range(runs // 10))
+
+    with db.transaction() as connection:
+        start = time.perf_counter()
+        for car_id in car_ids:
+            connection.execute("UPDATE cars SET price = price - 1000 WHERE id = ?", (car_id,))
+        results["reprice_with_history_per_s"] = len(car_ids) / (time.perf_counter() - start)
+    db.close()
+    os.remove(copy_path)
+    return results
+
+
+def purchase_worker(path, buyer, car_ids, attempts, seed):
+    """Процесс-покупатель: пытается купить attempts случайных машин из car_ids."""
+    db = Database(path)
+    rng = random.Random(seed)
+    bought, busy = [], 0
+    for _ in range(attempts):
+        car_id = rng.choice(car_ids)
+        try:
+            if db.buy_car(car_id, buyer) == PURCHASED:
+                bought.append(car_id)
+        except sqlite3.OperationalError:
+            busy += 1
+    db.close()
+    return bought, busy
+
+
+def bench_purchases(path, processes, purchases):
+    """Одновременные покупки из нескольких процессов.
+
+    Покупатели в среднем по четыре раза пытаются купить каждую машину, так
+    что большинство попыток конкурирует за уже проданные. Проверяется, что
+    каждая машина продана ровно один раз и продажи совпадают с базой.
+    """
+    db = Database(path)
+    car_ids = [row[0] for row in db.fetchall(
+        "SELECT id FROM cars WHERE status = 0 ORDER BY id LIMIT ?", (max(1, purchases // 4),)
+    )]
+    db.close()
+
+    attempts = purchases // processes
+    jobs = [(path, f"stress{number}", car_ids, attempts, number) for number in range(processes)]
+    with multiprocessing.get_context("spawn").Pool(processes) as pool:
+        start = time.perf_counter()
+        results = pool.starmap(purchase_worker, jobs)
+        elapsed = time.perf_counter() - start
+
+    bought = [car_id for sold, _ in results for car_id in sold]
+    db = Database(path)
+    sold = dict(db.fetchall(
+        f"SELECT id, buyer_login FROM cars WHERE id IN ({', '.join('?' * len(car_ids))})", car_ids
+    ))
+    db.close()
+    buyers = {car_id: f"stress{number}" for number, (cars, _) in enumerate(results) for car_id in cars}
+    return {
+        "purchases_per_s": attempts * processes / elapsed,
+        "cars_sold": len(bought),
+        "double_sales": len(bought) - len(set(bought)),
+        "lost_sales": sum(1 for car_id in car_ids if buyers.get(car_id) != sold[car_id]),
+        "busy_errors": sum(busy for _, busy in results),
+    }
+
+
+def report(name, results):
+    print(name)
+    for key, value in results.items():
+        print(f"  {key}: {value:,.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарки AvtoSell")
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--iterations", type=int, default=5000)
+    parser.add_argument("--processes", type=int, default=4)
+    parser.add_argument("--purchases", type=int, default=4000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "bench.db")
+        db = Database(path)
+        fill_database(db, args.rows)
+        db.close()
+
+        report("connections", bench_connections(path, args.iterations))
+        report("first page", bench_first_page(path, args.iterations))
+        report("search", bench_search(path, args.iterations))
+        report("live filter", bench_live_filter(path))
+        report("change bus", bench_change_bus(path))
+        report("result cache", bench_result_cache(path))
+        report("profiling", bench_profiling(path))
+        report("inventory", bench_inventory(path))
+        report("market stats", bench_market_stats(path))
+        report("archive", bench_archive(path))
+        report("login", bench_login(path))
+        report("users", bench_users(path))
+        report("writes", bench_writes(path))
+        report("price history", bench_price_history(path))
+        report("startup", bench_startup(path))
+
+        purchases = bench_purchases(path, args.processes, args.purchases)
+        report("concurrent purchases", purchases)
+        if purchases["double_sales"] or purchases["lost_sales"]:
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,370 @@
+"""Бенчмарк панелей целиком: вход, списки пользователей и машин, фильтры, покупка.
+
+Запуск: python bench_panels.py [--sizes 10000,100000,1000000] [--runs N]
+        [--data-dir каталог] [--output результат.json] [--baseline прежний.json]
+
+Базы генерируются один раз (bench.generate_cars с фиксированным seed) и
+хранятся в --data-dir; каждый размер меряется на копии базы в отдельном
+процессе с QT_QPA_PLATFORM=offscreen, поэтому пиковая память процесса
+относится к одному размеру. Операции вызываются так же, как кнопками в GUI,
+и замеряются до завершения фоновых запросов и обработки событий.
+
+Результат пишется в JSON вместе с коммитом; с --baseline операции,
+ставшие медленнее больше чем на --tolerance (и на MIN_DELTA_MS), считаются
+регрессией, и скрипт завершается с кодом 1.
+"""
+import argparse
+import json
+import os
+import resource
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from bench import fill_database
+from credentials import hash_password
+from database import Database
+
+
+SIZES = (10000, 100000, 1000000)
+
+# Разных снимков в обложках машин при замере прокрутки с миниатюрами
+PHOTOS = 50
+
+# Пользователи базы: продавцы и покупатели из generate_cars и администратор
+SELLERS = 2000
+BUYERS = 5000
+PASSWORD = "bench"
+
+# Изменения меньше этого порога не считаются регрессией (шум замеров)
+MIN_DELTA_MS = 1.0
+MIN_DELTA_KB = 1024
+
+
+def database_path(directory, rows):
+    """Шаблон базы на rows машин; генерируется при первом обращении."""
+    path = os.path.join(directory, f"cars_{rows}.db")
+    if os.path.exists(path):
+        return path
+    os.makedirs(directory, exist_ok=True)
+    partial = path + ".tmp"
+    if os.path.exists(partial):
+        os.remove(partial)
+    db = Database(partial)
+    fill_database(db, rows)
+    add_users(db)
+    db.close()
+    os.replace(partial, path)
+    return path
+
+
+def add_users(db):
+    # Один хеш на всех: scrypt для каждого из тысяч пользователей занял бы минуты
+    stored = hash_password(PASSWORD)
+    users = [("admin", stored, "Админ")]
+    users += [(f"seller{number}", stored, "Продавец") for number in range(SELLERS)]
+    users += [(f"buyer{number}", stored, "Покупатель") for number in range(BUYERS)]
+    with db.transaction(immediate=True) as connection:
+        connection.executemany("INSERT OR IGNORE INTO users (login, password, role) VALUES (?, ?, ?)", users)
+
+
+class PanelDriver:
+    """Главное окно в offscreen-режиме и операции панелей для замеров."""
+
+    def __init__(self, path):
+        from PyQt6.QtWidgets import QApplication, QMessageBox
+
+        import main
+
+        self.messages = []
+        # Окна сообщений модальные; в бенчмарке они только запоминаются
+        QMessageBox.information = staticmethod(lambda *args: self.messages.append(("info", args[2])))
+        QMessageBox.warning = staticmethod(lambda *args: self.messages.append(("warning", args[2])))
+        self.app = QApplication(sys.argv[:1])
+        self.db = Database(path)
+        main.initialize_database(self.db)
+        self.window = main.AuthRegApp(self.db)
+        self.window.show()
+        self.settle()
+
+    def settle(self):
+        """Дожидается записей, фоновых запросов и доставки их результатов в GUI."""
+        queries, writes = self.window.queries, self.window.writes
+        while True:
+            writes.wait()
+            queries.wait()
+            self.app.processEvents()
+            if not queries.busy and not writes.busy:
+                return
+
+    def login(self, login):
+        self.window.credentials.forget()
+        self.window.login_input.setText(login)
+        self.window.password_input.setText(PASSWORD)
+        self.window.login()
+        self.settle()
+
+    def become(self, login, panel):
+        """Входит пользователем без замера (вход меряется отдельно) и показывает его панель."""
+        self.window.current_user = self.db.get_user(login)
+        self.window.central_widget.setCurrentWidget(panel)
+        self.app.processEvents()
+
+    def load_users(self):
+        self.window.admin_panel.load_users()
+        self.settle()
+
+    def search_users(self):
+        """Поиск по началу логина и фильтр по роли."""
+        panel = self.window.admin_panel
+        panel.search_input.setText("buyer1")
+        panel.role_combo.setCurrentIndex(3)
+        # Повторный замер не меняет фильтров, поэтому список читается явно
+        panel.load_users()
+        self.settle()
+
+    def admin_cars(self):
+        self.window.admin_panel.show_cars_list()
+        self.settle()
+
+    def admin_scroll(self, pages=10):
+        """Список машин с начала и прокрутка на pages страниц вниз."""
+        self.admin_cars()
+        model = self.window.admin_cars_window.car_model
+        for _ in range(pages):
+            if model.canFetchMore():
+                model.fetchMore()
+            self.window.admin_cars_window.car_list_table.scrollToBottom()
+            self.app.processEvents()
+
+    def seller_cars(self):
+        self.window.seller_panel.load_car_list()
+        self.settle()
+
+    def buyer_catalogue(self):
+        panel = self.window.buyer_panel
+        panel.results.clear()
+        panel.catalogue_key = None
+        panel.load_car_list()
+        self.settle()
+
+    def buyer_filter(self, text="", min_price="", max_price="", sort=(), cached=False):
+        panel = self.window.buyer_panel
+        if not cached:
+            panel.results.clear()
+            panel.catalogue_key = None
+        panel.make_input.setText(text)
+        panel.min_price_input.setText(min_price)
+        panel.max_price_input.setText(max_price)
+        panel.sort = sort
+        panel.apply_filters()
+        self.settle()
+
+    def buyer_switch(self, texts=("camry автомат", "bmw")):
+        """Переключение между двумя поисками: со второго раза оба берутся из кэша пейджеров."""
+        self.switches = getattr(self, "switches", 0) + 1
+        self.buyer_filter(texts[self.switches % len(texts)], cached=True)
+
+    def add_photos(self, count=PHOTOS):
+        """Обложки всем машинам: count разных снимков по кругу. Хранилище держит
+        каждый снимок один раз, а миниатюры строятся при первом показе."""
+        from PyQt6.QtGui import QColor, QImage
+
+        digests = []
+        with tempfile.TemporaryDirectory() as directory:
+            for number in range(count):
+                image = QImage(1600, 1200, QImage.Format.Format_RGB32)
+                image.fill(QColor.fromHsv(number * 360 // count, 160, 220))
+                source = os.path.join(directory, f"{number}.jpg")
+                image.save(source, "JPG", 90)
+                digests.append(self.window.photos.add(source))
+        with self.db.transaction(immediate=True) as connection:
+            connection.execute("CREATE TEMP TABLE bench_photos (number INTEGER PRIMARY KEY, digest TEXT)")
+            connection.executemany("INSERT INTO bench_photos VALUES (?, ?)", enumerate(digests))
+            connection.execute("""
+                INSERT OR IGNORE INTO car_photos (car_id, position, digest)
+                SELECT id, 0, digest FROM cars JOIN bench_photos ON number = id % ?
+            """, (count,))
+            connection.execute("DROP TABLE bench_photos")
+
+    def scroll_photos(self, screens=20):
+        """Прокрутка каталога с миниатюрами на screens экранов вниз; миниатюры
+        декодируются в фоне, а в замер входит только работа GUI-потока."""
+        table = self.window.buyer_panel.car_list_table
+        bar = table.verticalScrollBar()
+        for _ in range(screens):
+            bar.setValue(bar.value() + bar.pageStep())
+            self.app.processEvents()
+
+    def buy_car(self):
+        panel = self.window.buyer_panel
+        panel.car_list_table.setCurrentIndex(panel.car_model.index(0, 0))
+        panel.buy_car()
+        self.settle()
+
+
+def measure(func, runs):
+    """Время каждого из runs вызовов в мс и пик памяти Python (КБ) еще одного вызова."""
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        func()
+        times.append((time.perf_counter() - start) * 1000)
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    ordered = sorted(times)
+    return {
+        "first_ms": times[0],
+        "median_ms": statistics.median(times),
+        "p95_ms": ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))],
+        "peak_kb": peak / 1024,
+        "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+def run_panels(path, runs):
+    """Замеры операций панелей на базе path; вызывается в отдельном процессе."""
+    driver = PanelDriver(path)
+    operations = {}
+
+    operations["login"] = measure(lambda: driver.login("buyer1"), runs)
+
+    driver.become("admin", driver.window.admin_panel)
+    operations["admin_load_users"] = measure(driver.load_users, runs)
+    operations["admin_search_users"] = measure(driver.search_users, runs)
+    operations["admin_load_car_list"] = measure(driver.admin_cars, runs)
+    operations["admin_load_and_scroll_10_pages"] = measure(driver.admin_scroll, runs)
+
+    driver.become("seller1", driver.window.seller_panel)
+    operations["seller_load_car_list"] = measure(driver.seller_cars, runs)
+
+    driver.become("buyer1", driver.window.buyer_panel)
+    operations["buyer_load_car_list"] = measure(driver.buyer_catalogue, runs)
+    filters = {
+        "make_prefix": {"text": "Toy"},
+        "price_range": {"min_price": "500000", "max_price": "1500000"},
+        "search": {"text": "camry автомат"},
+        "sorted_by_year": {"text": "bmw", "sort": (("year", "DESC"), ("price", "ASC"))},
+    }
+    for name, options in filters.items():
+        operations[f"buyer_filter_{name}"] = measure(lambda: driver.buyer_filter(**options), runs)
+    operations["buyer_filter_switch_cached"] = measure(driver.buyer_switch, runs)
+
+    driver.buyer_filter()
+    bought = len(driver.messages)
+    operations["buy_car"] = measure(driver.buy_car, runs)
+    failures = [text for kind, text in driver.messages[bought:] if kind != "info"]
+    if failures:
+        raise RuntimeError(f"Покупка не удалась: {failures[0]}")
+
+    driver.add_photos()
+    driver.window.resize(1200, 900)
+    driver.buyer_catalogue()
+    operations["buyer_scroll_20_screens_photos"] = measure(driver.scroll_photos, runs)
+    thumbnails = driver.window.thumbnails
+    thumbnails.wait()
+    driver.app.processEvents()
+
+    return {
+        "operations": operations,
+        "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "thumbnail_cache_mb": thumbnails.memory_size / 2 ** 20,
+    }
+
+
+def run_size(template, runs):
+    """Запускает run_panels на копии шаблона в отдельном процессе."""
+    env = dict(os.environ, QT_QPA_PLATFORM="offscreen")
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "users.db")
+        shutil.copyfile(template, path)
+        output = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--worker", path, "--runs", str(runs)],
+            cwd=os.path.dirname(os.path.abspath(__file__)), env=env,
+            stdout=subprocess.PIPE, check=True, text=True,
+        ).stdout
+    return json.loads(output)
+
+
+def current_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True, text=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline, tolerance):
+    """Операции, ставшие медленнее или тяжелее baseline больше чем на tolerance."""
+    regressions = []
+    for size, measured in results["sizes"].items():
+        previous = baseline.get("sizes", {}).get(size)
+        if previous is None:
+            continue
+        for name, current in measured["operations"].items():
+            before = previous["operations"].get(name)
+            if before is None:
+                continue
+            for key, delta in (("median_ms", MIN_DELTA_MS), ("peak_kb", MIN_DELTA_KB)):
+                if current[key] > before[key] * (1 + tolerance) and current[key] - before[key] > delta:
+                    regressions.append((size, name, key, before[key], current[key]))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк панелей AvtoSell")
+    parser.add_argument("--sizes", default=",".join(map(str, SIZES)))
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--data-dir", default=os.path.join(tempfile.gettempdir(), "avtosell_bench"))
+    parser.add_argument("--output")
+    parser.add_argument("--baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        json.dump(run_panels(args.worker, args.runs), sys.stdout)
+        return
+
+    results = {
+        "commit": current_commit(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": sys.version.split()[0],
+        "sqlite": sqlite3.sqlite_version,
+        "runs": args.runs,
+        "sizes": {},
+    }
+    for rows in map(int, args.sizes.split(",")):
+        measured = results["sizes"][str(rows)] = run_size(database_path(args.data_dir, rows), args.runs)
+        print(f"{rows} машин, пик RSS {measured['max_rss_mb']:.0f} МБ, "
+              f"кэш миниатюр {measured.get('thumbnail_cache_mb', 0):.1f} МБ")
+        for name, values in measured["operations"].items():
+            print(f"  {name:32} {values['median_ms']:9.1f} мс (p95 {values['p95_ms']:.1f}, "
+                  f"первый {values['first_ms']:.1f}), пик {values['peak_kb']:.0f} КБ")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(results, file, ensure_ascii=False, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as file:
+            baseline = json.load(file)
+        regressions = compare(results, baseline, args.tolerance)
+        print(f"сравнение с {baseline.get('commit')}: регрессий {len(regressions)}")
+        for size, name, key, before, after in regressions:
+            print(f"  {size} {name} {key}: {before:.1f} -> {after:.1f}")
+        if regressions:
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,314 @@
+"""Нагрузочный тест сервера API: множество одновременных клиентов.
+
+Запуск: python bench_server.py [--rows 100000] [--clients 100] [--duration 20]
+        [--sellers-share 0.2] [--think-ms 0] [--batch-limit N]
+        [--data-dir каталог] [--output результат.json]
+
+Сервер запускается в отдельном процессе на копии базы bench_panels
+(продавцы seller*, покупатели buyer*, пароль bench). Клиенты — корутины
+asyncio в этом процессе, каждая со своим keep-alive соединением. Клиент
+входит под своим пользователем и до конца замера выполняет случайные
+операции: каталог и следующие страницы, фильтры и поиск, повтор уже
+прочитанного запроса с If-None-Match, опрос журнала изменений, покупку
+(покупатели) или добавление и снятие машин (продавцы).
+
+В отчете — запросы в секунду, задержки по операциям, доля ответов 304,
+ошибки и проверка, что ни одна машина не продана дважды и ни одна покупка
+не потеряна. Статистику пачек записей сервер печатает при остановке.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import signal
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from urllib.parse import urlencode, urlsplit
+
+from bench_panels import BUYERS, PASSWORD, SELLERS, database_path
+
+
+MAKES = ("Toyota", "BMW", "Lada", "Kia", "Hyundai", "Mercedes", "Audi", "Ford")
+SEARCHES = ("bmw", "camry автомат", "седан", "lada vesta", "дизель", "kia rio")
+
+# Операции клиентов и их веса
+BUYER_OPERATIONS = {
+    "catalogue": 15, "next_page": 15, "filter": 15, "search": 10,
+    "revalidate": 20, "poll_changes": 20, "buy": 5,
+}
+SELLER_OPERATIONS = {
+    "own_cars": 20, "catalogue": 10, "revalidate": 20, "poll_changes": 20, "add_car": 20, "delete_car": 10,
+}
+
+
+class Client:
+    """Минимальный HTTP/1.1 клиент с keep-alive поверх asyncio."""
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.token = None
+        self._reader = self._writer = None
+
+    async def request(self, method, path, body=None, etag=None):
+        """(статус, ETag, тело) ответа."""
+        if self._writer is None:
+            self._reader, self._writer = await asyncio.open_connection(self.host, self.port)
+        data = json.dumps(body).encode("utf-8") if body is not None else b""
+        lines = [f"{method} {path} HTTP/1.1", f"Host: {self.host}", f"Content-Length: {len(data)}"]
+        if self.token:
+            lines.append(f"Authorization: Bearer {self.token}")
+        if etag:
+            lines.append(f"If-None-Match: {etag}")
+        self._writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + data)
+        status = int((await self._reader.readline()).split()[1])
+        headers = {}
+        while True:
+            line = await self._reader.readline()
+            if line in (b"\r\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        length = int(headers.get("content-length", 0))
+        payload = await self._reader.readexactly(length) if length else b""
+        return status, headers.get("etag"), json.loads(payload) if payload else None
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+
+
+class LoadTest:
+    """Клиенты, их операции и собранные замеры."""
+
+    def __init__(self, url, clients, sellers_share, think_ms, seed=1):
+        parts = urlsplit(url)
+        self.host, self.port = parts.hostname, parts.port
+        self.clients = clients
+        self.sellers = max(1, int(clients * sellers_share)) if sellers_share else 0
+        self.think = think_ms / 1000
+        self.rng = random.Random(seed)
+        self.latencies = {}
+        self.statuses = {}
+        self.purchases = []
+
+    def record(self, operation, started, status):
+        self.latencies.setdefault(operation, []).append((time.perf_counter() - started) * 1000)
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+
+    async def call(self, client, operation, method, path, body=None, etag=None):
+        started = time.perf_counter()
+        status, tag, result = await client.request(method, path, body, etag)
+        self.record(operation, started, status)
+        return status, tag, result
+
+    async def login(self, number):
+        client = Client(self.host, self.port)
+        seller = number < self.sellers
+        login = f"seller{number % SELLERS}" if seller else f"buyer{number % BUYERS}"
+        status, _, result = await self.call(client, "login", "POST", "/login", {"login": login, "password": PASSWORD})
+        if status != 200:
+            raise RuntimeError(f"Вход {login} не удался: {result}")
+        client.token = result["token"]
+        return client, login, seller
+
+    async def run_client(self, client, login, seller, deadline, rng):
+        state = {"pages": {}, "after": None, "cars": [], "own": [], "seq": 0}
+        operations = SELLER_OPERATIONS if seller else BUYER_OPERATIONS
+        names, weights = list(operations), list(operations.values())
+        while time.monotonic() < deadline:
+            operation = rng.choices(names, weights)[0]
+            await getattr(self, f"op_{operation}")(client, login, state, rng)
+            if self.think:
+                await asyncio.sleep(rng.uniform(0, 2 * self.think))
+
+    async def get_cars(self, client, operation, state, params):
+        path = "/cars?" + urlencode(params)
+        status, tag, rows = await self.call(client, operation, "GET", path)
+        if status == 200:
+            state["pages"][path] = tag
+            if len(state["pages"]) > 50:
+                state["pages"].pop(next(iter(state["pages"])))
+            state["cars"] = [row[0] for row in rows if row[7] == 0]
+            state["after"] = (params, rows[-1]) if rows else None
+        return rows
+
+    async def op_catalogue(self, client, login, state, rng):
+        await self.get_cars(client, "catalogue", state, {"available_only": 1})
+
+    async def op_next_page(self, client, login, state, rng):
+        if state["after"] is None:
+            return await self.op_catalogue(client, login, state, rng)
+        params, last = state["after"]
+        params = dict(params)
+        order = params.get("order")
+        if order == "ASC":
+            params["after"] = json.dumps([last[4], last[0]])
+        elif order:
+            params["after"] = json.dumps([last[3], last[0]])
+        else:
+            params["after"] = json.dumps([last[0]])
+        await self.get_cars(client, "next_page", state, params)
+
+    async def op_filter(self, client, login, state, rng):
+        params = {"available_only": 1}
+        if rng.random() < 0.5:
+            params["make"] = rng.choice(MAKES)[:3]
+        else:
+            low = rng.randrange(100000, 3000000, 50000)
+            params.update(min_price=low, max_price=low + rng.choice((100000, 500000)), order="ASC")
+        await self.get_cars(client, "filter", state, params)
+
+    async def op_search(self, client, login, state, rng):
+        params = {"available_only": 1, "search": rng.choice(SEARCHES)}
+        if rng.random() < 0.5:
+            params["order"] = json.dumps([["year", "DESC"]])
+        await self.get_cars(client, "search", state, params)
+
+    async def op_revalidate(self, client, login, state, rng):
+        if not state["pages"]:
+            return await self.op_catalogue(client, login, state, rng)
+        path, tag = rng.choice(list(state["pages"].items()))
+        await self.call(client, "revalidate", "GET", path, etag=tag)
+
+    async def op_poll_changes(self, client, login, state, rng):
+        status, _, result = await self.call(client, "poll_changes", "GET", "/changes/last")
+        if status == 200 and result["seq"] != state["seq"]:
+            await self.call(client, "poll_changes", "GET", f"/changes?since={max(state['seq'], result['seq'] - 100)}")
+            state["seq"] = result["seq"]
+
+    async def op_buy(self, client, login, state, rng):
+        if not state["cars"]:
+            return await self.op_catalogue(client, login, state, rng)
+        car_id = rng.choice(state["cars"])
+        status, _, result = await self.call(client, "buy", "POST", f"/cars/{car_id}/buy")
+        if status == 200 and result["result"] == "purchased":
+            self.purchases.append((car_id, login))
+        state["cars"].remove(car_id)
+
+    async def op_own_cars(self, client, login, state, rng):
+        await self.get_cars(client, "own_cars", state, {"seller_login": login})
+
+    async def op_add_car(self, client, login, state, rng):
+        car = {"make": rng.choice(MAKES), "model": "Load", "year": rng.randint(1990, 2024),
+               "price": rng.randrange(100000, 5000000, 1000), "description": "нагрузочный тест"}
+        status, _, result = await self.call(client, "add_car", "POST", "/cars", car)
+        if status == 200:
+            state["own"].append(result["id"])
+
+    async def op_delete_car(self, client, login, state, rng):
+        if not state["own"]:
+            return await self.op_add_car(client, login, state, rng)
+        await self.call(client, "delete_car", "DELETE", f"/cars/{state['own'].pop()}")
+
+    async def run(self, duration):
+        # Входы идут до замера: scrypt на каждого клиента занял бы его начало
+        sessions = []
+        for start in range(0, self.clients, 50):
+            sessions += await asyncio.gather(*(self.login(number)
+                                               for number in range(start, min(start + 50, self.clients))))
+        logins = self.latencies.pop("login")
+        self.statuses.clear()
+        started = time.perf_counter()
+        deadline = time.monotonic() + duration
+        await asyncio.gather(*(self.run_client(client, login, seller, deadline, random.Random(self.rng.random()))
+                               for client, login, seller in sessions))
+        elapsed = time.perf_counter() - started
+        for client, _, _ in sessions:
+            client.close()
+        return logins, elapsed
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def check_purchases(path, purchases):
+    """(продано дважды, потеряно покупок) по ответам сервера и содержимому базы."""
+    bought = [car_id for car_id, _ in purchases]
+    stored = {}
+    connection = sqlite3.connect(path)
+    # Проданную машину продавец мог снять, и она уже в архиве
+    for table in ("cars_archive", "cars"):
+        for start in range(0, len(bought), 10000):
+            chunk = bought[start:start + 10000]
+            stored.update(connection.execute(
+                f"SELECT id, buyer_login FROM {table} WHERE id IN ({', '.join('?' * len(chunk))})", chunk
+            ).fetchall())
+    connection.close()
+    lost = sum(1 for car_id, login in purchases if stored.get(car_id) != login)
+    return len(bought) - len(set(bought)), lost
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест сервера API AvtoSell")
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--clients", type=int, default=100)
+    parser.add_argument("--duration", type=float, default=20)
+    parser.add_argument("--sellers-share", type=float, default=0.2)
+    parser.add_argument("--think-ms", type=float, default=0)
+    parser.add_argument("--batch-limit", type=int)
+    parser.add_argument("--data-dir", default=os.path.join(tempfile.gettempdir(), "avtosell_bench"))
+    parser.add_argument("--output")
+    args = parser.parse_args()
+
+    template = database_path(args.data_dir, args.rows)
+    directory = os.path.dirname(os.path.abspath(__file__))
+    with tempfile.TemporaryDirectory() as temporary:
+        path = os.path.join(temporary, "users.db")
+        shutil.copyfile(template, path)
+        command = [sys.executable, os.path.join(directory, "server.py"), "--db", path, "--port", "0"]
+        if args.batch_limit:
+            command += ["--batch-limit", str(args.batch_limit)]
+        server = subprocess.Popen(command, cwd=directory, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        try:
+            url = server.stdout.readline().split()[-1]
+            test = LoadTest(url, args.clients, args.sellers_share, args.think_ms)
+            logins, elapsed = asyncio.run(test.run(args.duration))
+        finally:
+            server.send_signal(signal.SIGINT)
+            server_report = server.communicate(timeout=60)[1].strip()
+        double_sales, lost_sales = check_purchases(path, test.purchases)
+
+    requests = sum(len(values) for values in test.latencies.values())
+    results = {
+        "rows": args.rows, "clients": args.clients, "duration_s": elapsed,
+        "requests_per_s": requests / elapsed,
+        "not_modified_share": test.statuses.get(304, 0) / requests if requests else 0.0,
+        "errors": {status: count for status, count in test.statuses.items() if status >= 400},
+        "login_ms": {"median": statistics.median(logins), "p95": percentile(logins, 0.95)},
+        "operations": {
+            name: {"count": len(values), "per_s": len(values) / elapsed, "median_ms": statistics.median(values),
+                   "p95_ms": percentile(values, 0.95), "p99_ms": percentile(values, 0.99)}
+            for name, values in sorted(test.latencies.items())
+        },
+        "purchases": len(test.purchases), "double_sales": double_sales, "lost_sales": lost_sales,
+        "server": server_report,
+    }
+
+    print(f"{args.clients} клиентов, {args.rows} машин, {elapsed:.1f} с")
+    print(f"  запросов в секунду: {results['requests_per_s']:,.0f}, ответов 304: "
+          f"{results['not_modified_share']:.0%}, ошибки: {results['errors'] or 'нет'}")
+    print(f"  вход: медиана {results['login_ms']['median']:.0f} мс, p95 {results['login_ms']['p95']:.0f} мс")
+    for name, values in results["operations"].items():
+        print(f"  {name:14} {values['per_s']:8.1f}/с  медиана {values['median_ms']:7.1f} мс  "
+              f"p95 {values['p95_ms']:7.1f}  p99 {values['p99_ms']:7.1f}")
+    print(f"  покупок: {results['purchases']}, продано дважды: {double_sales}, потеряно: {lost_sales}")
+    print(f"  сервер: {server_report}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(results, file, ensure_ascii=False, indent=2)
+    if double_sales or lost_sales:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
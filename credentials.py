@@ -0,0 +1,111 @@
+"""Хранение и проверка паролей.
+
+Пароли хранятся как соленый хеш scrypt в виде
+'scrypt$<n>$<r>$<p>$<соль>$<хеш>'. scrypt отпускает GIL, поэтому проверка
+в потоке пула не тормозит GUI. Пароли, сохраненные открытым текстом или с
+устаревшей стоимостью, перехешируются при первом успешном входе.
+
+Успешный вход запоминается на SESSION_TTL секунд: повторный вход тем же
+паролем (например, при смене роли) сверяется по быстрому HMAC и не
+пересчитывает scrypt.
+"""
+import base64
+import hashlib
+import hmac
+import os
+import threading
+import time
+
+
+# Стоимость scrypt: N=2**14, r=8 — около 16 МБ памяти и десятков мс на проверку
+SCRYPT_N = 2 ** 14
+SCRYPT_R = 8
+SCRYPT_P = 1
+SALT_SIZE = 16
+HASH_SIZE = 32
+
+# Сколько секунд действует проверенный вход
+SESSION_TTL = 300
+
+
+def _scrypt(password, salt, n, r, p):
+    return hashlib.scrypt(
+        password.encode("utf-8"), salt=salt, n=n, r=r, p=p, maxmem=256 * n * r, dklen=HASH_SIZE
+    )
+
+
+def _encode(data):
+    return base64.b64encode(data).decode("ascii")
+
+
+def hash_password(password, n=SCRYPT_N, r=SCRYPT_R, p=SCRYPT_P):
+    salt = os.urandom(SALT_SIZE)
+    return f"scrypt${n}${r}${p}${_encode(salt)}${_encode(_scrypt(password, salt, n, r, p))}"
+
+
+def verify_password(stored, password):
+    """Проверяет пароль. Возвращает (подходит ли, нужно ли перехешировать)."""
+    if not stored.startswith("scrypt$"):
+        # Пароль из старой версии, сохраненный открытым текстом
+        return hmac.compare_digest(stored.encode("utf-8"), password.encode("utf-8")), True
+    _, n, r, p, salt, expected = stored.split("$")
+    n, r, p = int(n), int(r), int(p)
+    digest = _scrypt(password, base64.b64decode(salt), n, r, p)
+    valid = hmac.compare_digest(digest, base64.b64decode(expected))
+    return valid, (n, r, p) != (SCRYPT_N, SCRYPT_R, SCRYPT_P)
+
+
+class Credentials:
+    """Регистрация и вход пользователей поверх Database.
+
+    Методы вычисляют scrypt и вызываются в потоке пула (QueryExecutor).
+    """
+
+    def __init__(self, db, session_ttl=SESSION_TTL):
+        self.db = db
+        self.session_ttl = session_ttl
+        # Ключ живет только в памяти процесса; по нему сверяются пароли в кэше входов
+        self._key = os.urandom(32)
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def _fingerprint(self, login, password):
+        return hmac.new(self._key, f"{login}\0{password}".encode("utf-8"), hashlib.sha256).digest()
+
+    def register(self, login, password, role):
+        """Добавляет пользователя. При занятом логине бросает sqlite3.IntegrityError."""
+        self.db.add_user(login, hash_password(password), role)
+
+    def authenticate(self, login, password):
+        """Строка пользователя (id, login, password, role) или None при неверном пароле."""
+        user = self.db.get_user(login)
+        if user is None:
+            return None
+
+        fingerprint = self._fingerprint(login, password)
+        with self._lock:
+            session = self._sessions.get(login)
+        # Кэш действителен, только пока хеш в базе тот же: смена пароля его сбрасывает
+        if (session is not None and session[2] > time.monotonic() and session[1] == user[2]
+                and hmac.compare_digest(session[0], fingerprint)):
+            return user
+
+        valid, outdated = verify_password(user[2], password)
+        if not valid:
+            return None
+        if outdated:
+            stored = hash_password(password)
+            if self.db.set_password(login, stored, user[2]):
+                user = (user[0], user[1], stored, user[3])
+
+        with self._lock:
+            self._sessions[login] = (fingerprint, user[2], time.monotonic() + self.session_ttl)
+        return user
+
+    def forget(self, login=None):
+        """Сбрасывает запомненный вход пользователя или всех пользователей."""
+        with self._lock:
+            if login is None:
+                self._sessions.clear()
+            else:
+                self._sessions.pop(login, None)
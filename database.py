@@ -0,0 +1,813 @@
+import random
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+import profiling
+from migrations import MARKET_STATS_REFRESH, PRICE_HISTORY_REFRESH, migrate, schema_version
+from search import match_expression
+
+
+DB_PATH = "users.db"
+
+CAR_COLUMNS = (
+    "cars.id, cars.make, cars.model, cars.year, cars.price, cars.description, cars.seller_login, cars.status, "
+    "cars.buyer_login"
+)
+
+# Поля строк, которые возвращают запросы с CAR_COLUMNS, в том же порядке
+CAR_FIELDS = ("id", "make", "model", "year", "price", "description", "seller_login", "status", "buyer_login")
+
+# Статусы машины в cars.status; в SQL они записаны числами, чтобы запросы
+# совпадали с условием частичных индексов (status = 0)
+AVAILABLE = 0
+SOLD = 1
+
+# Столбцы, по которым car_page умеет сортировать
+SORT_COLUMNS = {"make": "cars.make", "model": "cars.model", "year": "cars.year", "price": "cars.price"}
+
+# Настройки соединения применяются один раз при его открытии
+PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA cache_size = -16000",
+    "PRAGMA mmap_size = 268435456",
+    "PRAGMA busy_timeout = 5000",
+)
+
+# Надежность фиксации (PRAGMA synchronous). В режиме WAL при NORMAL фиксация
+# не ждет записи на диск: после сбоя питания могут пропасть последние
+# транзакции, но база останется целой. FULL ждет fsync журнала на каждую
+# фиксацию, поэтому частые мелкие записи стоит собирать в пачки (write_batch).
+SYNCHRONOUS = "NORMAL"
+SYNCHRONOUS_MODES = ("NORMAL", "FULL")
+
+# Сколько раз повторять запись, если база занята дольше busy_timeout,
+# и начальная пауза перед повтором в секундах (удваивается с каждой попыткой)
+WRITE_RETRIES = 5
+RETRY_DELAY = 0.05
+
+# С какого числа совпадений поиск с сортировкой идет по индексу сортировки,
+# а не досортировывает все совпадения
+SORTED_SEARCH_MATCHES = 5000
+
+# Столбцы cars, которые переносятся в cars_archive
+ARCHIVE_COLUMNS = "id, make, model, year, price, description, seller_login, status, buyer_login, sold_at"
+
+# Причины переноса машины в архив
+ARCHIVE_SOLD = "sold"
+ARCHIVE_DELETED = "deleted"
+
+# Через сколько секунд после продажи машина уходит в архив и сколько машин
+# переносится одной транзакцией (чтобы не держать блокировку записи долго)
+ARCHIVE_AFTER = 30 * 24 * 3600
+ARCHIVE_BATCH = 1000
+
+# Сколько свободных страниц возвращать системе одной транзакцией в compact
+# и сколько страниц индекса поиска сливать одной транзакцией
+COMPACT_PAGES = 2000
+SEARCH_MERGE_PAGES = 500
+
+# Результаты buy_car
+PURCHASED = "purchased"
+ALREADY_BOUGHT = "already_bought"
+NOT_AVAILABLE = "not_available"
+
+# Сколько последних записей журнала car_changes хранить
+CHANGE_LOG_KEEP = 100000
+
+# За сколько последних дней считать среднюю цену марки (тренд цены в каталоге)
+PRICE_TREND_DAYS = 30
+
+# Записи, которые можно выполнять пачкой в write_batch; у каждой есть метод
+# _write_<имя>, выполняющий ее в уже открытой транзакции
+WRITE_OPERATIONS = frozenset((
+    "add_user", "delete_user", "delete_users", "add_car", "add_cars", "delete_car", "delete_seller_car", "buy_car",
+    "add_car_photos",
+))
+
+
+def status_label(status, buyer_login=None):
+    """Текст статуса для показа."""
+    if status == SOLD:
+        return f"Куплено покупателем ({buyer_login})" if buyer_login else "Продано"
+    return "В продаже"
+
+
+def sort_keys(order):
+    """Ключи сортировки ((поле, 'ASC' | 'DESC'), ...) для order из car_page."""
+    if order in (None, "RANK"):
+        return ()
+    if order in ("ASC", "DESC"):
+        return (("price", order),)
+    return tuple(order)
+
+
+def keyset_condition(columns, directions, after, nullable=()):
+    """Условие "строка после ключа after" для сортировки по columns.
+
+    При одном направлении это сравнение кортежей. При разных направлениях —
+    раскрытая форма: первый столбец больше, или равен, а второй больше, и
+    т. д.; отдельное условие на первый столбец сохраняет поиск по индексу.
+
+    NULL в SQLite меньше любого значения: при ASC такие строки идут первыми,
+    при DESC — последними. None в after и столбцы из nullable, где бывает
+    NULL, раскрываются с учетом этого. Столбцы сортировки cars объявлены
+    NOT NULL, и для них условие остается простым сравнением.
+    """
+    if len(set(directions)) == 1 and not nullable and None not in after:
+        operator = ">" if directions[0] == "ASC" else "<"
+        return f"({', '.join(columns)}) {operator} ({', '.join('?' * len(columns))})", list(after)
+
+    def later(column, direction, value, inclusive=False):
+        # Значения столбца после value (inclusive — и равные ему); None — таких нет
+        if value is None:
+            if direction == "DESC":
+                return (f"{column} IS NULL", []) if inclusive else None
+            return ("1", []) if inclusive else (f"{column} IS NOT NULL", [])
+        operator = (">" if direction == "ASC" else "<") + ("=" if inclusive else "")
+        term = f"{column} {operator} ?"
+        if direction == "DESC" and column in nullable:
+            term = f"({term} OR {column} IS NULL)"
+        return term, [value]
+
+    alternatives, params = [], []
+    for position, (column, direction) in enumerate(zip(columns, directions)):
+        term = later(column, direction, after[position])
+        if term is None:
+            continue
+        terms = [f"{previous} IS NULL" if value is None else f"{previous} = ?"
+                 for previous, value in zip(columns, after[:position])]
+        alternatives.append(f"({' AND '.join(terms + [term[0]])})")
+        params.extend(value for value in after[:position] if value is not None)
+        params.extend(term[1])
+    if not alternatives:
+        return "0", []
+    bound, values = later(columns[0], directions[0], after[0], inclusive=True)
+    return f"{bound} AND ({' OR '.join(alternatives)})", values + params
+
+
+class Database:
+    """Слой доступа к данным: долгоживущие соединения вместо connect/close на каждый клик.
+
+    Каждому потоку выдается свое соединение, которое открывается один раз и
+    переиспользуется. SQL-запросы хранятся в виде констант, поэтому sqlite3
+    берет подготовленные выражения из своего кэша.
+    """
+
+    def __init__(self, path=DB_PATH, cached_statements=256, synchronous=SYNCHRONOUS):
+        if synchronous not in SYNCHRONOUS_MODES:
+            raise ValueError(f"Неизвестный режим synchronous: {synchronous}")
+        self.path = path
+        self.cached_statements = cached_statements
+        self.synchronous = synchronous
+        # Соединения по идентификатору потока. threading.local здесь не подходит:
+        # потоки QThreadPool получают новое состояние Python на каждый запуск задачи.
+        self._connections = {}
+        self._lock = threading.Lock()
+
+    @property
+    def connection(self):
+        thread_id = threading.get_ident()
+        connection = self._connections.get(thread_id)
+        if connection is None:
+            connection = self._connect()
+            with self._lock:
+                self._connections[thread_id] = connection
+        return connection
+
+    def _connect(self):
+        connection = sqlite3.connect(
+            self.path, cached_statements=self.cached_statements, check_same_thread=False,
+            factory=profiling.connection_factory(),
+        )
+        for pragma in PRAGMAS:
+            connection.execute(pragma)
+        connection.execute(f"PRAGMA synchronous = {self.synchronous}")
+        return connection
+
+    def close(self):
+        with self._lock:
+            for connection in self._connections.values():
+                connection.close()
+            self._connections.clear()
+
+    def execute(self, query, params=()):
+        return self.connection.execute(query, params)
+
+    def fetchall(self, query, params=()):
+        return self.connection.execute(query, params).fetchall()
+
+    def fetchone(self, query, params=()):
+        return self.connection.execute(query, params).fetchone()
+
+    @contextmanager
+    def transaction(self, immediate=False):
+        """Выполняет блок в одной транзакции: commit при успехе, rollback при ошибке.
+
+        immediate=True берет блокировку записи сразу (BEGIN IMMEDIATE), поэтому
+        чтение и запись внутри блока не пересекаются с другими писателями.
+        """
+        connection = self.connection
+        with connection:
+            if immediate:
+                connection.execute("BEGIN IMMEDIATE")
+            yield connection
+
+    def retry(self, func, *args):
+        """Вызывает func(*args), повторяя его, пока база занята другим писателем."""
+        for attempt in range(WRITE_RETRIES):
+            try:
+                return func(*args)
+            except sqlite3.OperationalError as error:
+                busy = error.sqlite_errorcode & 0xFF in (sqlite3.SQLITE_BUSY, sqlite3.SQLITE_LOCKED)
+                if not busy or attempt == WRITE_RETRIES - 1:
+                    raise
+            # Случайная добавка к паузе разводит повторы одновременных покупателей
+            time.sleep(RETRY_DELAY * 2 ** attempt * random.uniform(0.5, 1.5))
+
+    def initialize(self):
+        """Создает или обновляет схему до последней версии миграций."""
+        connection = self.connection
+        if schema_version(connection) == 0 and not connection.execute("SELECT 1 FROM sqlite_master").fetchone():
+            # Режим auto_vacuum дешево меняется только в пустой базе; с ним
+            # compact возвращает системе место, освобожденное удалениями
+            connection.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            connection.execute("VACUUM")
+        return migrate(connection)
+
+    def query_plan(self, query, params=()):
+        """Строки EXPLAIN QUERY PLAN для запроса."""
+        return [row[3] for row in self.fetchall(f"EXPLAIN QUERY PLAN {query}", params)]
+
+    # Пользователи
+
+    def get_user(self, login):
+        return self.fetchone("SELECT id, login, password, role FROM users WHERE login = ?", (login,))
+
+    def list_users(self):
+        return self.fetchall("SELECT id, login, role FROM users")
+
+    def user_page(self, after=None, limit=256, prefix=None, role=None):
+        """(id, логин, роль) пользователей по возрастанию логина после логина after.
+
+        prefix — начало логина (с учетом регистра), role — только эта роль.
+        Начало логина ищется диапазоном по индексу логина, а не LIKE, поэтому
+        каждая страница — поиск по индексу, а не проход по таблице.
+        """
+        conditions, params = [], []
+        if role is not None:
+            conditions.append("role = ?")
+            params.append(role)
+        if after is not None:
+            conditions.append("login > ?")
+            params.append(after)
+        if prefix:
+            conditions.append("login >= ? AND login < ?")
+            params += [prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)]
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        return self.fetchall(f"SELECT id, login, role FROM users {where} ORDER BY login LIMIT ?", (*params, limit))
+
+    def admin_ids(self, user_ids):
+        """id администраторов среди user_ids."""
+        user_ids = list(user_ids)
+        if not user_ids:
+            return []
+        placeholders = ", ".join("?" * len(user_ids))
+        rows = self.fetchall(f"SELECT id FROM users WHERE role = ? AND id IN ({placeholders})", ["Админ", *user_ids])
+        return [user_id for user_id, in rows]
+
+    def add_user(self, login, password, role):
+        """Добавляет пользователя с уже захешированным паролем (см. credentials).
+        При занятом логине бросает sqlite3.IntegrityError."""
+        with self.transaction() as connection:
+            self._write_add_user(connection, login, password, role)
+
+    def _write_add_user(self, connection, login, password, role):
+        connection.execute("INSERT INTO users (login, password, role) VALUES (?, ?, ?)", (login, password, role))
+
+    def set_password(self, login, password, old_password):
+        """Меняет сохраненный пароль, если он все еще равен old_password.
+        Возвращает False, если пароль успели изменить в другом месте."""
+        with self.transaction() as connection:
+            cursor = connection.execute(
+                "UPDATE users SET password = ? WHERE login = ? AND password = ?", (password, login, old_password)
+            )
+        return cursor.rowcount == 1
+
+    def delete_user(self, user_id):
+        with self.transaction() as connection:
+            self._write_delete_user(connection, user_id)
+
+    def _write_delete_user(self, connection, user_id):
+        connection.execute("DELETE FROM users WHERE id = ?", (user_id,))
+
+    def delete_users(self, user_ids):
+        """Удаляет пользователей одной транзакцией. Возвращает число удаленных."""
+        with self.transaction() as connection:
+            return self._write_delete_users(connection, user_ids)
+
+    def _write_delete_users(self, connection, user_ids):
+        return connection.executemany("DELETE FROM users WHERE id = ?", [(user_id,) for user_id in user_ids]).rowcount
+
+    # Машины. Списки возвращаются курсором, чтобы таблица читала их порциями.
+
+    def list_cars(self):
+        return self.execute(f"SELECT {CAR_COLUMNS} FROM cars")
+
+    def cars_by_seller(self, seller_login):
+        return self.execute(f"SELECT {CAR_COLUMNS} FROM cars WHERE seller_login = ?", (seller_login,))
+
+    def _car_conditions(self, available_only=False, make=None, min_price=None, max_price=None,
+                        seller_login=None):
+        conditions = []
+        params = []
+
+        if seller_login is not None:
+            conditions.append("cars.seller_login = ?")
+            params.append(seller_login)
+
+        if available_only:
+            conditions.append("cars.status = 0")
+        if make:
+            conditions.append("cars.make LIKE ?")
+            params.append(f"%{make}%")
+        if min_price is not None:
+            conditions.append("cars.price >= ?")
+            params.append(min_price)
+        if max_price is not None:
+            conditions.append("cars.price <= ?")
+            params.append(max_price)
+
+        return conditions, params
+
+    def filter_cars(self, make=None, min_price=None, max_price=None, order=None):
+        """Машины в продаже с фильтром по марке и цене; order — 'ASC', 'DESC' или None."""
+        conditions, params = self._car_conditions(True, make, min_price, max_price)
+        query = f"SELECT {CAR_COLUMNS} FROM cars WHERE {' AND '.join(conditions)}"
+        if order in ("ASC", "DESC"):
+            query += f" ORDER BY cars.price {order}"
+
+        return self.execute(query, params)
+
+    def count_matches(self, search, limit):
+        """Число машин, найденных полнотекстовым поиском, но не больше limit."""
+        match = match_expression(self.connection, search)
+        if not match:
+            return 0
+        return self.fetchone(
+            "SELECT count(*) FROM (SELECT rowid FROM cars_fts WHERE cars_fts MATCH ? LIMIT ?)", (match, limit)
+        )[0]
+
+    def frequent_search(self, search):
+        """Больше ли у поиска SORTED_SEARCH_MATCHES совпадений (см. car_page)."""
+        return self.count_matches(search, SORTED_SEARCH_MATCHES + 1) > SORTED_SEARCH_MATCHES
+
+    def car_page(self, after=None, limit=256, order=None, search=None, frequent=None, **filters):
+        """Страница машин с keyset-пагинацией.
+
+        order — ключи сортировки ((поле, 'ASC' | 'DESC'), ...) по полям из
+        SORT_COLUMNS; 'ASC'/'DESC' означает сортировку по цене. Строки с
+        равными ключами упорядочены по id в направлении первого ключа, без
+        order — просто по id. after — ключ последней строки предыдущей
+        страницы: значения полей сортировки и id.
+        search — полнотекстовый поиск по марке, модели и описанию (cars_fts);
+        frequent — результат frequent_search для него, если уже известен.
+        При order 'RANK' строки упорядочены по релевантности bm25; bm25 все равно
+        оценивает все совпадения, поэтому такие страницы адресуются смещением:
+        after — (число уже прочитанных строк,).
+        Остальные аргументы — фильтры, как у filter_cars, плюс available_only.
+        """
+        conditions, params = self._car_conditions(**filters)
+        match = match_expression(self.connection, search) if search else None
+        query = f"SELECT {CAR_COLUMNS} FROM cars"
+        key = "cars.id"
+        sort = sort_keys(order)
+
+        if match and sort:
+            # Частое слово выгоднее искать, идя по индексу сортировки и проверяя
+            # совпадение (унарный плюс не дает выбрать поиск по id), редкое —
+            # наоборот, через полнотекстовый индекс с досортировкой
+            if frequent is None:
+                frequent = self.frequent_search(search)
+            conditions.append(f"{'+' if frequent else ''}cars.id IN (SELECT rowid FROM cars_fts WHERE cars_fts MATCH ?)")
+            params.append(match)
+        elif match and order == "RANK":
+            query += (" JOIN (SELECT rowid, rank FROM cars_fts WHERE cars_fts MATCH ?) AS matches"
+                      " ON cars.id = matches.rowid")
+            params.insert(0, match)
+        elif match:
+            # Без сортировки по цене выборку ведет полнотекстовый индекс в порядке rowid
+            query = f"SELECT {CAR_COLUMNS} FROM cars_fts JOIN cars ON cars.id = cars_fts.rowid"
+            conditions.insert(0, "cars_fts MATCH ?")
+            params.insert(0, match)
+            key = "cars_fts.rowid"
+
+        if order == "RANK":
+            ordering = "matches.rank, cars.id" if match else "cars.id"
+        elif sort:
+            columns = [SORT_COLUMNS[field] for field, _ in sort] + ["cars.id"]
+            directions = [direction for _, direction in sort] + [sort[0][1]]
+            ordering = ", ".join(f"{column} {direction}" for column, direction in zip(columns, directions))
+            if after is not None:
+                condition, values = keyset_condition(columns, directions, after)
+                conditions.append(condition)
+                params.extend(values)
+        else:
+            ordering = key
+            if after is not None:
+                conditions.append(f"{key} > ?")
+                params.extend(after)
+
+        if conditions:
+            query += f" WHERE {' AND '.join(conditions)}"
+        query += f" ORDER BY {ordering} LIMIT ?"
+        params.append(limit)
+        if order == "RANK":
+            query += " OFFSET ?"
+            params.append(after[0] if after else 0)
+
+        return self.fetchall(query, params)
+
+    def cars_by_ids(self, ids, search=None, **filters):
+        """Машины с заданными id в том же порядке.
+
+        Удаленные машины и машины, не подходящие под фильтры (как у car_page),
+        пропускаются.
+        """
+        ids = list(ids)
+        if not ids:
+            return []
+        conditions, params = self._car_conditions(**filters)
+        conditions.append(f"cars.id IN ({', '.join('?' * len(ids))})")
+        params.extend(ids)
+        match = match_expression(self.connection, search) if search else None
+        if match:
+            conditions.append("cars.id IN (SELECT rowid FROM cars_fts WHERE cars_fts MATCH ?)")
+            params.append(match)
+        # id — не больше страницы, поэтому поиск по первичному ключу дешевле
+        # прохода по индексу статуса и цены, который иначе выбирает планировщик
+        rows = self.fetchall(
+            f"SELECT {CAR_COLUMNS} FROM cars NOT INDEXED WHERE {' AND '.join(conditions)}", params
+        )
+        by_id = {row[0]: row for row in rows}
+        return [by_id[car_id] for car_id in ids if car_id in by_id]
+
+    def available_price_index(self, after=None, limit=-1):
+        """(id, марка, цена) машин в продаже по возрастанию (цена, id) — для индекса в памяти.
+        after — (цена, id) последней прочитанной строки, limit — сколько строк (-1 — все)."""
+        if after is None:
+            return self.execute(
+                "SELECT id, make, price FROM cars WHERE status = 0 ORDER BY price, id LIMIT ?", (limit,)
+            )
+        return self.execute(
+            "SELECT id, make, price FROM cars WHERE status = 0 AND (price, id) > (?, ?) ORDER BY price, id LIMIT ?",
+            (*after, limit),
+        )
+
+    def available_cars_after(self, car_id):
+        """(id, марка, цена) машин в продаже с id больше car_id — догрузка
+        индекса в памяти после массового импорта."""
+        return self.execute("SELECT id, make, price FROM cars WHERE status = 0 AND id > ?", (car_id,))
+
+    def text_terms(self):
+        """Термины полнотекстового индекса из моделей и описаний, по возрастанию."""
+        return [term for term, in self.fetchall(
+            "SELECT DISTINCT term FROM cars_fts_columns WHERE col != 'make' ORDER BY term"
+        )]
+
+    # Фотографии
+
+    def add_car_photos(self, car_id, digests):
+        """Добавляет фотографии (хеши файлов photos.PhotoStore) в конец списка фотографий машины."""
+        with self.transaction() as connection:
+            self._write_add_car_photos(connection, car_id, digests)
+
+    def _write_add_car_photos(self, connection, car_id, digests):
+        first = connection.execute(
+            "SELECT coalesce(max(position) + 1, 0) FROM car_photos WHERE car_id = ?", (car_id,)
+        ).fetchone()[0]
+        connection.executemany(
+            "INSERT INTO car_photos (car_id, position, digest) VALUES (?, ?, ?)",
+            [(car_id, first + number, digest) for number, digest in enumerate(digests)],
+        )
+
+    def cover_photos(self, ids):
+        """{id машины: хеш первой фотографии} для тех машин из ids, у которых есть фотографии."""
+        ids = list(ids)
+        if not ids:
+            return {}
+        return dict(self.fetchall(
+            f"SELECT car_id, digest FROM car_photos WHERE position = 0 AND car_id IN ({', '.join('?' * len(ids))})",
+            ids,
+        ))
+
+    def photo_digests(self):
+        """Хеши всех фотографий, на которые ссылаются машины."""
+        return {digest for digest, in self.fetchall("SELECT DISTINCT digest FROM car_photos")}
+
+    # История цен
+
+    def price_history(self, car_id):
+        """[(время unixepoch, цена, статус), ...] машины по возрастанию времени."""
+        history, price = [], 0
+        for at, delta, status in self.fetchall(
+            "SELECT at, price_delta, status FROM price_history WHERE car_id = ? ORDER BY at", (car_id,)
+        ):
+            price += delta
+            history.append((at, price / 100, status))
+        return history
+
+    def make_average_price(self, make, days=PRICE_TREND_DAYS):
+        """Средняя цена предложений марки (новых машин и новых цен) за последние
+        days дней или None, если их не было."""
+        return self.fetchone(
+            "SELECT sum(price_sum) / sum(offers) FROM price_days WHERE make = ? AND day > ?",
+            (make, int(time.time()) // 86400 - days),
+        )[0]
+
+    def make_average_prices(self, days=PRICE_TREND_DAYS):
+        """{марка: средняя цена предложений за последние days дней} по всем маркам."""
+        return dict(self.fetchall(
+            "SELECT make, sum(price_sum) / sum(offers) FROM price_days WHERE day > ? GROUP BY make",
+            (int(time.time()) // 86400 - days,),
+        ))
+
+    # Статистика
+
+    def market_summary(self, seller_limit=200):
+        """Сводки статистики, прочитанные в одной транзакции:
+
+        - (марка, год, в продаже ли, машин, сумма цен);
+        - (марка, год, число корзин цены) по возрастанию марки и года;
+        - (корзина цены, машин) для этих групп подряд, по возрастанию корзины;
+        - (продавец, в продаже, продано, выручка) для seller_limit продавцов
+          с наибольшими продажами.
+
+        Корзины читаются без марки и года: так их десятки тысяч строк
+        читаются заметно быстрее.
+        """
+        with self.transaction() as connection:
+            # Без явного BEGIN каждый SELECT видел бы свой снимок базы
+            connection.execute("BEGIN")
+            groups = connection.execute(
+                "SELECT make, year, available, cars_count, price_sum FROM market_stats"
+            ).fetchall()
+            price_groups = connection.execute(
+                "SELECT make, year, count(*) FROM market_prices GROUP BY make, year ORDER BY make, year"
+            ).fetchall()
+            prices = connection.execute(
+                "SELECT bucket, cars_count FROM market_prices ORDER BY make, year, bucket"
+            ).fetchall()
+            sellers = connection.execute("""
+                SELECT seller_login,
+                       sum(CASE WHEN available THEN cars_count ELSE 0 END) AS on_sale,
+                       sum(CASE WHEN available THEN 0 ELSE cars_count END) AS sold,
+                       sum(CASE WHEN available THEN 0 ELSE price_sum END) AS revenue
+                FROM seller_stats GROUP BY seller_login
+                ORDER BY sold DESC, revenue DESC, seller_login LIMIT ?
+            """, (seller_limit,)).fetchall()
+        return groups, price_groups, prices, sellers
+
+    # Журнал изменений
+
+    def data_version(self):
+        """Меняется, когда другое соединение фиксирует изменения в базе."""
+        return self.fetchone("PRAGMA data_version")[0]
+
+    def last_change_seq(self):
+        return self.fetchone("SELECT coalesce(max(seq), 0) FROM car_changes")[0]
+
+    def car_changes_since(self, seq):
+        return self.fetchall(
+            "SELECT seq, car_id, op, old_make, old_price, old_status FROM car_changes WHERE seq > ? ORDER BY seq",
+            (seq,),
+        )
+
+    def prune_car_changes(self, up_to_seq):
+        with self.transaction() as connection:
+            connection.execute("DELETE FROM car_changes WHERE seq <= ?", (up_to_seq,))
+
+    def add_car(self, make, model, year, price, description, seller_login):
+        with self.transaction() as connection:
+            return self._write_add_car(connection, make, model, year, price, description, seller_login)
+
+    def _write_add_car(self, connection, make, model, year, price, description, seller_login):
+        return connection.execute("""
+            INSERT INTO cars (make, model, year, price, description, seller_login, status)
+            VALUES (?, ?, ?, ?, ?, ?, 0)
+        """, (make, model, year, price, description, seller_login)).lastrowid
+
+    def add_cars(self, cars):
+        """Добавляет пачку машин (make, model, year, price, description, seller_login)
+        одной транзакцией. Возвращает число добавленных.
+
+        Построчные триггеры на время вставки отключаются через bulk_load:
+        полнотекстовый индекс и сводки статистики заполняются запросами
+        INSERT ... SELECT по всей пачке, как и история цен, а в журнал
+        изменений пишется одна запись 'reset' вместо записи на каждую машину.
+        """
+        return self.retry(self._add_cars, cars)
+
+    def _add_cars(self, cars):
+        with self.transaction(immediate=True) as connection:
+            return self._write_add_cars(connection, cars)
+
+    def _write_add_cars(self, connection, cars):
+        # С AUTOINCREMENT id новых машин больше любого уже выданного
+        last_id = connection.execute("SELECT coalesce(max(id), 0) FROM cars").fetchone()[0]
+        connection.execute("INSERT INTO bulk_load (active) VALUES (1)")
+        count = connection.executemany("""
+            INSERT INTO cars (make, model, year, price, description, seller_login, status)
+            VALUES (?, ?, ?, ?, ?, ?, 0)
+        """, cars).rowcount
+        connection.execute("DELETE FROM bulk_load")
+        connection.execute("""
+            INSERT INTO cars_fts (rowid, make, model, description)
+            SELECT id, make, model, description FROM cars WHERE id > ?
+        """, (last_id,))
+        for statement in MARKET_STATS_REFRESH + PRICE_HISTORY_REFRESH:
+            connection.execute(statement, (last_id,))
+        connection.execute("INSERT INTO car_changes (car_id, op) VALUES (0, 'reset')")
+        return count
+
+    def _move_to_archive(self, connection, ids, reason):
+        placeholders = ", ".join("?" * len(ids))
+        connection.execute(f"""
+            INSERT INTO cars_archive ({ARCHIVE_COLUMNS}, archived_at, reason)
+            SELECT {ARCHIVE_COLUMNS}, ?, ? FROM cars WHERE id IN ({placeholders})
+        """, (time.time(), reason, *ids))
+        connection.execute(f"DELETE FROM cars WHERE id IN ({placeholders})", ids)
+        # Фотографии в архив не переносятся; их файлы удалит maintain
+        connection.execute(f"DELETE FROM car_photos WHERE car_id IN ({placeholders})", ids)
+
+    def delete_car(self, car_id):
+        """Снимает машину: она переносится в cars_archive и пропадает из списков и статистики."""
+        with self.transaction() as connection:
+            self._write_delete_car(connection, car_id)
+
+    def _write_delete_car(self, connection, car_id):
+        self._move_to_archive(connection, (car_id,), ARCHIVE_DELETED)
+
+    def delete_seller_car(self, car_id, seller_login):
+        """Удаляет машину продавца. Возвращает False, если машина принадлежит другому продавцу."""
+        with self.transaction(immediate=True) as connection:
+            return self._write_delete_seller_car(connection, car_id, seller_login)
+
+    def _write_delete_seller_car(self, connection, car_id, seller_login):
+        car = connection.execute("SELECT seller_login FROM cars WHERE id = ?", (car_id,)).fetchone()
+        if car and car[0] != seller_login:
+            return False
+        self._move_to_archive(connection, (car_id,), ARCHIVE_DELETED)
+        return True
+
+    # Архив и обслуживание файла базы
+
+    def archive_sold_cars(self, older_than=ARCHIVE_AFTER, batch=ARCHIVE_BATCH):
+        """Переносит в cars_archive машины, проданные больше older_than секунд
+        назад, порциями по batch машин в отдельных транзакциях.
+        Возвращает число перенесенных машин.
+
+        Перенесенные машины остаются в сводках статистики (см. archiving в
+        миграции add_cars_archive), а в журнал изменений попадают как удаления.
+        """
+        cutoff = time.time() - older_than
+        total = 0
+        while True:
+            moved = self.retry(self._archive_batch, cutoff, batch)
+            total += moved
+            if moved < batch:
+                return total
+
+    def _archive_batch(self, cutoff, batch):
+        with self.transaction(immediate=True) as connection:
+            ids = [row[0] for row in connection.execute(
+                "SELECT id FROM cars WHERE buyer_login IS NOT NULL AND coalesce(sold_at, 0) <= ? LIMIT ?",
+                (cutoff, batch),
+            )]
+            if not ids:
+                return 0
+            connection.execute("INSERT INTO archiving (active) VALUES (1)")
+            self._move_to_archive(connection, ids, ARCHIVE_SOLD)
+            connection.execute("DELETE FROM archiving")
+        return len(ids)
+
+    def merge_search_index(self, pages=SEARCH_MERGE_PAGES):
+        """Сливает сегменты полнотекстового индекса порциями по pages страниц,
+        каждую в своей транзакции, пока индекс не станет одним сегментом.
+
+        Удаление из fts5 не стирает строку, а дописывает отметку об удалении;
+        пока отметки не слиты с сегментами, поиск читает и их, поэтому после
+        переноса в архив большой пачки машин поиск замедляется в разы.
+        """
+        connection = self.connection
+        while True:
+            changes = connection.total_changes
+            with self.transaction(immediate=True):
+                # Отрицательное число — сливать все уровни, как optimize, но понемногу
+                connection.execute("INSERT INTO cars_fts (cars_fts, rank) VALUES ('merge', ?)", (-pages,))
+            # Меньше двух изменений — сливать уже нечего
+            if connection.total_changes - changes < 2:
+                return
+
+    def compact(self, max_pages=COMPACT_PAGES, rebuild=False):
+        """Возвращает системе до max_pages (None — все) свободных страниц файла
+        порциями по COMPACT_PAGES. Возвращает число освобожденных страниц.
+
+        Базе, созданной без auto_vacuum = INCREMENTAL, это доступно только после
+        полной перезаписи VACUUM: она выполняется при rebuild=True и держит
+        базу заблокированной, пока идет.
+        """
+        connection = self.connection
+        if connection.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            if not rebuild:
+                return 0
+            free = connection.execute("PRAGMA freelist_count").fetchone()[0]
+            connection.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            connection.execute("VACUUM")
+            return free
+        freed = 0
+        while max_pages is None or freed < max_pages:
+            step = COMPACT_PAGES if max_pages is None else min(COMPACT_PAGES, max_pages - freed)
+            pages = self.retry(self._vacuum_pages, step)
+            freed += pages
+            if pages < step:
+                break
+        return freed
+
+    def _vacuum_pages(self, pages):
+        with self.transaction(immediate=True) as connection:
+            pages = min(pages, connection.execute("PRAGMA freelist_count").fetchone()[0])
+            # sqlite3 делает у прагмы без столбцов результата один шаг, а шаг
+            # incremental_vacuum освобождает одну страницу
+            for _ in range(pages):
+                connection.execute("PRAGMA incremental_vacuum(1)")
+        return pages
+
+    def maintain(self, photos=None):
+        """Плановое обслуживание: архив проданных машин, удаление файлов
+        фотографий, на которые больше не ссылается ни одна машина (photos —
+        photos.PhotoStore), и сжатие файла.
+        Возвращает (перенесено машин, освобождено страниц)."""
+        archived = self.archive_sold_cars()
+        # Слияние переписывает весь индекс поиска, поэтому только после большой пачки
+        if archived >= ARCHIVE_BATCH:
+            self.merge_search_index()
+        if photos is not None:
+            photos.sweep(self.photo_digests())
+        return archived, self.compact()
+
+    def buy_car(self, car_id, buyer_login):
+        """Оформляет покупку. Возвращает PURCHASED, ALREADY_BOUGHT, если машина
+        уже куплена этим покупателем, или NOT_AVAILABLE, если ее продали другому
+        или сняли с продажи.
+
+        Машина продается условным UPDATE по статусу AVAILABLE в транзакции
+        BEGIN IMMEDIATE, поэтому даже при одновременных покупках из разных
+        процессов ее покупает ровно один покупатель.
+        """
+        return self.retry(self._buy_car, car_id, buyer_login)
+
+    def _buy_car(self, car_id, buyer_login):
+        with self.transaction(immediate=True) as connection:
+            return self._write_buy_car(connection, car_id, buyer_login)
+
+    def _write_buy_car(self, connection, car_id, buyer_login):
+        cursor = connection.execute("""
+            UPDATE cars
+            SET status = 1, buyer_login = ?, sold_at = ?
+            WHERE id = ? AND status = 0
+        """, (buyer_login, time.time(), car_id))
+        if cursor.rowcount:
+            return PURCHASED
+        car = connection.execute("SELECT buyer_login FROM cars WHERE id = ?", (car_id,)).fetchone()
+        return ALREADY_BOUGHT if car and car[0] == buyer_login else NOT_AVAILABLE
+
+    def write_batch(self, operations):
+        """Выполняет записи [(имя, аргументы), ...] одной транзакцией (group commit):
+        вместо фиксации на каждую запись — одна на всю пачку.
+
+        Имена — из WRITE_OPERATIONS, аргументы — как у одноименных методов.
+        Каждая запись идет в своей точке сохранения: запись, нарушившая
+        ограничение базы, откатывается одна, и вместо ее результата в списке
+        стоит исключение sqlite3.IntegrityError. Возвращает результаты в
+        порядке записей.
+        """
+        for name, _ in operations:
+            if name not in WRITE_OPERATIONS:
+                raise ValueError(f"Неизвестная запись: {name}")
+        return self.retry(self._write_batch, operations)
+
+    def _write_batch(self, operations):
+        results = []
+        with self.transaction(immediate=True) as connection:
+            for name, args in operations:
+                connection.execute("SAVEPOINT write")
+                try:
+                    results.append(getattr(self, f"_write_{name}")(connection, *args))
+                except sqlite3.IntegrityError as error:
+                    connection.execute("ROLLBACK TO write")
+                    results.append(error)
+                connection.execute("RELEASE write")
+        return results
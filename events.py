@@ -0,0 +1,66 @@
+from collections import namedtuple
+
+from PyQt6.QtCore import QObject, QTimer, pyqtSignal
+
+from database import CHANGE_LOG_KEEP
+
+
+CarChange = namedtuple("CarChange", "seq car_id op old_make old_price old_status")
+
+# Больше изменений за раз дешевле показать полной перезагрузкой, чем точечно
+CHANGE_BATCH_LIMIT = 500
+
+
+class ChangeBus(QObject):
+    """Шина изменений таблицы cars.
+
+    Изменения читаются из журнала car_changes, который ведут триггеры, поэтому
+    шина видит и свои записи, и записи других процессов. Свои записи
+    публикуются вызовом poll(force=True) сразу после них, чужие замечаются
+    по PRAGMA data_version при периодическом опросе.
+
+    cars_changed получает список CarChange. reset означает, что изменений
+    слишком много, часть журнала уже удалена или был массовый импорт, и
+    данные нужно перечитать.
+    """
+
+    cars_changed = pyqtSignal(object)
+    reset = pyqtSignal()
+
+    def __init__(self, db, parent=None, interval_ms=1000):
+        super().__init__(parent)
+        self.db = db
+        self._seq = db.last_change_seq()
+        self._data_version = db.data_version()
+        self._pruned_seq = self._seq
+        self.timer = QTimer(self)
+        self.timer.setInterval(interval_ms)
+        self.timer.timeout.connect(self.poll)
+        self.timer.start()
+
+    @property
+    def seq(self):
+        """Последняя опубликованная запись журнала car_changes."""
+        return self._seq
+
+    def poll(self, force=False):
+        version = self.db.data_version()
+        if not force and version == self._data_version:
+            return
+        self._data_version = version
+
+        changes = [CarChange(*row) for row in self.db.car_changes_since(self._seq)]
+        if not changes:
+            return
+        gap = changes[0].seq > self._seq + 1
+        self._seq = changes[-1].seq
+
+        # Запись 'reset' оставляет массовый импорт вместо записи на каждую машину
+        if gap or len(changes) > CHANGE_BATCH_LIMIT or any(change.op == "reset" for change in changes):
+            self.reset.emit()
+        else:
+            self.cars_changed.emit(changes)
+
+        if self._seq - self._pruned_seq > CHANGE_LOG_KEEP // 10:
+            self.db.prune_car_changes(self._seq - CHANGE_LOG_KEEP)
+            self._pruned_seq = self._seq
@@ -0,0 +1,489 @@
+"""Индекс каталога в памяти для живой фильтрации по мере ввода.
+
+Машины в продаже хранятся парами (цена, id), отсортированными по цене:
+общий столбец и по столбцу на каждую марку. Диапазон цен в столбце — это
+два bisect, а результат по нескольким маркам собирается ленивым слиянием,
+поэтому нажатие клавиши стоит O(число марок · log n), а строки
+материализуются только для видимых страниц.
+
+Одно слово в поле поиска индекс ищет среди терминов марок, разобранных
+токенизатором cars_fts, и только если ни один термин моделей и описаний
+(cars_fts_columns) не начинается с этого слова: тогда полнотекстовый поиск
+нашел бы те же машины. Остальной текст (несколько слов, модели, описания,
+опечатки) ищет полнотекстовый поиск базы.
+
+Индекс сохраняется снимком рядом с файлом базы: столбцы лежат в файле
+как массивы фиксированной ширины и при запуске отображаются в память
+(mmap) без разбора строк, а изменения после снимка догоняются по журналу
+car_changes. Столбец, который меняется, копируется в память целиком.
+
+Снимок — кэш этого индекса, а не копия каталога: в нем цены и id машин
+в продаже, названия марок и термины моделей и описаний. Года, статуса,
+моделей и продавцов в нем нет, поэтому строки каждой видимой страницы
+(и первой тоже) читаются из базы по id (cars_by_ids), а без базы каталог
+не открывается. От прохода по cars при запуске снимок избавляет только
+построение индекса.
+"""
+import heapq
+import mmap
+import os
+import struct
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+from itertools import islice
+
+from database import AVAILABLE
+from events import CarChange
+from models import CarColumnStore
+from paging import KeysetPager
+from search import TOKEN_RE, tokenize
+
+
+SNAPSHOT_SUFFIX = ".catalogue"
+SNAPSHOT_MAGIC = b"AVTOCAT3"
+# Метка, номер записи журнала, машин в общем столбце, марок, машин в столбцах
+# марок, терминов моделей и описаний (-1 — словарь не известен)
+SNAPSHOT_HEADER = struct.Struct("<8sqqqqq")
+
+# Снимок перезаписывается, если при загрузке пришлось догнать больше изменений
+SNAPSHOT_REWRITE = 10000
+
+# Сколько id читать из базы за один запрос при применении изменений
+CHANGE_CHUNK = 5000
+
+
+def snapshot_path(db):
+    """Файл снимка индекса рядом с файлом базы; у RemoteDatabase файла нет."""
+    path = getattr(db, "path", None)
+    return path + SNAPSHOT_SUFFIX if path else None
+
+
+class PriceColumn:
+    """Пары (цена, id), отсортированные по цене, а при равной цене — по id.
+
+    prices и ids — array или memoryview над снимком; столбец не меняется
+    на месте, изменения дают новый столбец (edited).
+    """
+
+    def __init__(self, prices=None, ids=None):
+        self.prices = array("d") if prices is None else prices
+        self.ids = array("q") if ids is None else ids
+
+    def __len__(self):
+        return len(self.ids)
+
+    def append(self, price, car_id):
+        self.prices.append(price)
+        self.ids.append(car_id)
+
+    def extend(self, column, start, stop):
+        """Дописывает пары column[start:stop] копированием памяти."""
+        self.prices.frombytes(memoryview(column.prices)[start:stop].cast("B"))
+        self.ids.frombytes(memoryview(column.ids)[start:stop].cast("B"))
+
+    def position(self, price, car_id, inclusive=False):
+        """Позиция первой пары после (price, car_id), а если inclusive=False —
+        первой пары не меньше нее."""
+        start = bisect_left(self.prices, price)
+        stop = bisect_right(self.prices, price, start)
+        search = bisect_right if inclusive else bisect_left
+        return start + search(self.ids[start:stop], car_id)
+
+    def holds(self, position, price, car_id):
+        return position < len(self.ids) and self.ids[position] == car_id and self.prices[position] == price
+
+    def edited(self, removed, added):
+        """Новый столбец без пар removed и с парами added.
+
+        Отсутствующие пары не удаляются, а имеющиеся не добавляются второй
+        раз, поэтому повторное применение тех же изменений безвредно. Новый
+        столбец собирается из кусков старого, и пачка из k изменений стоит
+        одно копирование плюс O(k log n), а не k сдвигов массива.
+        """
+        dropped = set()
+        for price, car_id in removed:
+            position = self.position(price, car_id)
+            if self.holds(position, price, car_id):
+                dropped.add(position)
+        inserted = {}
+        for price, car_id in sorted(set(added)):
+            position = self.position(price, car_id)
+            if position not in dropped and self.holds(position, price, car_id):
+                continue
+            inserted.setdefault(position, []).append((price, car_id))
+        if not dropped and not inserted:
+            return self
+
+        column = PriceColumn()
+        start = 0
+        for position in sorted(dropped | inserted.keys()):
+            column.extend(self, start, position)
+            for price, car_id in inserted.get(position, ()):
+                column.append(price, car_id)
+            start = position + 1 if position in dropped else position
+        column.extend(self, start, len(self))
+        return column
+
+    def range(self, min_price=None, max_price=None):
+        start = 0 if min_price is None else bisect_left(self.prices, min_price)
+        stop = len(self.prices) if max_price is None else bisect_right(self.prices, max_price)
+        return start, max(start, stop)
+
+    def pairs(self, start, stop, descending=False):
+        if descending:
+            return ((-self.prices[i], -self.ids[i]) for i in range(stop - 1, start - 1, -1))
+        return ((self.prices[i], self.ids[i]) for i in range(start, stop))
+
+
+class FilterResult:
+    """Результат фильтра: марки и диапазон цены над индексом.
+
+    Строки читаются по ключу (цена, id) последней прочитанной строки из
+    текущих столбцов индекса, поэтому изменения индекса после запроса
+    видны при дальнейшей прокрутке. Индекс не меняет столбцы на месте,
+    а заменяет их копиями, так что чтение не мешает обновлению.
+    makes=None — все машины.
+    """
+
+    def __init__(self, index, makes, min_price=None, max_price=None, descending=False, length=0):
+        self.index = index
+        self.makes = makes
+        self.min_price = min_price
+        self.max_price = max_price
+        self.descending = descending
+        self.length = length
+
+    def __len__(self):
+        return self.length
+
+    def ids(self, after=None):
+        """id по порядку цены, начиная после ключа after = (цена, id)."""
+        slices = []
+        for column in self.index.columns(self.makes):
+            start, stop = column.range(self.min_price, self.max_price)
+            if after is not None and self.descending:
+                stop = min(stop, column.position(*after))
+            elif after is not None:
+                start = max(start, column.position(*after, inclusive=True))
+            if stop > start:
+                slices.append(column.pairs(start, stop, self.descending))
+        if not slices:
+            return iter(())
+        merged = slices[0] if len(slices) == 1 else heapq.merge(*slices)
+        sign = -1 if self.descending else 1
+        return (sign * car_id for _, car_id in merged)
+
+
+class CatalogueIndex:
+    """Индекс машин в продаже: общий столбец цен и столбцы по маркам.
+
+    make_terms — термины cars_fts каждой марки, text_terms — отсортированные
+    термины моделей и описаний или None, если словаря нет (RemoteDatabase):
+    тогда индекс отвечает только на фильтры без текста.
+    seq — последняя запись журнала car_changes, которую индекс уже учел.
+    """
+
+    def __init__(self):
+        self.all = PriceColumn()
+        self.by_make = {}
+        self.make_terms = {}
+        self.text_terms = None
+        self.seq = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def build(cls, db):
+        index = cls()
+        # Номер журнала читается до прохода: изменения, которые проход уже
+        # увидел, применятся повторно, а это безвредно
+        index.seq = db.last_change_seq()
+        if snapshot_path(db) is not None:
+            index.text_terms = db.text_terms()
+        for car_id, make, price in db.available_price_index():
+            index.all.append(price, car_id)
+            column = index.by_make.get(make)
+            if column is None:
+                column = index.by_make[make] = PriceColumn()
+            column.append(price, car_id)
+        index.make_terms = dict(zip(index.by_make, tokenize(index.by_make)))
+        return index
+
+    @classmethod
+    def load(cls, db):
+        """Индекс из снимка, догнанный по журналу изменений, а если снимка нет
+        или журнал его уже не покрывает — построенный по базе. Новый или
+        заметно отставший снимок перезаписывается."""
+        path = snapshot_path(db)
+        if path is None:
+            return cls.build(db)
+        index = cls.from_snapshot(path)
+        changed = None
+        # Номер больше последнего в журнале — снимок от другой базы
+        if index is not None and index.seq <= db.last_change_seq():
+            changed = index.catch_up(db)
+        if changed is None:
+            index = cls.build(db)
+        if changed is None or changed > SNAPSHOT_REWRITE:
+            index.save(path)
+        return index
+
+    @classmethod
+    def from_snapshot(cls, path):
+        """Индекс над отображенным в память снимком или None, если снимка нет
+        или он поврежден."""
+        try:
+            with open(path, "rb") as file:
+                snapshot = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            magic, seq, count, make_count, make_rows, term_count = SNAPSHOT_HEADER.unpack_from(snapshot)
+        except (OSError, ValueError, struct.error):
+            return None
+        if magic != SNAPSHOT_MAGIC:
+            return None
+        view = memoryview(snapshot)
+        offset = SNAPSHOT_HEADER.size
+
+        def section(typecode, length):
+            nonlocal offset
+            start, offset = offset, offset + 8 * length
+            return view[start:offset].cast(typecode)
+
+        try:
+            prices, ids = section("d", count), section("q", count)
+            make_prices, make_ids = section("d", make_rows), section("q", make_rows)
+            bounds, name_ends = section("q", make_count + 1), section("q", make_count + 1)
+            term_ends = section("q", term_count + 1) if term_count >= 0 else array("q", [0])
+            strings = bytes(view[offset:])
+            if len(ids) != count or bounds[-1] != make_rows or len(strings) != name_ends[-1] + term_ends[-1]:
+                return None
+        except (TypeError, ValueError, IndexError):
+            return None
+
+        index = cls()
+        index.seq = seq
+        index.all = PriceColumn(prices, ids)
+        names, terms = strings[:name_ends[-1]], strings[name_ends[-1]:]
+        for number in range(make_count):
+            make = names[name_ends[number]:name_ends[number + 1]].decode("utf-8")
+            start, stop = bounds[number], bounds[number + 1]
+            index.by_make[make] = PriceColumn(make_prices[start:stop], make_ids[start:stop])
+        index.make_terms = dict(zip(index.by_make, tokenize(index.by_make)))
+        if term_count >= 0:
+            index.text_terms = [terms[term_ends[number]:term_ends[number + 1]].decode("utf-8")
+                                for number in range(term_count)]
+        return index
+
+    def save(self, path):
+        """Записывает снимок: во временный файл, который затем подменяет прежний."""
+        with self._lock:
+            all_column, seq, text_terms = self.all, self.seq, self.text_terms
+            columns = [(make.encode("utf-8"), column) for make, column in self.by_make.items()]
+        terms = [term.encode("utf-8") for term in text_terms or ()]
+        bounds, name_ends, term_ends = array("q", [0]), array("q", [0]), array("q", [0])
+        for name, column in columns:
+            bounds.append(bounds[-1] + len(column))
+            name_ends.append(name_ends[-1] + len(name))
+        for term in terms:
+            term_ends.append(term_ends[-1] + len(term))
+        term_count = len(terms) if text_terms is not None else -1
+
+        partial = path + ".partial"
+        try:
+            with open(partial, "wb") as file:
+                file.write(SNAPSHOT_HEADER.pack(
+                    SNAPSHOT_MAGIC, seq, len(all_column), len(columns), bounds[-1], term_count
+                ))
+                file.write(all_column.prices)
+                file.write(all_column.ids)
+                for _, column in columns:
+                    file.write(column.prices)
+                for _, column in columns:
+                    file.write(column.ids)
+                file.write(bounds)
+                file.write(name_ends)
+                if text_terms is not None:
+                    file.write(term_ends)
+                for name, _ in columns:
+                    file.write(name)
+                for term in terms:
+                    file.write(term)
+            os.replace(partial, path)
+        except OSError:
+            # Снимок — только ускорение запуска; без него индекс строится по базе
+            if os.path.exists(partial):
+                os.remove(partial)
+
+    def __len__(self):
+        return len(self.all)
+
+    def add(self, car_id, make, price):
+        self.update([], [(car_id, make, price)])
+
+    def remove(self, car_id, make, price):
+        self.update([(car_id, make, price)], [])
+
+    def update(self, removed, added):
+        """Убирает и добавляет тройки (id, марка, цена).
+
+        Затронутые столбцы пересобираются один раз на весь пакет изменений и
+        подменяются под блокировкой, чтобы уже выданные FilterResult не
+        видели изменений посреди чтения.
+        """
+        edits = {}
+        for car_id, make, price in removed:
+            for key in (None, make):
+                edits.setdefault(key, ([], []))[0].append((price, car_id))
+        for car_id, make, price in added:
+            for key in (None, make):
+                edits.setdefault(key, ([], []))[1].append((price, car_id))
+        if not edits:
+            return
+        # Новые марки разбираются токенизатором до блокировки
+        new_makes = [make for make in edits if make is not None and make not in self.make_terms]
+        make_terms = dict(zip(new_makes, tokenize(new_makes)))
+        with self._lock:
+            self.make_terms.update(make_terms)
+            for key, (gone, new) in edits.items():
+                if key is None:
+                    self.all = self.all.edited(gone, new)
+                    continue
+                current = self.by_make.get(key)
+                if current is None:
+                    if not new:
+                        continue
+                    current = PriceColumn()
+                self.by_make[key] = current.edited(gone, new)
+
+    def add_text_terms(self, texts):
+        """Добавляет в словарь термины моделей и описаний из texts. Термины
+        удаленных машин остаются: лишний термин только отправляет слово
+        в полнотекстовый поиск."""
+        if self.text_terms is None:
+            return
+        terms = set().union(*tokenize(texts))
+        if any(not self.has_text_prefix(term, exact=True) for term in terms):
+            self.text_terms = sorted(terms.union(self.text_terms))
+
+    def has_text_prefix(self, prefix, exact=False):
+        """Есть ли в словаре моделей и описаний термин, начинающийся с prefix
+        (exact=True — равный prefix)."""
+        terms = self.text_terms
+        position = bisect_left(terms, prefix)
+        if position == len(terms):
+            return False
+        return terms[position] == prefix if exact else terms[position].startswith(prefix)
+
+    def apply_changes(self, changes, db):
+        """Обновляет индекс по списку CarChange из ChangeBus. Записи, которые
+        индекс уже учел, и записи 'reset' (их обрабатывает шина) пропускаются."""
+        changes = [change for change in changes if change.seq > self.seq and change.op != "reset"]
+        if not changes:
+            return
+        removed = [(change.car_id, change.old_make, change.old_price) for change in changes
+                   if change.old_status == AVAILABLE]
+        ids = list({change.car_id for change in changes})
+        rows = []
+        for start in range(0, len(ids), CHANGE_CHUNK):
+            rows.extend(db.cars_by_ids(ids[start:start + CHANGE_CHUNK], available_only=True))
+        self.add_text_terms(f"{row[2]} {row[5] or ''}" for row in rows)
+        # Строка, уже убранная по старым значениям, добавляется заново с текущими
+        self.update(removed, [(row[0], row[1], row[4]) for row in rows])
+        self.seq = max(self.seq, changes[-1].seq)
+
+    def catch_up(self, db):
+        """Применяет журнал car_changes после seq. Возвращает число примененных
+        изменений или None, если журнал уже обрезан дальше seq."""
+        changes = [CarChange(*row) for row in db.car_changes_since(self.seq)]
+        if not changes:
+            return 0
+        if changes[0].seq > self.seq + 1:
+            return None
+        added = []
+        if any(change.op == "reset" for change in changes):
+            # Массовый импорт только добавляет машины, а с AUTOINCREMENT
+            # их id больше любого id в индексе; словарь перечитывается целиком
+            last_id = max(self.all.ids, default=0)
+            added = list(db.available_cars_after(last_id))
+            if self.text_terms is not None:
+                self.text_terms = db.text_terms()
+            self.update([], added)
+        self.apply_changes(changes, db)
+        self.seq = changes[-1].seq
+        return len(changes) + len(added)
+
+    def makes_with_prefix(self, prefix):
+        """Марки машин в продаже, у которых есть термин, начинающийся с prefix."""
+        return [make for make, column in self.by_make.items()
+                if len(column) and any(term.startswith(prefix) for term in self.make_terms[make])]
+
+    def query(self, text="", min_price=None, max_price=None, descending=False):
+        """Фильтр по слову из марки и диапазону цены.
+
+        Возвращает FilterResult или None, если ответ по индексу мог бы
+        отличаться от полнотекстового поиска: текст из нескольких слов,
+        слово, с которого начинается термин модели или описания, или слово,
+        которого нет в марках (его поиск исправляет опечатки).
+        """
+        tokens = TOKEN_RE.findall(text.lower())
+        makes = None
+        if tokens:
+            if len(tokens) > 1 or self.text_terms is None or self.has_text_prefix(tokens[0]):
+                return None
+            # Без марок в продаже с таким словом решает поиск: он исправляет опечатки
+            makes = self.makes_with_prefix(tokens[0])
+            if not makes:
+                return None
+        length = 0
+        for column in self.columns(makes):
+            start, stop = column.range(min_price, max_price)
+            length += stop - start
+        return FilterResult(self, makes, min_price, max_price, descending, length)
+
+    def columns(self, makes=None):
+        """Текущие столбцы марок makes или общий столбец при makes=None."""
+        with self._lock:
+            if makes is None:
+                return [self.all]
+            return [self.by_make[make] for make in makes if make in self.by_make]
+
+
+class FilterPager(KeysetPager):
+    """Пейджер по результату FilterResult: id берутся из индекса, строки — из базы по id."""
+
+    def __init__(self, db, result, page_size=256, max_pages=8):
+        super().__init__(db, page_size, max_pages, "DESC" if result.descending else "ASC")
+        self.result = result
+        self.total = len(result)
+        self._ended = set()
+
+    def _matching_rows(self, ids):
+        result = self.result
+        rows = self.db.cars_by_ids(ids, available_only=True, min_price=result.min_price, max_price=result.max_price)
+        if result.makes is None:
+            return rows
+        makes = set(result.makes)
+        return [row for row in rows if row[1] in makes]
+
+    def _is_last(self, number, store):
+        return number in self._ended
+
+    def _load(self, number):
+        store = CarColumnStore()
+        stream = self.result.ids(self._keys[number - 1] if number else None)
+        # Индекс может отставать от базы до следующего опроса шины изменений,
+        # поэтому строки, которые уже не подходят, пропускаются с дочитыванием
+        while len(store) < self.page_size:
+            wanted = self.page_size - len(store)
+            ids = list(islice(stream, wanted))
+            store.extend(self._matching_rows(ids))
+            if len(ids) < wanted:
+                with self._lock:
+                    self._ended.add(number)
+                break
+        return store
+
+
+def open_filter_pager(db, result, **options):
+    pager = FilterPager(db, result, **options)
+    pager.page(0)
+    return pager
@@ -0,0 +1,203 @@
+"""Массовый импорт и экспорт машин в CSV и JSONL.
+
+Файлы читаются и пишутся потоково: строки разбираются генератором и
+вставляются пачками по BATCH_SIZE в одной транзакции executemany, поэтому
+память не зависит от размера файла.
+
+Запуск из командной строки:
+    python inventory.py import cars.csv --seller login
+    python inventory.py export cars.jsonl [--seller login]
+"""
+import argparse
+import csv
+import json
+import math
+import os
+import sys
+
+from database import DB_PATH, Database, status_label
+
+
+# Строк в одной транзакции импорта
+BATCH_SIZE = 10000
+
+# Сколько ошибок по строкам хранить для отчета; остальные только считаются
+ERROR_LIMIT = 100
+
+# status выгружается текстом, как его видит пользователь
+EXPORT_FIELDS = ("id", "make", "model", "year", "price", "description", "seller_login", "status")
+
+
+def validate_car(year, price):
+    """Проверяет год и цену машины. Возвращает (год, цена) или бросает
+    ValueError с сообщением для пользователя."""
+    try:
+        year = int(year)
+    except (TypeError, ValueError):
+        raise ValueError("Введите корректный год!") from None
+    if year < 1950 or year > 2024:
+        raise ValueError("Год выпуска должен быть от 1950 до 2024.")
+
+    try:
+        price = float(price)
+    except (TypeError, ValueError):
+        raise ValueError("Введите корректную цену!") from None
+    if not 0 < price < math.inf:
+        raise ValueError("Цена должна быть положительным числом.")
+    return year, price
+
+
+def car_row(record, seller_login):
+    """Строка для Database.add_cars из записи файла (словаря с полями EXPORT_FIELDS)."""
+    make = str(record.get("make") or "").strip()
+    model = str(record.get("model") or "").strip()
+    if not make or not model:
+        raise ValueError("Не указаны марка или модель.")
+    year, price = validate_car(record.get("year"), record.get("price"))
+    return make, model, year, price, record.get("description") or "", seller_login
+
+
+def read_csv(file):
+    """(номер строки, запись, ошибка) для каждой строки CSV с заголовком."""
+    reader = csv.DictReader(file)
+    for record in reader:
+        yield reader.line_num, record, None
+
+
+def read_jsonl(file):
+    """(номер строки, запись, ошибка) для каждой непустой строки JSONL."""
+    for number, line in enumerate(file, start=1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError as error:
+            yield number, None, f"Некорректный JSON: {error.msg}"
+            continue
+        if isinstance(record, dict):
+            yield number, record, None
+        else:
+            yield number, None, "Ожидался объект JSON."
+
+
+def write_csv(file, rows):
+    writer = csv.writer(file)
+    writer.writerow(EXPORT_FIELDS)
+    writer.writerows(rows)
+
+
+def write_jsonl(file, rows):
+    for row in rows:
+        file.write(json.dumps(dict(zip(EXPORT_FIELDS, row)), ensure_ascii=False))
+        file.write("\n")
+
+
+FORMATS = {"csv": (read_csv, write_csv), "jsonl": (read_jsonl, write_jsonl)}
+
+
+def file_format(path, default="csv"):
+    """Формат файла по расширению: 'csv' или 'jsonl'."""
+    extension = os.path.splitext(path)[1].lower().lstrip(".")
+    return "jsonl" if extension in ("jsonl", "json", "ndjson") else default
+
+
+class ImportReport:
+    """Итог импорта: число добавленных машин и ошибки по номерам строк."""
+
+    def __init__(self):
+        self.imported = 0
+        self.failed = 0
+        self.errors = []
+
+    def add_error(self, line, message):
+        self.failed += 1
+        if len(self.errors) < ERROR_LIMIT:
+            self.errors.append((line, message))
+
+    def summary(self):
+        lines = [f"Импортировано машин: {self.imported}. Строк с ошибками: {self.failed}."]
+        lines += [f"Строка {line}: {message}" for line, message in self.errors[:10]]
+        if self.failed > 10:
+            lines.append("...")
+        return "\n".join(lines)
+
+
+def import_cars(db, records, seller_login, batch_size=BATCH_SIZE):
+    """Добавляет машины из записей read_csv/read_jsonl от имени продавца.
+
+    Каждая пачка вставляется в своей транзакции: при сбое уже вставленные
+    пачки остаются в базе.
+    """
+    report = ImportReport()
+    batch = []
+    for line, record, error in records:
+        if error is None:
+            try:
+                batch.append(car_row(record, seller_login))
+            except ValueError as invalid:
+                error = str(invalid)
+        if error is not None:
+            report.add_error(line, error)
+        elif len(batch) >= batch_size:
+            report.imported += db.add_cars(batch)
+            batch = []
+    if batch:
+        report.imported += db.add_cars(batch)
+    return report
+
+
+def import_file(db, path, seller_login, fmt=None):
+    reader = FORMATS[fmt or file_format(path)][0]
+    with open(path, newline="", encoding="utf-8-sig") as file:
+        return import_cars(db, reader(file), seller_login)
+
+
+def export_cars(db, file, fmt="csv", seller_login=None):
+    """Пишет машины (все или одного продавца) в файл, читая их курсором. Возвращает их число."""
+    cursor = db.cars_by_seller(seller_login) if seller_login else db.list_cars()
+    count = 0
+
+    def rows():
+        nonlocal count
+        for row in cursor:
+            count += 1
+            yield row[:7] + (status_label(row[7], row[8]),)
+
+    FORMATS[fmt][1](file, rows())
+    return count
+
+
+def export_file(db, path, seller_login=None, fmt=None):
+    with open(path, "w", newline="", encoding="utf-8") as file:
+        return export_cars(db, file, fmt or file_format(path), seller_login)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Импорт и экспорт машин AvtoSell")
+    parser.add_argument("--db", default=DB_PATH, help="путь к базе")
+    parser.add_argument("--format", choices=sorted(FORMATS), help="формат файла (по умолчанию по расширению)")
+    commands = parser.add_subparsers(dest="command", required=True)
+    import_parser = commands.add_parser("import", help="добавить машины из файла")
+    import_parser.add_argument("path")
+    import_parser.add_argument("--seller", required=True, help="логин продавца")
+    export_parser = commands.add_parser("export", help="выгрузить машины в файл")
+    export_parser.add_argument("path")
+    export_parser.add_argument("--seller", help="только машины этого продавца")
+    args = parser.parse_args(argv)
+
+    db = Database(args.db)
+    try:
+        db.initialize()
+        if args.command == "import":
+            report = import_file(db, args.path, args.seller, args.format)
+            print(report.summary())
+            return 1 if report.failed else 0
+        count = export_file(db, args.path, args.seller, args.format)
+        print(f"Выгружено машин: {count}.")
+        return 0
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,514 +1,40 @@
 import sys
 import sqlite3
 
-from PyQt6.QtCore import Qt
+from PyQt6.QtCore import QTimer
 from PyQt6.QtWidgets import (
     QApplication, QMainWindow, QWidget, QVBoxLayout, QLineEdit,
-    QPushButton, QLabel, QComboBox, QStackedWidget, QMessageBox, QTableWidget, QTableWidgetItem, QTextEdit, QDialog,
-    QHeaderView
+    QPushButton, QLabel, QComboBox, QStackedWidget, QMessageBox
 )
 
+import profiling
+from credentials import Credentials
+from database import SYNCHRONOUS, Database
 
-def initialize_database():
-    connection = sqlite3.connect("users.db")
-    cursor = connection.cursor()
-
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS cars (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            make TEXT NOT NULL,
-            model TEXT NOT NULL,
-            year INTEGER NOT NULL,
-            price REAL NOT NULL,
-            description TEXT,
-            seller_login TEXT NOT NULL,
-            status TEXT DEFAULT 'Доступно',
-            buyer_login TEXT  
-        )
-    """)
-
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            login TEXT UNIQUE NOT NULL,
-            password TEXT NOT NULL,
-            role TEXT NOT NULL
-        )
-    """)
-
-    connection.commit()
-    connection.close()
-
-
-
-class AdminPanel(QWidget):
-    def __init__(self, parent):
-        super().__init__()
-        self.parent = parent
-        self.setup_ui()
-
-    def setup_ui(self):
-        """Создаем интерфейс для управления пользователями"""
-        layout = QVBoxLayout()
-
-        self.users_table = QTableWidget()
-        self.users_table.setColumnCount(3)
-        self.users_table.setHorizontalHeaderLabels(["ID", "Логин", "Роль"])
-
-        delete_user_button = QPushButton("Удалить пользователя")
-        show_cars_button = QPushButton("Показать список машин")
-        back_button = QPushButton("Выход")
-
-        delete_user_button.clicked.connect(self.delete_user)
-        show_cars_button.clicked.connect(self.show_cars_list)
-        back_button.clicked.connect(self.parent.show_login_window)
-
-        layout.addWidget(self.users_table)
-        layout.addWidget(delete_user_button)
-        layout.addWidget(show_cars_button)
-        layout.addWidget(back_button)
 
-        self.setLayout(layout)
+# Как часто переносить проданные машины в архив и сжимать файл базы
+MAINTENANCE_INTERVAL_MS = 15 * 60 * 1000
 
-    def load_users(self):
-        self.users_table.setRowCount(0)
 
-        connection = sqlite3.connect("users.db")
-        cursor = connection.cursor()
-        cursor.execute("SELECT id, login, role FROM users")
-        users = cursor.fetchall()
-        connection.close()
+def initialize_database(db):
+    db.initialize()
 
-        for row_num, user in enumerate(users):
-            self.users_table.insertRow(row_num)
-            for col_num, value in enumerate(user):
-                self.users_table.setItem(row_num, col_num, QTableWidgetItem(str(value)))
-
-    def delete_user(self):
-        selected_row = self.users_table.currentRow()
-        if selected_row == -1:
-            QMessageBox.warning(self, "Ошибка", "Выберите пользователя для удаления.")
-            return
-
-        user_id = self.users_table.item(selected_row, 0).text()
-        user_role = self.users_table.item(selected_row, 2).text()
-
-        if user_id == str(self.parent.current_user[0]):
-            QMessageBox.warning(self, "Ошибка", "Вы не можете удалить себя!")
-            return
-        if user_role == "Админ":
-            QMessageBox.warning(self, "Ошибка", "Невозможно удалить админа!")
-            return
-
-        connection = sqlite3.connect("users.db")
-        cursor = connection.cursor()
-        cursor.execute("DELETE FROM users WHERE id = ?", (user_id,))
-        connection.commit()
-        connection.close()
-
-        self.load_users()
-        QMessageBox.information(self, "Успех", "Пользователь успешно удалён!")
-
-    def show_cars_list(self):
-        self.parent.admin_cars_window.load_car_list()
-        self.parent.central_widget.setCurrentWidget(self.parent.admin_cars_window)
-        self.parent.setWindowTitle("Список машин")
-
-
-class AdminCarsWindow(QWidget):
-    def __init__(self, parent):
-        super().__init__(parent)
-        self.parent = parent
-        self.setup_ui()
-
-    def setup_ui(self):
-        layout = QVBoxLayout()
 
-        # Таблица для списка машин
-        self.car_list_table = QTableWidget()
-        self.car_list_table.setColumnCount(8)
-        self.car_list_table.setHorizontalHeaderLabels(
-            ["ID", "Марка", "Модель", "Год", "Цена", "Описание", "Продавец", "Статус"]
-        )
-
-        # Автоматическое растягивание столбцов
-        self.car_list_table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Stretch)
-
-        # Устанавливаем минимальные ширины для столбцов
-        self.car_list_table.setColumnWidth(0, 50)  # ID
-        self.car_list_table.setColumnWidth(1, 150)  # Марка
-        self.car_list_table.setColumnWidth(2, 150)  # Модель
-        self.car_list_table.setColumnWidth(4, 100)  # Цена
-
-        # Кнопки "Удалить машину" и "Назад"
-        delete_car_button = QPushButton("Удалить машину")
-        delete_car_button.clicked.connect(self.delete_car)
-
-        back_button = QPushButton("Назад")
-        back_button.clicked.connect(self.parent.show_admin_panel)
-
-        # Добавляем все элементы в layout
-        layout.addWidget(self.car_list_table)
-        layout.addWidget(delete_car_button)
-        layout.addWidget(back_button)
-
-        self.setLayout(layout)
-
-        # Загружаем список машин
-        self.load_car_list()
-
-    def load_car_list(self):
-        """Загружаем данные о машинах в таблицу"""
-        self.car_list_table.setRowCount(0)
-
-        connection = sqlite3.connect("users.db")
-        cursor = connection.cursor()
-        cursor.execute("SELECT id, make, model, year, price, description, seller_login, status FROM cars")
-        cars = cursor.fetchall()
-        connection.close()
-
-        for row_num, car in enumerate(cars):
-            self.car_list_table.insertRow(row_num)
-            self.car_list_table.setRowHeight(row_num, 100)
-            for col_num, value in enumerate(car):
-                if col_num == 4:  # Форматируем цену
-                    value = f"{value} руб."
-                self.car_list_table.setItem(row_num, col_num, QTableWidgetItem(str(value)))
-
-        # Устанавливаем ширину столбцов автоматически по содержимому
-        self.car_list_table.resizeColumnsToContents()
-
-    def delete_car(self):
-        selected_row = self.car_list_table.currentRow()
-        if selected_row == -1:
-            QMessageBox.warning(self, "Ошибка", "Выберите машину для удаления.")
-            return
-
-        car_id = self.car_list_table.item(selected_row, 0).text()
-
-        connection = sqlite3.connect("users.db")
-        cursor = connection.cursor()
-        cursor.execute("DELETE FROM cars WHERE id = ?", (car_id,))
-        connection.commit()
-        connection.close()
-
-        QMessageBox.information(self, "Успех", "Машина успешно удалена!")
-        self.load_car_list()
-
-
-
-
-class SellerPanel(QWidget):
-    def __init__(self, parent):
-        super().__init__()
-        self.parent = parent
-        self.setup_ui()
-
-    def setup_ui(self):
-        layout = QVBoxLayout()
-
-        self.car_list_table = QTableWidget()
-        self.car_list_table.setColumnCount(8)
-        self.car_list_table.setHorizontalHeaderLabels(
-            ["ID", "Марка", "Модель", "Год", "Цена", "Описание", "Продавец", "Статус"])
-
-        self.car_list_table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Stretch)
-        self.car_list_table.setHorizontalScrollBarPolicy(Qt.ScrollBarPolicy.ScrollBarAlwaysOff)
-
-        add_car_button = QPushButton("Добавить машину")
-        delete_car_button = QPushButton("Удалить машину")
-        back_button = QPushButton("Выход")
-
-        add_car_button.clicked.connect(self.show_add_car_window)
-        delete_car_button.clicked.connect(self.delete_car)
-        back_button.clicked.connect(self.parent.show_login_window)
-
-        layout.addWidget(self.car_list_table)
-        layout.addWidget(add_car_button)
-        layout.addWidget(delete_car_button)
-        layout.addWidget(back_button)
-
-        self.setLayout(layout)
-
-    def load_car_list(self):
-        self.car_list_table.setRowCount(0)
-
-        connection = sqlite3.connect("users.db")
-        cursor = connection.cursor()
-        cursor.execute("""
-            SELECT id, make, model, year, price, description, seller_login, status
-            FROM cars
-            WHERE seller_login = ?
-        """, (self.parent.current_user[1],))
-        cars = cursor.fetchall()
-        connection.close()
-
-        for row_num, car in enumerate(cars):
-            self.car_list_table.insertRow(row_num)
-            self.car_list_table.setRowHeight(row_num, 100)
-            for col_num, value in enumerate(car):
-                if col_num == 4:
-                    value = f"{value} руб"
-                self.car_list_table.setItem(row_num, col_num, QTableWidgetItem(str(value)))
-
-    def delete_car(self):
-        selected_row = self.car_list_table.currentRow()
-        if selected_row == -1:
-            QMessageBox.warning(self, "Ошибка", "Выберите машину для удаления.")
-            return
-
-        car_id = self.car_list_table.item(selected_row, 0).text()
-
-        connection = sqlite3.connect("users.db")
-        cursor = connection.cursor()
-        cursor.execute("SELECT seller_login FROM cars WHERE id = ?", (car_id,))
-        car = cursor.fetchone()
-        connection.close()
-
-        # Проверяем, является ли текущий пользователь продавцом этой машины
-        if car and car[0] != self.parent.current_user[1]:
-            QMessageBox.warning(self, "Ошибка", "Вы не можете удалить машину другого продавца!")
-            return
-
-        # Если это его машина, удаляем
-        connection = sqlite3.connect("users.db")
-        cursor = connection.cursor()
-        cursor.execute("DELETE FROM cars WHERE id = ?", (car_id,))
-        connection.commit()
-        connection.close()
-
-        self.load_car_list()
-        self.parent.buyer_panel.load_car_list()
-        QMessageBox.information(self, "Успех", "Машина успешно удалена!")
-
-    def show_add_car_window(self):
-        self.add_car_window = AddCarWindow(self)
-        self.add_car_window.show()
-
-
-
-class BuyerPanel(QWidget):
-    def __init__(self, parent):
-        super().__init__()
-        self.parent = parent
-        self.setup_ui()
-
-    def setup_ui(self):
-        layout = QVBoxLayout()
-
-        self.min_price_input = QLineEdit()
-        self.min_price_input.setPlaceholderText("Мин. цена")
-        self.max_price_input = QLineEdit()
-        self.max_price_input.setPlaceholderText("Макс. цена")
-        self.make_input = QLineEdit()
-        self.make_input.setPlaceholderText("Марка автомобиля")
-        self.sort_combo = QComboBox()
-        self.sort_combo.addItems(["Без сортировки", "Цена: по возрастанию", "Цена: по убыванию"])
-
-        apply_filters_button = QPushButton("Применить фильтры")
-        apply_filters_button.clicked.connect(self.apply_filters)
-
-        filters_layout = QVBoxLayout()
-        filters_layout.addWidget(QLabel("Фильтры"))
-        filters_layout.addWidget(self.make_input)
-        filters_layout.addWidget(self.min_price_input)
-        filters_layout.addWidget(self.max_price_input)
-        filters_layout.addWidget(QLabel("Сортировка"))
-        filters_layout.addWidget(self.sort_combo)
-        filters_layout.addWidget(apply_filters_button)
-
-        self.car_list_table = QTableWidget()
-        self.car_list_table.setColumnCount(8)
-        self.car_list_table.setHorizontalHeaderLabels(["ID", "Марка", "Модель", "Год", "Цена", "Описание", "Продавец", "Статус"])
-
-
-        buy_car_button = QPushButton("Купить машину")
-        buy_car_button.clicked.connect(self.buy_car)
-
-        back_button = QPushButton("Выход")
-        back_button.clicked.connect(self.parent.show_login_window)
-
-        layout.addLayout(filters_layout)
-        layout.addWidget(self.car_list_table)
-        layout.addWidget(buy_car_button)
-        layout.addWidget(back_button)
-
-        self.setLayout(layout)
-
-    def load_car_list(self):
-        self.car_list_table.setRowCount(0)
-
-        connection = sqlite3.connect("users.db")
-        cursor = connection.cursor()
-        cursor.execute("""
-            SELECT id, make, model, year, price, description, seller_login, status
-            FROM cars
-        """)
-        cars = cursor.fetchall()
-        connection.close()
-
-        for row_num, car in enumerate(cars):
-            self.car_list_table.insertRow(row_num)
-            self.car_list_table.setRowHeight(row_num, 100)
-            for col_num, value in enumerate(car):
-                # Format the price column
-                if col_num == 4:  # Column for price
-                    value = f"{value} руб"
-                self.car_list_table.setItem(row_num, col_num, QTableWidgetItem(str(value)))
-
-    def apply_filters(self):
-        query = """
-            SELECT id, make, model, year, price, description, seller_login, status
-            FROM cars
-            WHERE status = 'В продаже'
-        """
-        params = []
-
-        make = self.make_input.text()
-        if make:
-            query += " AND make LIKE ?"
-            params.append(f"%{make}%")
-
-        if self.min_price_input.text():
-            query += " AND price >= ?"
-            params.append(float(self.min_price_input.text()))
-
-        if self.max_price_input.text():
-            query += " AND price <= ?"
-            params.append(float(self.max_price_input.text()))
-
-        if self.sort_combo.currentText() == "Цена: по возрастанию":
-            query += " ORDER BY price ASC"
-        elif self.sort_combo.currentText() == "Цена: по убыванию":
-            query += " ORDER BY price DESC"
-
-        connection = sqlite3.connect("users.db")
-        cursor = connection.cursor()
-        cursor.execute(query, params)
-        cars = cursor.fetchall()
-        connection.close()
-
-        self.car_list_table.setRowCount(0)
-        for row_num, car in enumerate(cars):
-            self.car_list_table.insertRow(row_num)
-            for col_num, value in enumerate(car):
-                self.car_list_table.setItem(row_num, col_num, QTableWidgetItem(str(value)))
-
-    def buy_car(self):
-        selected_row = self.car_list_table.currentRow()
-        if selected_row == -1:
-            QMessageBox.warning(self, "Ошибка", "Выберите машину для покупки.")
-            return
-
-        car_id = self.car_list_table.item(selected_row, 0).text()
-        buyer_login = self.parent.current_user[1]
-
-        connection = sqlite3.connect("users.db")
-        cursor = connection.cursor()
-        cursor.execute("SELECT buyer_login FROM cars WHERE id = ?", (car_id,))
-        existing_buyer = cursor.fetchone()
-        connection.close()
-
-        if existing_buyer and existing_buyer[0] == buyer_login:
-            QMessageBox.warning(self, "Ошибка", "Вы уже купили эту машину!")
-            return
-
-        connection = sqlite3.connect("users.db")
-        cursor = connection.cursor()
-        cursor.execute("""
-            UPDATE cars
-            SET status = ?, buyer_login = ?
-            WHERE id = ?
-        """, (f"Куплено покупателем ({buyer_login})", buyer_login, car_id))
-        connection.commit()
-        connection.close()
-
-        self.load_car_list()
-        self.parent.seller_panel.load_car_list()
-        QMessageBox.information(self, "Успех", "Машина успешно куплена!")
-
-
-class AddCarWindow(QDialog):
-    def __init__(self, parent):
-        super().__init__(parent)
-        self.parent = parent
-        self.setWindowTitle("Добавить машину")
-
-        # Поля ввода с подсказками
-        self.make_input = QLineEdit(self)
-        self.make_input.setPlaceholderText("Введите марку автомобиля")
-
-        self.model_input = QLineEdit(self)
-        self.model_input.setPlaceholderText("Введите модель автомобиля")
-
-        self.year_input = QLineEdit(self)
-        self.year_input.setPlaceholderText("Введите год выпуска")
-
-        # Поле для ввода цены
-        self.price_input = QLineEdit(self)
-        self.price_input.setPlaceholderText("Введите цену автомобиля")
-
-        self.description_input = QTextEdit(self)
-        self.description_input.setPlaceholderText("Введите описание машины")
-        self.description_input.setMaximumHeight(100)
-
-        self.add_button = QPushButton("Добавить", self)
-        self.add_button.clicked.connect(self.add_car)
-
-        layout = QVBoxLayout(self)
-        layout.addWidget(self.make_input)
-        layout.addWidget(self.model_input)
-        layout.addWidget(self.year_input)
-        layout.addWidget(self.price_input)
-        layout.addWidget(self.description_input)
-        layout.addWidget(self.add_button)
-
-        self.setLayout(layout)
-
-    def add_car(self):
-        make = self.make_input.text()
-        model = self.model_input.text()
-        try:
-            year = int(self.year_input.text())
-            if year < 1950 or year > 2024:
-                QMessageBox.warning(self, "Ошибка", "Год выпуска должен быть от 1950 до 2024.")
-                return
-        except ValueError:
-            QMessageBox.warning(self, "Ошибка", "Введите корректный год!")
-            return
-
-        price_text = self.price_input.text().strip()
-        try:
-            price = float(price_text)
-            if price <= 0:
-                QMessageBox.warning(self, "Ошибка", "Цена должна быть положительным числом.")
-                return
-        except ValueError:
-            QMessageBox.warning(self, "Ошибка", "Введите корректную цену!")
-            return
-
-        try:
-            seller_login = self.parent.parent.current_user[1]
-            connection = sqlite3.connect("users.db")
-            cursor = connection.cursor()
-            cursor.execute("""
-                INSERT INTO cars (make, model, year, price, description, seller_login, status)
-                VALUES (?, ?, ?, ?, ?, ?, 'В продаже')
-            """, (make, model, year, price, self.description_input.toPlainText(), seller_login))
-            connection.commit()
-            connection.close()
-
-            QMessageBox.information(self, "Успех", "Машина успешно добавлена!")
-            self.parent.load_car_list()
-            self.close()
-
-        except Exception as e:
-            QMessageBox.warning(self, "Ошибка", f"Ошибка при добавлении машины: {str(e)}")
+def synchronous_mode(argv):
+    """Надежность фиксации из флага --synchronous NORMAL|FULL (убирая его из argv)."""
+    if "--synchronous" not in argv:
+        return SYNCHRONOUS
+    position = argv.index("--synchronous")
+    mode = argv[position + 1].upper() if position + 1 < len(argv) else SYNCHRONOUS
+    del argv[position:position + 2]
+    return mode
 
 
 class AuthRegApp(QMainWindow):
-    def __init__(self):
+    def __init__(self, db, credentials=None):
         super().__init__()
+        self.db = db
+        self.credentials = credentials or Credentials(db)
         self.setWindowTitle("Авторизация")
         self.setGeometry(300, 300, 300, 200)
 
@@ -521,23 +47,119 @@ class AuthRegApp(QMainWindow):
         self.register_widget = self.create_register_window()
         self.central_widget.addWidget(self.register_widget)
 
-        self.admin_panel = AdminPanel(self)
-        self.central_widget.addWidget(self.admin_panel)
-
-        self.admin_cars_window = AdminCarsWindow(self)  # Новый экран
-        self.central_widget.addWidget(self.admin_cars_window)
-
-        self.seller_panel = SellerPanel(self)
-        self.central_widget.addWidget(self.seller_panel)
-
-        self.add_car_window = AddCarWindow(self)
-        self.central_widget.addWidget(self.add_car_window)
-
-        self.buyer_panel = BuyerPanel(self)
-        self.central_widget.addWidget(self.buyer_panel)
-
         self.current_user = None
 
+        # Панели ролей и шина изменений создаются при первом обращении:
+        # окну входа не нужны ни их виджеты, ни запросы к базе
+        self._panels = {}
+        self._changes = None
+        # Пул запросов, очередь записей и фотографии тоже создаются при первом обращении
+        self._queries = None
+        self._writes = None
+        self._photos = None
+
+        # Обслуживание базы идет в пуле; таймер запускается после первого входа,
+        # и первый раз оно выполняется через интервал, а не сразу
+        self.maintenance_timer = QTimer(self)
+        self.maintenance_timer.setInterval(MAINTENANCE_INTERVAL_MS)
+        self.maintenance_timer.timeout.connect(self.maintain_database)
+
+    def _panel(self, name, class_name):
+        panel = self._panels.get(name)
+        if panel is None:
+            import panels
+            panel = self._panels[name] = getattr(panels, class_name)(self)
+            self.central_widget.addWidget(panel)
+            # Изменения машин (свои и других процессов) точечно применяются к таблицам панели
+            if hasattr(panel, "apply_changes"):
+                self.changes.cars_changed.connect(panel.apply_changes)
+        return panel
+
+    @property
+    def admin_panel(self):
+        return self._panel("admin_panel", "AdminPanel")
+
+    @property
+    def admin_cars_window(self):
+        return self._panel("admin_cars_window", "AdminCarsWindow")
+
+    @property
+    def market_stats_window(self):
+        return self._panel("market_stats_window", "MarketStatsWindow")
+
+    @property
+    def seller_panel(self):
+        return self._panel("seller_panel", "SellerPanel")
+
+    @property
+    def buyer_panel(self):
+        return self._panel("buyer_panel", "BuyerPanel")
+
+    @property
+    def queries(self):
+        if self._queries is None:
+            from workers import QueryExecutor
+            self._queries = QueryExecutor(self.db, self)
+        return self._queries
+
+    @property
+    def writes(self):
+        if self._writes is None:
+            from workers import WriteQueue
+            # Записи продавца фиксируются пачками; свои изменения публикуются сразу после фиксации
+            self._writes = WriteQueue(self.db, self)
+            self._writes.committed.connect(self.writes_committed)
+        return self._writes
+
+    def _photo_store(self):
+        if self._photos is None:
+            from photos import PhotoStore, ThumbnailCache
+            # Фотографии хранятся рядом с файлом базы; при работе через сервер их нет
+            photos = PhotoStore.for_database(self.db)
+            thumbnails = ThumbnailCache(photos, self.db, self) if photos is not None else None
+            self._photos = (photos, thumbnails)
+        return self._photos
+
+    @property
+    def photos(self):
+        return self._photo_store()[0]
+
+    @property
+    def thumbnails(self):
+        return self._photo_store()[1]
+
+    @property
+    def changes(self):
+        if self._changes is None:
+            from events import ChangeBus
+            self._changes = ChangeBus(self.db, self)
+            self._changes.reset.connect(self.reload_car_lists)
+        return self._changes
+
+    def maintain_database(self):
+        # Ошибки (например, занятая база) не показываются: обслуживание повторится позже
+        self.queries.submit("maintenance", self.db.maintain, self.maintenance_finished, self.photos)
+
+    def maintenance_finished(self, result):
+        archived, _ = result
+        # Перенесенные в архив машины пропадают из списков продавца и администратора
+        if archived and self._changes is not None:
+            self._changes.poll(force=True)
+
+    def writes_committed(self):
+        self.changes.poll(force=True)
+
+    def reload_car_lists(self):
+        if "admin_cars_window" in self._panels:
+            self.admin_cars_window.load_car_list()
+        if "market_stats_window" in self._panels:
+            self.market_stats_window.load_stats()
+        if self.current_user is not None:
+            if "seller_panel" in self._panels:
+                self.seller_panel.load_car_list()
+            if "buyer_panel" in self._panels:
+                self.buyer_panel.refresh()
+
     def show_admin_panel(self):
         self.central_widget.setCurrentWidget(self.admin_panel)
 
@@ -602,14 +224,17 @@ class AuthRegApp(QMainWindow):
             QMessageBox.warning(self, "Ошибка", "Введите логин и пароль!")
             return
 
-        connection = sqlite3.connect("users.db")
-        cursor = connection.cursor()
-        cursor.execute("SELECT id, login, password, role FROM users WHERE login = ?", (login,))
-        user = cursor.fetchone()
-        connection.close()
+        # Проверка хеша пароля занимает десятки миллисекунд и идет в пуле
+        self.queries.submit(
+            "login", self.credentials.authenticate, self.complete_login, login, password,
+            error_callback=self.show_query_error,
+        )
 
-        if user and user[2] == password:
+    def complete_login(self, user):
+        if user:
             self.current_user = user
+            if not self.maintenance_timer.isActive():
+                self.maintenance_timer.start()
             role = user[3]
             QMessageBox.information(self, "Успех", f"Добро пожаловать, {role}!")
             if role == "Админ":
@@ -646,18 +271,24 @@ class AuthRegApp(QMainWindow):
             QMessageBox.warning(self, "Ошибка", "Пароль не должен превышать 8 символов!")
             return
 
-        connection = sqlite3.connect("users.db")
-        cursor = connection.cursor()
-        try:
-            cursor.execute("INSERT INTO users (login, password, role) VALUES (?, ?, ?)",
-                           (login, password, role))
-            connection.commit()
-            QMessageBox.information(self, "Успех", "Пользователь зарегистрирован!")
-            self.show_login_window()
-        except sqlite3.IntegrityError:
+        # Отдельный канал на логин: следующая регистрация не отменяет предыдущую
+        self.queries.submit(
+            f"register:{login}", self.credentials.register, self.complete_register, login, password, role,
+            error_callback=self.register_failed,
+        )
+
+    def complete_register(self, _):
+        QMessageBox.information(self, "Успех", "Пользователь зарегистрирован!")
+        self.show_login_window()
+
+    def register_failed(self, error):
+        if isinstance(error, sqlite3.IntegrityError):
             QMessageBox.warning(self, "Ошибка", "Этот логин уже существует!")
-        finally:
-            connection.close()
+        else:
+            self.show_query_error(error)
+
+    def show_query_error(self, error):
+        QMessageBox.warning(self, "Ошибка", f"Ошибка при выполнении запроса: {error}")
 
     def show_login_window(self):
         self.setWindowTitle("Авторизация")
@@ -666,21 +297,42 @@ class AuthRegApp(QMainWindow):
         self.setWindowTitle("Регистрация")
         self.central_widget.setCurrentWidget(self.register_widget)
 
-    def show_add_car_window(self):
-        self.central_widget.setCurrentWidget(self.add_car_window)
-
-    def show_cars_list(self):
-        self.parent.admin_cars_window.load_car_list()
-        self.parent.central_widget.setCurrentWidget(self.parent.admin_cars_window)
-        self.parent.setWindowTitle("Список машин")
-
 
 def main():
+    # --profile путь включает замеры запросов и таблиц (см. profiling)
+    profiling.configure(sys.argv)
+    # --server URL: работа через сервер API (server.py) вместо файла базы;
+    # обслуживание базы тогда выполняет сервер
+    import remote
+    url = remote.server_url(sys.argv)
+    if url:
+        db = remote.RemoteDatabase(url)
+        credentials = remote.RemoteCredentials(db)
+    else:
+        # --synchronous FULL: каждая фиксация ждет записи на диск
+        db = Database(synchronous=synchronous_mode(sys.argv))
+        initialize_database(db)
+        credentials = None
+        # --maintain: архив и полное сжатие базы без запуска GUI, например по расписанию cron
+        if "--maintain" in sys.argv:
+            archived = db.archive_sold_cars()
+            db.merge_search_index()
+            from photos import PhotoStore
+            removed = PhotoStore.for_database(db).sweep(db.photo_digests())
+            freed = db.compact(None, rebuild=True)
+            print(f"В архив перенесено машин: {archived}, удалено файлов фотографий: {removed}, "
+                  f"освобождено страниц: {freed}")
+            db.close()
+            return
     app = QApplication(sys.argv)
-    initialize_database()
-    window = AuthRegApp()
+    window = AuthRegApp(db, credentials)
     window.show()
-    sys.exit(app.exec())
+    exit_code = app.exec()
+    # Записи, которые еще в очереди, фиксируются до закрытия базы
+    if window._writes is not None:
+        window._writes.wait()
+    db.close()
+    sys.exit(exit_code)
 
 
 if __name__ == "__main__":
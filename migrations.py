@@ -0,0 +1,636 @@
+"""Версионные миграции схемы users.db.
+
+Номер примененной миграции хранится в PRAGMA user_version. Каждая миграция —
+функция, получающая соединение; новые миграции добавляются в конец списка
+декоратором @migration и выполняются при следующем запуске приложения.
+"""
+import math
+
+
+MIGRATIONS = []
+
+
+def migration(func):
+    MIGRATIONS.append(func)
+    return func
+
+
+def schema_version(connection):
+    return connection.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(connection):
+    """Применяет недостающие миграции, каждую в своей транзакции."""
+    version = schema_version(connection)
+    for number, step in enumerate(MIGRATIONS[version:], start=version + 1):
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            step(connection)
+            connection.execute(f"PRAGMA user_version = {number}")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+    return schema_version(connection)
+
+
+# Корзины цен в market_prices шириной 1/50 по логарифму цены, около 2%
+PRICE_BUCKET_SCALE = 50
+# Корзины таблицы price_buckets: от цены около 2e-9 до 1e13; цены за этими
+# пределами попадают в крайние корзины
+PRICE_BUCKET_RANGE = range(-1000, 1501)
+
+
+def price_bucket_sql(price):
+    """SQL-выражение корзины цены: round(ln(цена) * PRICE_BUCKET_SCALE) по
+    таблице границ price_buckets; для цены не больше нуля — NULL, как у ln().
+
+    Корзина читается из таблицы, а не считается функцией, чтобы триггеры
+    cars работали в любом соединении: ln() есть только в сборках SQLite
+    с математическими функциями, а функцию приложения другие программы
+    не регистрируют.
+    """
+    return f"(SELECT bucket FROM price_buckets WHERE low <= {price} ORDER BY low DESC LIMIT 1)"
+
+
+def create_price_buckets(connection):
+    """Таблица нижних границ корзин цен: корзина b начинается с exp((b - 0.5) / 50)."""
+    connection.execute("""
+        CREATE TABLE IF NOT EXISTS price_buckets (
+            low REAL PRIMARY KEY,
+            bucket INTEGER NOT NULL
+        ) WITHOUT ROWID
+    """)
+    connection.executemany(
+        "INSERT OR IGNORE INTO price_buckets VALUES (?, ?)",
+        ((math.exp((bucket - 0.5) / PRICE_BUCKET_SCALE), bucket) for bucket in PRICE_BUCKET_RANGE),
+    )
+
+
+@migration
+def create_tables(connection):
+    connection.execute("""
+        CREATE TABLE IF NOT EXISTS cars (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            make TEXT NOT NULL,
+            model TEXT NOT NULL,
+            year INTEGER NOT NULL,
+            price REAL NOT NULL,
+            description TEXT,
+            seller_login TEXT NOT NULL,
+            status TEXT DEFAULT 'Доступно',
+            buyer_login TEXT
+        )
+    """)
+    connection.execute("""
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            login TEXT UNIQUE NOT NULL,
+            password TEXT NOT NULL,
+            role TEXT NOT NULL
+        )
+    """)
+
+
+@migration
+def add_car_indexes(connection):
+    # Каталог покупателя: фильтр по статусу, диапазону цены и сортировка по цене
+    connection.execute("CREATE INDEX IF NOT EXISTS idx_cars_status_price ON cars (status, price)")
+    # Каталог без сортировки: строки одного статуса в порядке id для keyset-пагинации
+    connection.execute("CREATE INDEX IF NOT EXISTS idx_cars_status ON cars (status)")
+    # Список машин продавца
+    connection.execute("CREATE INDEX IF NOT EXISTS idx_cars_seller ON cars (seller_login)")
+    # Покупки покупателя
+    connection.execute("CREATE INDEX IF NOT EXISTS idx_cars_buyer ON cars (buyer_login)")
+    connection.execute("ANALYZE")
+
+
+@migration
+def add_cars_fts(connection):
+    # Полнотекстовый индекс по марке, модели и описанию поверх таблицы cars
+    connection.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS cars_fts USING fts5(
+            make, model, description,
+            content = 'cars', content_rowid = 'id',
+            tokenize = 'unicode61 remove_diacritics 2',
+            prefix = '2 3'
+        )
+    """)
+    # Словарь терминов для исправления опечаток
+    connection.execute("CREATE VIRTUAL TABLE IF NOT EXISTS cars_fts_vocab USING fts5vocab(cars_fts, 'row')")
+    # Совпадение в марке весит больше, чем в модели, а в модели — больше, чем в описании
+    connection.execute("INSERT INTO cars_fts (cars_fts, rank) VALUES ('rank', 'bm25(10.0, 5.0, 1.0)')")
+
+    connection.execute("""
+        CREATE TRIGGER IF NOT EXISTS cars_fts_insert AFTER INSERT ON cars BEGIN
+            INSERT INTO cars_fts (rowid, make, model, description)
+            VALUES (new.id, new.make, new.model, new.description);
+        END
+    """)
+    connection.execute("""
+        CREATE TRIGGER IF NOT EXISTS cars_fts_delete AFTER DELETE ON cars BEGIN
+            INSERT INTO cars_fts (cars_fts, rowid, make, model, description)
+            VALUES ('delete', old.id, old.make, old.model, old.description);
+        END
+    """)
+    connection.execute("""
+        CREATE TRIGGER IF NOT EXISTS cars_fts_update AFTER UPDATE OF make, model, description ON cars BEGIN
+            INSERT INTO cars_fts (cars_fts, rowid, make, model, description)
+            VALUES ('delete', old.id, old.make, old.model, old.description);
+            INSERT INTO cars_fts (rowid, make, model, description)
+            VALUES (new.id, new.make, new.model, new.description);
+        END
+    """)
+    connection.execute("INSERT INTO cars_fts (cars_fts) VALUES ('rebuild')")
+
+
+@migration
+def add_car_change_log(connection):
+    # Журнал изменений машин: по нему панели точечно обновляют строки,
+    # в том числе после изменений из других процессов
+    connection.execute("""
+        CREATE TABLE IF NOT EXISTS car_changes (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            car_id INTEGER NOT NULL,
+            op TEXT NOT NULL,
+            old_make TEXT,
+            old_price REAL,
+            old_status TEXT
+        )
+    """)
+    connection.execute("""
+        CREATE TRIGGER IF NOT EXISTS car_changes_insert AFTER INSERT ON cars BEGIN
+            INSERT INTO car_changes (car_id, op) VALUES (new.id, 'insert');
+        END
+    """)
+    connection.execute("""
+        CREATE TRIGGER IF NOT EXISTS car_changes_update AFTER UPDATE ON cars BEGIN
+            INSERT INTO car_changes (car_id, op, old_make, old_price, old_status)
+            VALUES (new.id, 'update', old.make, old.price, old.status);
+        END
+    """)
+    connection.execute("""
+        CREATE TRIGGER IF NOT EXISTS car_changes_delete AFTER DELETE ON cars BEGIN
+            INSERT INTO car_changes (car_id, op, old_make, old_price, old_status)
+            VALUES (old.id, 'delete', old.make, old.price, old.status);
+        END
+    """)
+
+
+@migration
+def add_bulk_load_switch(connection):
+    # Пока в bulk_load есть строка, построчные триггеры вставки не срабатывают.
+    # Строку добавляет только Database.add_cars внутри своей транзакции, поэтому
+    # другие соединения ее не видят; индекс поиска и журнал изменений импорт
+    # заполняет сам, одним запросом на пачку.
+    connection.execute("CREATE TABLE IF NOT EXISTS bulk_load (active INTEGER NOT NULL)")
+    connection.execute("DROP TRIGGER IF EXISTS cars_fts_insert")
+    connection.execute("""
+        CREATE TRIGGER cars_fts_insert AFTER INSERT ON cars
+        WHEN NOT EXISTS (SELECT 1 FROM bulk_load) BEGIN
+            INSERT INTO cars_fts (rowid, make, model, description)
+            VALUES (new.id, new.make, new.model, new.description);
+        END
+    """)
+    connection.execute("DROP TRIGGER IF EXISTS car_changes_insert")
+    connection.execute("""
+        CREATE TRIGGER car_changes_insert AFTER INSERT ON cars
+        WHEN NOT EXISTS (SELECT 1 FROM bulk_load) BEGIN
+            INSERT INTO car_changes (car_id, op) VALUES (new.id, 'insert');
+        END
+    """)
+
+
+@migration
+def add_car_sort_indexes(connection):
+    # Сортировка каталога по заголовкам: машины в продаже в порядке года,
+    # марки (и модели внутри марки) или модели; id идет в индексе последним
+    connection.execute("CREATE INDEX IF NOT EXISTS idx_cars_status_year ON cars (status, year)")
+    connection.execute("CREATE INDEX IF NOT EXISTS idx_cars_status_make ON cars (status, make, model)")
+    connection.execute("CREATE INDEX IF NOT EXISTS idx_cars_status_model ON cars (status, model)")
+    connection.execute("ANALYZE")
+
+
+
+# Ключ корзины цен в market_prices — price_bucket_sql(цена), то есть корзины
+# шириной около 2%; по ним перцентили цены считаются с точностью около 1%.
+# Машина доступна, если ее статус 0 (см. normalize_car_status). Выражения
+# написаны для текущей схемы: сводки, посчитанные add_market_stats по
+# текстовым статусам, normalize_car_status пересчитывает заново.
+
+# Добавление машины new в сводки
+MARKET_STATS_ADD = f"""
+    INSERT INTO market_stats VALUES (new.make, new.year, new.status = 0, 1, new.price)
+    ON CONFLICT DO UPDATE SET cars_count = cars_count + 1, price_sum = price_sum + excluded.price_sum;
+    INSERT INTO market_prices VALUES (new.make, new.year, {price_bucket_sql('new.price')}, 1)
+    ON CONFLICT DO UPDATE SET cars_count = cars_count + 1;
+    INSERT INTO seller_stats VALUES (new.seller_login, new.status = 0, 1, new.price)
+    ON CONFLICT DO UPDATE SET cars_count = cars_count + 1, price_sum = price_sum + excluded.price_sum;
+"""
+
+# Удаление машины old из сводок; опустевшие строки удаляются
+MARKET_STATS_REMOVE = f"""
+    UPDATE market_stats SET cars_count = cars_count - 1, price_sum = price_sum - old.price
+    WHERE make = old.make AND year = old.year AND available = (old.status = 0);
+    DELETE FROM market_stats
+    WHERE make = old.make AND year = old.year AND available = (old.status = 0) AND cars_count = 0;
+    UPDATE market_prices SET cars_count = cars_count - 1
+    WHERE make = old.make AND year = old.year AND bucket = {price_bucket_sql('old.price')};
+    DELETE FROM market_prices
+    WHERE make = old.make AND year = old.year AND bucket = {price_bucket_sql('old.price')}
+      AND cars_count = 0;
+    UPDATE seller_stats SET cars_count = cars_count - 1, price_sum = price_sum - old.price
+    WHERE seller_login = old.seller_login AND available = (old.status = 0);
+    DELETE FROM seller_stats
+    WHERE seller_login = old.seller_login AND available = (old.status = 0) AND cars_count = 0;
+"""
+
+# Добавление в сводки машин с id больше ? одним запросом на таблицу
+MARKET_STATS_REFRESH = (
+    """
+    INSERT INTO market_stats
+    SELECT make, year, status = 0, count(*), sum(price) FROM cars WHERE id > ?
+    GROUP BY 1, 2, 3
+    ON CONFLICT DO UPDATE SET cars_count = cars_count + excluded.cars_count, price_sum = price_sum + excluded.price_sum
+    """,
+    f"""
+    INSERT INTO market_prices
+    SELECT make, year, {price_bucket_sql('price')}, count(*) FROM cars WHERE id > ?
+    GROUP BY 1, 2, 3
+    ON CONFLICT DO UPDATE SET cars_count = cars_count + excluded.cars_count
+    """,
+    """
+    INSERT INTO seller_stats
+    SELECT seller_login, status = 0, count(*), sum(price) FROM cars WHERE id > ?
+    GROUP BY 1, 2
+    ON CONFLICT DO UPDATE SET cars_count = cars_count + excluded.cars_count, price_sum = price_sum + excluded.price_sum
+    """,
+)
+
+
+@migration
+def add_market_stats(connection):
+    # Сводки для статистики администратора: число машин и сумма цен по марке,
+    # году и доступности, корзины цен для медианы и перцентилей и итоги
+    # продавцов. Их ведут триггеры, поэтому статистика читается из нескольких
+    # тысяч строк, а не группировкой всей таблицы cars.
+    connection.execute("""
+        CREATE TABLE IF NOT EXISTS market_stats (
+            make TEXT NOT NULL,
+            year INTEGER NOT NULL,
+            available INTEGER NOT NULL,
+            cars_count INTEGER NOT NULL,
+            price_sum REAL NOT NULL,
+            PRIMARY KEY (make, year, available)
+        ) WITHOUT ROWID
+    """)
+    connection.execute("""
+        CREATE TABLE IF NOT EXISTS market_prices (
+            make TEXT NOT NULL,
+            year INTEGER NOT NULL,
+            bucket INTEGER NOT NULL,
+            cars_count INTEGER NOT NULL,
+            PRIMARY KEY (make, year, bucket)
+        ) WITHOUT ROWID
+    """)
+    connection.execute("""
+        CREATE TABLE IF NOT EXISTS seller_stats (
+            seller_login TEXT NOT NULL,
+            available INTEGER NOT NULL,
+            cars_count INTEGER NOT NULL,
+            price_sum REAL NOT NULL,
+            PRIMARY KEY (seller_login, available)
+        ) WITHOUT ROWID
+    """)
+    create_price_buckets(connection)
+    for statement in MARKET_STATS_REFRESH:
+        connection.execute(statement, (0,))
+
+    # Массовый импорт (bulk_load) пополняет сводки сам, запросами MARKET_STATS_REFRESH
+    connection.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS market_stats_insert AFTER INSERT ON cars
+        WHEN NOT EXISTS (SELECT 1 FROM bulk_load) BEGIN
+            {MARKET_STATS_ADD}
+        END
+    """)
+    connection.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS market_stats_delete AFTER DELETE ON cars BEGIN
+            {MARKET_STATS_REMOVE}
+        END
+    """)
+    connection.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS market_stats_update
+        AFTER UPDATE OF make, year, price, seller_login, status ON cars BEGIN
+            {MARKET_STATS_REMOVE}
+            {MARKET_STATS_ADD}
+        END
+    """)
+
+
+@migration
+def add_cars_archive(connection):
+    # Архив проданных и удаленных машин: каталог, поиск и списки читают только
+    # горячую таблицу cars, которая не растет вместе с историей продаж.
+    # sold_at — время покупки (unixepoch); у проданных раньше машин он пуст
+    connection.execute("ALTER TABLE cars ADD COLUMN sold_at REAL")
+    connection.execute("""
+        CREATE TABLE IF NOT EXISTS cars_archive (
+            id INTEGER PRIMARY KEY,
+            make TEXT NOT NULL,
+            model TEXT NOT NULL,
+            year INTEGER NOT NULL,
+            price REAL NOT NULL,
+            description TEXT,
+            seller_login TEXT NOT NULL,
+            status TEXT,
+            buyer_login TEXT,
+            sold_at REAL,
+            archived_at REAL NOT NULL,
+            reason TEXT NOT NULL
+        )
+    """)
+    connection.execute("CREATE INDEX IF NOT EXISTS idx_cars_archive_seller ON cars_archive (seller_login)")
+    connection.execute("CREATE INDEX IF NOT EXISTS idx_cars_archive_buyer ON cars_archive (buyer_login)")
+    # Проданные машины по времени продажи — для переноса в архив порциями
+    connection.execute("""
+        CREATE INDEX IF NOT EXISTS idx_cars_sold_at ON cars (coalesce(sold_at, 0))
+        WHERE buyer_login IS NOT NULL
+    """)
+
+    # Пока в archiving есть строка, удаление машины не меняет сводки статистики:
+    # проданная машина уходит в архив, но остается в статистике продаж.
+    # Строку добавляет только Database.archive_sold_cars внутри своей транзакции.
+    connection.execute("CREATE TABLE IF NOT EXISTS archiving (active INTEGER NOT NULL)")
+    connection.execute("DROP TRIGGER IF EXISTS market_stats_delete")
+    connection.execute(f"""
+        CREATE TRIGGER market_stats_delete AFTER DELETE ON cars
+        WHEN NOT EXISTS (SELECT 1 FROM archiving) BEGIN
+            {MARKET_STATS_REMOVE}
+        END
+    """)
+
+
+# Префикс старого текстового статуса проданной машины: 'Куплено покупателем (логин)'
+SOLD_STATUS_PREFIX = "Куплено покупателем ("
+
+
+def _status_to_enum(connection, table):
+    # Логин покупателя, записанный только в тексте статуса, переносится в buyer_login;
+    # проданной считается машина с покупателем, остальные ('В продаже', 'Доступно'
+    # по умолчанию таблицы и прочие) — в продаже
+    connection.execute(f"""
+        UPDATE {table} SET buyer_login = substr(status, ?, length(status) - ?)
+        WHERE buyer_login IS NULL AND status LIKE ? || '%)'
+    """, (len(SOLD_STATUS_PREFIX) + 1, len(SOLD_STATUS_PREFIX) + 1, SOLD_STATUS_PREFIX))
+    connection.execute(f"ALTER TABLE {table} ADD COLUMN status_code INTEGER NOT NULL DEFAULT 0")
+    connection.execute(f"UPDATE {table} SET status_code = 1 WHERE buyer_login IS NOT NULL")
+    connection.execute(f"ALTER TABLE {table} DROP COLUMN status")
+    connection.execute(f"ALTER TABLE {table} RENAME COLUMN status_code TO status")
+
+
+@migration
+def normalize_car_status(connection):
+    # Статус машины — число: 0 — в продаже, 1 — продана (кому — в buyer_login),
+    # а не текст с логином покупателя внутри. Текст для показа собирается при
+    # отрисовке (database.status_label). Столбец меняется на месте: индексы и
+    # триггеры, которые его упоминают, пересоздаются.
+    for index in ("idx_cars_status_price", "idx_cars_status", "idx_cars_status_year",
+                  "idx_cars_status_make", "idx_cars_status_model"):
+        connection.execute(f"DROP INDEX IF EXISTS {index}")
+    for trigger in ("car_changes_update", "car_changes_delete",
+                    "market_stats_insert", "market_stats_delete", "market_stats_update"):
+        connection.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+
+    create_price_buckets(connection)
+    _status_to_enum(connection, "cars")
+    _status_to_enum(connection, "cars_archive")
+    connection.execute("ALTER TABLE car_changes ADD COLUMN old_status_code INTEGER")
+    connection.execute("""
+        UPDATE car_changes SET old_status_code = CASE
+            WHEN old_status IS NULL THEN NULL WHEN old_status LIKE ? || '%)' THEN 1 ELSE 0 END
+    """, (SOLD_STATUS_PREFIX,))
+    connection.execute("ALTER TABLE car_changes DROP COLUMN old_status")
+    connection.execute("ALTER TABLE car_changes RENAME COLUMN old_status_code TO old_status")
+
+    # Каталог покупателя читает только машины в продаже, поэтому индексы для него
+    # частичные: проданные машины в них не попадают. Запросы должны содержать
+    # условие status = 0 буквально, иначе планировщик эти индексы не возьмет.
+    # Каталог без сортировки идет по id; в ключе нет status, иначе без статистики
+    # планировщик предпочитал этот индекс (равенство по status) индексам сортировки.
+    connection.execute("CREATE INDEX idx_cars_available ON cars (id) WHERE status = 0")
+    connection.execute("CREATE INDEX idx_cars_available_price ON cars (price) WHERE status = 0")
+    connection.execute("CREATE INDEX idx_cars_available_year ON cars (year) WHERE status = 0")
+    connection.execute("CREATE INDEX idx_cars_available_make ON cars (make, model) WHERE status = 0")
+    connection.execute("CREATE INDEX idx_cars_available_model ON cars (model) WHERE status = 0")
+
+    connection.execute("""
+        CREATE TRIGGER car_changes_update AFTER UPDATE ON cars BEGIN
+            INSERT INTO car_changes (car_id, op, old_make, old_price, old_status)
+            VALUES (new.id, 'update', old.make, old.price, old.status);
+        END
+    """)
+    connection.execute("""
+        CREATE TRIGGER car_changes_delete AFTER DELETE ON cars BEGIN
+            INSERT INTO car_changes (car_id, op, old_make, old_price, old_status)
+            VALUES (old.id, 'delete', old.make, old.price, old.status);
+        END
+    """)
+    connection.execute(f"""
+        CREATE TRIGGER market_stats_insert AFTER INSERT ON cars
+        WHEN NOT EXISTS (SELECT 1 FROM bulk_load) BEGIN
+            {MARKET_STATS_ADD}
+        END
+    """)
+    connection.execute(f"""
+        CREATE TRIGGER market_stats_delete AFTER DELETE ON cars
+        WHEN NOT EXISTS (SELECT 1 FROM archiving) BEGIN
+            {MARKET_STATS_REMOVE}
+        END
+    """)
+    connection.execute(f"""
+        CREATE TRIGGER market_stats_update
+        AFTER UPDATE OF make, year, price, seller_login, status ON cars BEGIN
+            {MARKET_STATS_REMOVE}
+            {MARKET_STATS_ADD}
+        END
+    """)
+
+    # Сводки пересчитываются по исправленным статусам; проданные машины из
+    # архива остаются в статистике продаж
+    for table in ("market_stats", "market_prices", "seller_stats"):
+        connection.execute(f"DELETE FROM {table}")
+    for statement in MARKET_STATS_REFRESH:
+        connection.execute(statement, (0,))
+    connection.execute("""
+        INSERT INTO market_stats
+        SELECT make, year, 0, count(*), sum(price) FROM cars_archive WHERE reason = 'sold' GROUP BY 1, 2
+        ON CONFLICT DO UPDATE SET cars_count = cars_count + excluded.cars_count, price_sum = price_sum + excluded.price_sum
+    """)
+    connection.execute(f"""
+        INSERT INTO market_prices
+        SELECT make, year, {price_bucket_sql('price')}, count(*) FROM cars_archive WHERE reason = 'sold'
+        GROUP BY 1, 2, 3
+        ON CONFLICT DO UPDATE SET cars_count = cars_count + excluded.cars_count
+    """)
+    connection.execute("""
+        INSERT INTO seller_stats
+        SELECT seller_login, 0, count(*), sum(price) FROM cars_archive WHERE reason = 'sold' GROUP BY 1
+        ON CONFLICT DO UPDATE SET cars_count = cars_count + excluded.cars_count, price_sum = price_sum + excluded.price_sum
+    """)
+    connection.execute("ANALYZE")
+
+
+@migration
+def add_user_role_index(connection):
+    # Список пользователей администратора листается по логину (индекс UNIQUE),
+    # а с фильтром по роли — по этому индексу: роль, затем логин
+    connection.execute("CREATE INDEX IF NOT EXISTS idx_users_role_login ON users (role, login)")
+    connection.execute("ANALYZE users")
+
+
+@migration
+def add_car_photos(connection):
+    # Фотографии машин лежат файлами вне базы (photos.PhotoStore) под именем из
+    # хеша содержимого; здесь — только хеши в порядке показа. Первая фотография
+    # (position = 0) — обложка, из нее строится миниатюра в таблицах.
+    connection.execute("""
+        CREATE TABLE IF NOT EXISTS car_photos (
+            car_id INTEGER NOT NULL,
+            position INTEGER NOT NULL,
+            digest TEXT NOT NULL,
+            PRIMARY KEY (car_id, position)
+        ) WITHOUT ROWID
+    """)
+
+
+# История цен и статусов: цена — в копейках, разностью с предыдущей записью
+# машины (у первой записи — вся цена), поэтому обычная запись — несколько
+# байт; время — целые секунды unixepoch. Цена на момент записи — сумма
+# разностей до нее. Изменения машины за одну секунду сливаются в одну запись.
+HISTORY_NOW = "CAST(strftime('%s', 'now') AS INTEGER)"
+HISTORY_PRICE = "CAST(round({}.price * 100) AS INTEGER)"
+
+# Добавление в историю и в дневные сводки цен машин с id больше ? одним
+# запросом на таблицу (массовый импорт, как MARKET_STATS_REFRESH)
+PRICE_HISTORY_REFRESH = (
+    f"""
+    INSERT INTO price_history
+    SELECT id, {HISTORY_NOW}, {HISTORY_PRICE.format("cars")}, status FROM cars WHERE id > ?
+    """,
+    f"""
+    INSERT INTO price_days
+    SELECT make, {HISTORY_NOW} / 86400, count(*), sum(price) FROM cars WHERE id > ? GROUP BY make
+    ON CONFLICT DO UPDATE SET offers = offers + excluded.offers, price_sum = price_sum + excluded.price_sum
+    """,
+)
+
+
+@migration
+def add_price_history(connection):
+    # Журнал цен и статусов машин, который только дополняется триггерами. Ключ
+    # (car_id, at) — он же покрывающий индекс: история машины читается одним
+    # проходом по диапазону ключа. Средние цены марок за период берутся из
+    # дневной сводки price_days (предложения: новые машины и новые цены),
+    # а не суммированием разностей по всей истории. Записи машин, ушедших в
+    # архив, остаются.
+    connection.execute("""
+        CREATE TABLE IF NOT EXISTS price_history (
+            car_id INTEGER NOT NULL,
+            at INTEGER NOT NULL,
+            price_delta INTEGER NOT NULL,
+            status INTEGER NOT NULL,
+            PRIMARY KEY (car_id, at)
+        ) WITHOUT ROWID
+    """)
+    connection.execute("""
+        CREATE TABLE IF NOT EXISTS price_days (
+            make TEXT NOT NULL,
+            day INTEGER NOT NULL,
+            offers INTEGER NOT NULL,
+            price_sum REAL NOT NULL,
+            PRIMARY KEY (make, day)
+        ) WITHOUT ROWID
+    """)
+    # История начинается с текущих цен и статусов машин
+    for statement in PRICE_HISTORY_REFRESH:
+        connection.execute(statement, (0,))
+
+    connection.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS price_history_insert AFTER INSERT ON cars
+        WHEN NOT EXISTS (SELECT 1 FROM bulk_load) BEGIN
+            INSERT INTO price_history VALUES (new.id, {HISTORY_NOW}, {HISTORY_PRICE.format("new")}, new.status);
+            INSERT INTO price_days VALUES (new.make, {HISTORY_NOW} / 86400, 1, new.price)
+            ON CONFLICT DO UPDATE SET offers = offers + 1, price_sum = price_sum + excluded.price_sum;
+        END
+    """)
+    connection.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS price_history_update AFTER UPDATE OF price, status ON cars
+        WHEN new.price != old.price OR new.status != old.status BEGIN
+            INSERT INTO price_history
+            VALUES (new.id, {HISTORY_NOW}, {HISTORY_PRICE.format("new")} - {HISTORY_PRICE.format("old")}, new.status)
+            ON CONFLICT DO UPDATE SET price_delta = price_delta + excluded.price_delta, status = excluded.status;
+        END
+    """)
+    connection.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS price_days_update AFTER UPDATE OF price ON cars
+        WHEN new.price != old.price BEGIN
+            INSERT INTO price_days VALUES (new.make, {HISTORY_NOW} / 86400, 1, new.price)
+            ON CONFLICT DO UPDATE SET offers = offers + 1, price_sum = price_sum + excluded.price_sum;
+        END
+    """)
+
+
+def _create_market_stats_triggers(connection):
+    create_price_buckets(connection)
+    for trigger in ("market_stats_insert", "market_stats_delete", "market_stats_update"):
+        connection.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+    connection.execute(f"""
+        CREATE TRIGGER market_stats_insert AFTER INSERT ON cars
+        WHEN NOT EXISTS (SELECT 1 FROM bulk_load) BEGIN
+            {MARKET_STATS_ADD}
+        END
+    """)
+    connection.execute(f"""
+        CREATE TRIGGER market_stats_delete AFTER DELETE ON cars
+        WHEN NOT EXISTS (SELECT 1 FROM archiving) BEGIN
+            {MARKET_STATS_REMOVE}
+        END
+    """)
+    connection.execute(f"""
+        CREATE TRIGGER market_stats_update
+        AFTER UPDATE OF make, year, price, seller_login, status ON cars BEGIN
+            {MARKET_STATS_REMOVE}
+            {MARKET_STATS_ADD}
+        END
+    """)
+
+
+@migration
+def use_price_bucket_function(connection):
+    # Триггеры сводок считали корзину цены через ln(), которого нет в сборках
+    # SQLite без математических функций. Значения корзин те же, поэтому
+    # сводки не пересчитываются.
+    _create_market_stats_triggers(connection)
+
+
+@migration
+def drop_archived_car_photos(connection):
+    # Фотографии машин, ушедших в архив, больше не показываются; теперь их
+    # строки удаляются вместе с машиной, а здесь — оставшиеся от прежних версий
+    connection.execute("DELETE FROM car_photos WHERE car_id NOT IN (SELECT id FROM cars)")
+
+
+@migration
+def use_price_bucket_table(connection):
+    # Триггеры, созданные прежней use_price_bucket_function, вызывали функцию
+    # price_bucket, которую регистрировало только приложение: в любом другом
+    # соединении запись в cars падала. Теперь корзина читается из таблицы
+    # price_buckets, значения корзин те же.
+    _create_market_stats_triggers(connection)
+
+
+@migration
+def add_fts_column_vocab(connection):
+    # Словарь cars_fts по столбцам: индекс живой фильтрации проверяет по нему,
+    # что префикс встречается только в марках
+    connection.execute("CREATE VIRTUAL TABLE IF NOT EXISTS cars_fts_columns USING fts5vocab(cars_fts, 'col')")
@@ -0,0 +1,385 @@
+import sys
+from array import array
+
+from PyQt6.QtCore import QAbstractTableModel, QModelIndex, Qt
+
+from database import SOLD, status_label
+from profiling import timed
+
+
+CAR_HEADERS = ["ID", "Марка", "Модель", "Год", "Цена", "Описание", "Продавец", "Статус"]
+USER_HEADERS = ["ID", "Логин", "Роль"]
+
+MAKE_COLUMN = 1
+PRICE_COLUMN = 4
+STATUS_COLUMN = 7
+BUYER_COLUMN = 8
+
+# Столбец тренда цены идет после CAR_HEADERS, когда у модели заданы trends
+TREND_COLUMN = len(CAR_HEADERS)
+TREND_HEADER = "К рынку"
+
+
+class CarColumnStore:
+    """Компактное колоночное хранилище строк таблицы cars.
+
+    Числа (и статус) лежат в array, повторяющиеся строки (марка, модель,
+    продавец, покупатель) интернируются, так что одна строка таблицы стоит
+    несколько десятков байт вместо кортежа и восьми QTableWidgetItem.
+    """
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.ids = array("q")
+        self.makes = []
+        self.models = []
+        self.years = array("l")
+        self.prices = array("d")
+        self.descriptions = []
+        self.sellers = []
+        self.statuses = array("b")
+        self.buyers = []
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _columns(self):
+        return (
+            self.ids, self.makes, self.models, self.years,
+            self.prices, self.descriptions, self.sellers, self.statuses, self.buyers,
+        )
+
+    @staticmethod
+    def _prepare(row):
+        intern = sys.intern
+        car_id, make, model, year, price, description, seller, status, buyer = row
+        return (car_id, intern(make), intern(model), year, price,
+                description or "", intern(seller), status, buyer and intern(buyer))
+
+    def extend(self, rows):
+        for row in rows:
+            for column, value in zip(self._columns(), self._prepare(row)):
+                column.append(value)
+
+    def insert(self, position, row):
+        for column, value in zip(self._columns(), self._prepare(row)):
+            column.insert(position, value)
+
+    def replace(self, position, row):
+        for column, value in zip(self._columns(), self._prepare(row)):
+            column[position] = value
+
+    def delete(self, position):
+        for column in self._columns():
+            del column[position]
+
+    def value(self, row, column):
+        return self._columns()[column][row]
+
+    def row(self, position):
+        """Строка в виде кортежа из CAR_COLUMNS."""
+        return tuple(column[position] for column in self._columns())
+
+
+def format_price(price):
+    if price == int(price):
+        price = int(price)
+    return f"{price} руб"
+
+
+def format_trend(price, average):
+    """Цена машины относительно средней цены марки: "▼ 12%" — на 12% дешевле."""
+    if not average:
+        return ""
+    change = round((price / average - 1) * 100)
+    if not change:
+        return "0%"
+    return f"{'▲' if change > 0 else '▼'} {abs(change)}%"
+
+
+class CarTableModel(QAbstractTableModel):
+    """Модель таблицы машин, которую QTableView подгружает порциями.
+
+    Источник строк — функция loader(batch_size), возвращающая очередную
+    порцию строк (например, cursor.fetchmany). Пустая или неполная порция
+    означает, что данных больше нет.
+    """
+
+    def __init__(self, parent=None, batch_size=256):
+        super().__init__(parent)
+        self.batch_size = batch_size
+        self._store = CarColumnStore()
+        self._loader = None
+        # photos.ThumbnailCache: миниатюра обложки в столбце ID
+        self.thumbnails = None
+        # {марка: средняя цена} (Database.make_average_prices): столбец тренда цены
+        self.trends = None
+
+    def set_loader(self, loader):
+        self.beginResetModel()
+        self._store.clear()
+        self._loader = loader
+        self.endResetModel()
+        # Первая порция читается сразу, остальные — по запросу представления
+        self.fetchMore()
+
+    def _value(self, row, column):
+        return self._store.value(row, column)
+
+    def car_id(self, row):
+        return self._value(row, 0)
+
+    def car_value(self, row, column):
+        return self._value(row, column)
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self._store)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(CAR_HEADERS) + (self.trends is not None)
+
+    def set_trends(self, averages):
+        """Задает средние цены марок; первый вызов добавляет столбец тренда."""
+        if self.trends is None:
+            self.beginInsertColumns(QModelIndex(), TREND_COLUMN, TREND_COLUMN)
+            self.trends = averages
+            self.endInsertColumns()
+            return
+        self.trends = averages
+        if self.rowCount():
+            self.dataChanged.emit(self.index(0, TREND_COLUMN), self.index(self.rowCount() - 1, TREND_COLUMN))
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid():
+            return None
+        if index.column() == TREND_COLUMN:
+            if role != Qt.ItemDataRole.DisplayRole:
+                return None
+            price = self._value(index.row(), PRICE_COLUMN)
+            if price is None:
+                return None
+            return format_trend(price, self.trends.get(self._value(index.row(), MAKE_COLUMN)))
+        if role == Qt.ItemDataRole.DecorationRole:
+            # Представление спрашивает картинки только у строк, которые рисует
+            if index.column() or self.thumbnails is None:
+                return None
+            return self.thumbnails.pixmap(self.car_id(index.row()))
+        if role != Qt.ItemDataRole.DisplayRole:
+            return None
+        value = self._value(index.row(), index.column())
+        if value is None:
+            return None
+        if index.column() == PRICE_COLUMN:
+            return format_price(value)
+        if index.column() == STATUS_COLUMN:
+            # Логин покупателя нужен только проданным машинам
+            return status_label(value, self._value(index.row(), BUYER_COLUMN) if value == SOLD else None)
+        return str(value)
+
+    def headerData(self, section, orientation, role=Qt.ItemDataRole.DisplayRole):
+        if role == Qt.ItemDataRole.DisplayRole and orientation == Qt.Orientation.Horizontal:
+            return TREND_HEADER if section == TREND_COLUMN else CAR_HEADERS[section]
+        return super().headerData(section, orientation, role)
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and self._loader is not None
+
+    def fetchMore(self, parent=QModelIndex()):
+        if parent.isValid() or self._loader is None:
+            return
+        rows = self._loader(self.batch_size)
+        if len(rows) < self.batch_size:
+            self._loader = None
+        if not rows:
+            return
+        first = len(self._store)
+        self.beginInsertRows(QModelIndex(), first, first + len(rows) - 1)
+        self._store.extend(rows)
+        self.endInsertRows()
+
+
+class UserTableModel(QAbstractTableModel):
+    """Модель таблицы пользователей, которую QTableView подгружает страницами.
+
+    loader(batch_size) возвращает следующую страницу строк (id, логин, роль),
+    как paging.user_loader; неполная страница означает конец списка.
+    Удаленные пользователи убираются из модели точечно (remove_ids).
+    """
+
+    def __init__(self, parent=None, batch_size=256):
+        super().__init__(parent)
+        self.batch_size = batch_size
+        self._ids = array("q")
+        self._logins = []
+        self._roles = []
+        self._loader = None
+
+    @timed("render")
+    def set_loader(self, loader, rows=None):
+        """Показывает список loader; rows — уже прочитанная первая страница."""
+        self.beginResetModel()
+        self._ids = array("q")
+        self._logins = []
+        self._roles = []
+        self._loader = loader
+        self.endResetModel()
+        if rows is None:
+            self.fetchMore()
+        else:
+            self._append(rows)
+
+    def user(self, row):
+        return self._ids[row], self._logins[row], self._roles[row]
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self._ids)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(USER_HEADERS)
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid() or role != Qt.ItemDataRole.DisplayRole:
+            return None
+        return str(self.user(index.row())[index.column()])
+
+    def headerData(self, section, orientation, role=Qt.ItemDataRole.DisplayRole):
+        if role == Qt.ItemDataRole.DisplayRole and orientation == Qt.Orientation.Horizontal:
+            return USER_HEADERS[section]
+        return super().headerData(section, orientation, role)
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and self._loader is not None
+
+    @timed("render")
+    def fetchMore(self, parent=QModelIndex()):
+        if self.canFetchMore(parent):
+            self._append(self._loader(self.batch_size))
+
+    def _append(self, rows):
+        if len(rows) < self.batch_size:
+            self._loader = None
+        if not rows:
+            return
+        first = len(self._ids)
+        self.beginInsertRows(QModelIndex(), first, first + len(rows) - 1)
+        for user_id, login, role in rows:
+            self._ids.append(user_id)
+            self._logins.append(login)
+            self._roles.append(sys.intern(role))
+        self.endInsertRows()
+
+    def remove_ids(self, ids):
+        """Убирает строки пользователей ids; соседние строки убираются одним блоком."""
+        ids = set(ids)
+        positions = [row for row, user_id in enumerate(self._ids) if user_id in ids]
+        # С конца, чтобы номера еще не убранных строк не сдвигались
+        while positions:
+            last = first = positions.pop()
+            while positions and positions[-1] == first - 1:
+                first = positions.pop()
+            self.beginRemoveRows(QModelIndex(), first, last)
+            del self._ids[first:last + 1]
+            del self._logins[first:last + 1]
+            del self._roles[first:last + 1]
+            self.endRemoveRows()
+
+
+class PagedCarTableModel(CarTableModel):
+    """Модель таблицы машин поверх KeysetPager.
+
+    Хранит только число строк: данные берутся из страниц пейджера, который
+    держит в памяти ограниченное окно страниц. Поэтому память не зависит
+    от размера каталога. Изменения из ChangeBus применяются точечно через
+    apply_changes, без перезагрузки таблицы.
+    """
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._pager = None
+        self._rows = 0
+        self._pages_shown = 0
+
+    @property
+    def pager(self):
+        return self._pager
+
+    @timed("render")
+    def set_pager(self, pager):
+        self.beginResetModel()
+        self._pager = pager
+        self._rows = 0
+        self._pages_shown = 0
+        self.endResetModel()
+        self.fetchMore()
+
+    def _value(self, row, column):
+        number, offset = self._pager.locate(row)
+        store = self._pager.page(number)
+        return store.value(offset, column) if offset < len(store) else None
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else self._rows
+
+    def canFetchMore(self, parent=QModelIndex()):
+        if parent.isValid() or self._pager is None:
+            return False
+        # Страницы могли быть прочитаны заранее, до того как модель их показала
+        return self._pages_shown < self._pager.loaded_pages or not self._pager.exhausted
+
+    @timed("render")
+    def fetchMore(self, parent=QModelIndex()):
+        if not self.canFetchMore(parent):
+            return
+        number = self._pages_shown
+        rows = len(self._pager.page(number))
+        self._pages_shown += 1
+        self._pager.prefetch(number + 1)
+        if not rows:
+            return
+        self.beginInsertRows(QModelIndex(), self._rows, self._rows + rows - 1)
+        self._rows += rows
+        self.endInsertRows()
+
+    @timed("render")
+    def apply_changes(self, changes):
+        """Точечно применяет изменения машин: затрагиваются только измененные строки."""
+        if self._pager is None:
+            return
+        self._pager.apply_changes(changes, self._begin_change, self._end_change)
+        # Новые строки в конце уже дочитанного списка иначе не появятся до прокрутки
+        while self._pager.exhausted and self.canFetchMore():
+            self.fetchMore()
+
+    @timed("render")
+    def insert_rows(self, rows):
+        """Показывает строки, которых еще нет в базе; убираются они изменением 'delete'."""
+        if self._pager is None:
+            return
+        self._pager.insert_rows(rows, self._begin_change, self._end_change)
+        while self._pager.exhausted and self.canFetchMore():
+            self.fetchMore()
+
+    def _begin_change(self, op, number, offset):
+        # Страницы, которые модель еще не показала, обновляются без сигналов
+        if number >= self._pages_shown:
+            return
+        row = self._pager.row_number(number, offset)
+        if op == "remove":
+            self.beginRemoveRows(QModelIndex(), row, row)
+        elif op == "insert":
+            self.beginInsertRows(QModelIndex(), row, row)
+
+    def _end_change(self, op, number, offset):
+        if number >= self._pages_shown:
+            return
+        row = self._pager.row_number(number, offset)
+        if op == "remove":
+            self._rows -= 1
+            self.endRemoveRows()
+        elif op == "insert":
+            self._rows += 1
+            self.endInsertRows()
+        else:
+            self.dataChanged.emit(self.index(row, 0), self.index(row, self.columnCount() - 1))
@@ -0,0 +1,425 @@
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from database import AVAILABLE, CAR_FIELDS, sort_keys
+from models import CarColumnStore
+from search import TOKEN_RE
+
+
+_prefetch_executor = None
+
+# Сколько совпадений поиска еще ранжируется по bm25. bm25 оценивает каждое
+# совпадение, а при широком запросе (например, только марка) оценки почти
+# одинаковы, поэтому такие результаты идут в порядке id.
+RANK_LIMIT = 2000
+
+# Примерная память одной строки в CarColumnStore и одного запомненного id
+# (с ключом сортировки, если он есть) — для оценки размера пейджера
+ROW_BYTES = 160
+ID_BYTES = 16
+SORT_VALUES_BYTES = 72
+
+
+def prefetch_executor():
+    """Общий фоновый поток для предзагрузки страниц."""
+    global _prefetch_executor
+    if _prefetch_executor is None:
+        _prefetch_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="prefetch")
+    return _prefetch_executor
+
+
+class _Descending:
+    """Часть ключа сортировки, сравниваемая в обратном порядке."""
+
+    __slots__ = ("value",)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __eq__(self, other):
+        return self.value == other.value
+
+    def __lt__(self, other):
+        return other.value < self.value
+
+
+class KeysetPager:
+    """Постраничное чтение каталога с keyset-пагинацией.
+
+    Страницы читаются через Database.car_page по ключу последней строки
+    предыдущей страницы, поэтому каждая страница — это индексный поиск,
+    а не OFFSET. Следующая страница загружается заранее в фоновом потоке.
+
+    order — ключи сортировки, как в car_page. В памяти держится не больше
+    max_pages страниц со строками. Для всех прочитанных страниц хранятся
+    только id строк и значения их полей сортировки: по id вытесненная
+    страница перечитывается, а по значениям изменения из ChangeBus находят
+    место для новых и переехавших строк.
+
+    Если задан поиск без сортировки по цене и совпадений не больше
+    RANK_LIMIT, строки идут по релевантности (order 'RANK'), а ключом
+    страницы служит смещение.
+    """
+
+    def __init__(self, db, page_size=256, max_pages=8, order=None, **filters):
+        self.db = db
+        self.page_size = page_size
+        self.max_pages = max_pages
+        self.order = order
+        search = filters.get("search")
+        if order is None and search and db.count_matches(search, RANK_LIMIT + 1) <= RANK_LIMIT:
+            self.order = "RANK"
+        self.filters = filters
+        self.sort = sort_keys(self.order)
+        # План поиска с сортировкой выбирается по числу совпадений один раз на пейджер
+        self._frequent = db.frequent_search(search) if search and self.sort else None
+        self._sort_columns = [CAR_FIELDS.index(field) for field, _ in self.sort]
+        directions = [direction for _, direction in self.sort]
+        self._directions = directions + directions[:1] if directions else ["ASC"]
+        self.exhausted = False
+        self._pages = OrderedDict()
+        self._page_ids = []
+        self._page_values = []
+        self._keys = []
+        self._starts = None
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    @property
+    def loaded_pages(self):
+        """Количество уже прочитанных страниц."""
+        return len(self._page_ids)
+
+    def memory_size(self):
+        """Примерный объем памяти страниц и запомненных ключей в байтах."""
+        with self._lock:
+            rows = sum(len(store) for store in self._pages.values())
+            ids = sum(len(page_ids) for page_ids in self._page_ids)
+        return rows * ROW_BYTES + ids * (ID_BYTES + (SORT_VALUES_BYTES if self.sort else 0))
+
+    def _values(self, row):
+        """Значения полей сортировки строки (кортежа из CAR_COLUMNS)."""
+        return tuple(row[column] for column in self._sort_columns)
+
+    def _row_key(self, row):
+        """Ключ строки для car_page: значения полей сортировки и id."""
+        return self._values(row) + (row[0],)
+
+    def _sort_key(self, key):
+        """Ключ, возрастающий в порядке показа строк."""
+        if "DESC" not in self._directions:
+            return key
+        return tuple(_Descending(part) if direction == "DESC" else part
+                     for part, direction in zip(key, self._directions))
+
+    def _key(self, number, store):
+        return self._row_key(store.row(len(store) - 1))
+
+    def _read_page(self, number):
+        if not number:
+            after = None
+        elif self.order == "RANK":
+            # Смещение считается по текущим строкам: удаленные строки его уменьшают
+            after = (self._page_starts()[number],)
+        else:
+            after = self._keys[number - 1]
+        return self.db.car_page(after, self.page_size, self.order, frequent=self._frequent, **self.filters)
+
+    def _load(self, number):
+        store = CarColumnStore()
+        store.extend(self._read_page(number))
+        return store
+
+    def _reload(self, number):
+        """Перечитывает вытесненную страницу по сохраненным id."""
+        ids = self._page_ids[number]
+        rows = {row[0]: row for row in self.db.cars_by_ids(ids)}
+        store = CarColumnStore()
+        # Машина могла исчезнуть до того, как шина изменений сообщила об этом
+        store.extend(rows.get(car_id, (car_id, "", "", 0, 0.0, "", "", AVAILABLE, None)) for car_id in ids)
+        return store
+
+    def _is_last(self, number, store):
+        return len(store) < self.page_size
+
+    def _remember(self, number, store):
+        with self._lock:
+            if number == len(self._page_ids):
+                if self._is_last(number, store):
+                    self.exhausted = True
+                if not store:
+                    return
+                self._page_ids.append(array("q", store.ids))
+                self._page_values.append([self._values(store.row(i)) for i in range(len(store))])
+                self._keys.append(self._key(number, store))
+                self._starts = None
+            self._pages[number] = store
+            self._pages.move_to_end(number)
+            while len(self._pages) > self.max_pages:
+                self._pages.popitem(last=False)
+
+    def page(self, number):
+        """Возвращает страницу number; доступны прочитанные страницы и одна следующая."""
+        with self._lock:
+            store = self._pages.get(number)
+            if store is not None:
+                self._pages.move_to_end(number)
+                return store
+            future = self._pending.pop(number, None)
+
+        if future is not None:
+            store = future.result()
+        elif number < len(self._page_ids):
+            store = self._reload(number)
+        else:
+            store = self._load(number)
+        self._remember(number, store)
+        return store
+
+    def prefetch(self, number):
+        """Загружает следующую еще не прочитанную страницу в фоне."""
+        with self._lock:
+            if number != len(self._page_ids) or self.exhausted or number in self._pending:
+                return
+            self._pending[number] = prefetch_executor().submit(self._load, number)
+
+    # Номера строк
+
+    def _page_starts(self):
+        if self._starts is None:
+            starts, total = [], 0
+            for ids in self._page_ids:
+                starts.append(total)
+                total += len(ids)
+            # Последний элемент — начало следующей, еще не прочитанной страницы
+            starts.append(total)
+            self._starts = starts
+        return self._starts
+
+    def locate(self, row):
+        """(номер страницы, смещение в ней) для сквозного номера строки."""
+        starts = self._page_starts()
+        number = min(bisect_right(starts, row), len(starts) - 1) - 1
+        number = max(number, 0)
+        return number, row - starts[number]
+
+    def row_number(self, number, offset):
+        return self._page_starts()[number] + offset
+
+    # Изменения
+
+    def _find(self, car_id):
+        for number, ids in enumerate(self._page_ids):
+            if car_id in ids:
+                return number, ids.index(car_id)
+        return None
+
+    def _matching_rows(self, ids):
+        """Текущие строки из ids, которые подходят под фильтры пейджера."""
+        return self.db.cars_by_ids(ids, **self.filters)
+
+    def _moved(self, position, row):
+        number, offset = position
+        return self._page_values[number][offset] != self._values(row)
+
+    def _insert_position(self, row):
+        """Куда вставить новую строку: (страница, смещение) или None, если ее
+        место еще не прочитано и она появится при прокрутке."""
+        if self.order == "RANK":
+            # Место по релевантности неизвестно; в дочитанный список строка идет в конец
+            if not self.exhausted or not self._page_ids:
+                return None
+            return len(self._page_ids) - 1, len(self._page_ids[-1])
+        key = self._sort_key(self._row_key(row))
+        boundaries = [self._sort_key(boundary) for boundary in self._keys]
+        number = bisect_left(boundaries, key)
+        if number == len(boundaries):
+            if not self.exhausted:
+                return None
+            if not boundaries:
+                return 0, 0
+            number -= 1
+        keys = [self._sort_key(values + (car_id,))
+                for values, car_id in zip(self._page_values[number], self._page_ids[number])]
+        return number, bisect_left(keys, key)
+
+    def apply_changes(self, changes, before, after):
+        """Применяет изменения к прочитанным страницам.
+
+        Для каждой затронутой строки вызывает before(op, страница, смещение),
+        меняет данные и вызывает after(op, страница, смещение); op — 'remove',
+        'update' или 'insert'.
+        """
+        # Заранее прочитанная страница могла устареть; она перечитается при показе
+        with self._lock:
+            self._pending.clear()
+        ops = {}
+        for change in changes:
+            # Вставка с последующим изменением — все равно вставка
+            if not (ops.get(change.car_id) == "insert" and change.op == "update"):
+                ops[change.car_id] = change.op
+        current = [car_id for car_id, op in ops.items() if op != "delete"]
+        rows = {row[0]: row for row in self._matching_rows(current)} if current else {}
+
+        for car_id in ops:
+            position = self._find(car_id)
+            row = rows.get(car_id)
+            if position is not None and row is None:
+                self._apply("remove", position, before, after)
+            elif position is not None and self._moved(position, row):
+                # Изменилось поле сортировки, и строка переезжает
+                self._apply("remove", position, before, after)
+                position = self._insert_position(row)
+                if position is not None:
+                    self._apply("insert", position, before, after, row)
+            elif position is not None:
+                self._apply("update", position, before, after, row)
+            elif row is not None:
+                position = self._insert_position(row)
+                if position is not None:
+                    self._apply("insert", position, before, after, row)
+
+    def insert_rows(self, rows, before, after):
+        """Вставляет строки, которых еще нет в базе (например, машины, ждущие
+        фиксации в очереди записей), на их место по порядку сортировки."""
+        for row in rows:
+            position = self._insert_position(row)
+            if position is not None:
+                self._apply("insert", position, before, after, row)
+
+    def _apply(self, op, position, before, after, row=None):
+        number, offset = position
+        before(op, number, offset)
+        with self._lock:
+            store = self._pages.get(number)
+            if op == "remove":
+                del self._page_ids[number][offset]
+                del self._page_values[number][offset]
+                if store is not None:
+                    store.delete(offset)
+            elif op == "update":
+                self._page_values[number][offset] = self._values(row)
+                if store is not None:
+                    store.replace(offset, row)
+            else:
+                if number == len(self._page_ids):
+                    self._page_ids.append(array("q"))
+                    self._page_values.append([])
+                    self._keys.append(self._row_key(row))
+                    store = self._pages[number] = CarColumnStore()
+                self._page_ids[number].insert(offset, row[0])
+                self._page_values[number].insert(offset, self._values(row))
+                if store is not None:
+                    store.insert(offset, row)
+                # Строка после последнего ключа последней страницы сдвигает ее границу
+                if number == len(self._keys) - 1 and offset == len(self._page_ids[number]) - 1:
+                    self._keys[number] = self._row_key(row)
+            self._starts = None
+        after(op, number, offset)
+
+
+def _ignore_change(op, number, offset):
+    pass
+
+
+_CacheEntry = namedtuple("_CacheEntry", "pager seq")
+
+
+class PagerCache:
+    """LRU-кэш пейджеров каталога по нормализованным параметрам фильтра.
+
+    Повторный выбор той же марки, цен и сортировки показывает уже прочитанные
+    страницы вместо нового запроса. Пейджер в кэше отдается таблице через
+    take и возвращается через put, когда таблица переключается на другой;
+    пока пейджер в кэше, изменения из ChangeBus применяются к нему через
+    apply_changes. Запись помнит seq журнала car_changes, до которого
+    применены изменения, и при take отбрасывается, если в журнале есть более
+    новые записи (например, из другого процесса, еще не опрошенного шиной).
+
+    Объем ограничен max_bytes по оценке KeysetPager.memory_size; первыми
+    вытесняются давно не использованные пейджеры. Счетчики hits, misses,
+    evictions и invalidations помогают подобрать размер. Кэш используется
+    только из GUI-потока.
+    """
+
+    def __init__(self, db, max_bytes=16 * 2 ** 20):
+        self.db = db
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def key(order=None, search=None, available_only=False, min_price=None, max_price=None, **filters):
+        """Ключ кэша: параметры open_pager, приведенные к одному виду."""
+        search = " ".join(TOKEN_RE.findall(search.lower())) if search else ""
+        order = tuple(order) if isinstance(order, (list, tuple)) else order
+        prices = tuple(None if price is None else float(price) for price in (min_price, max_price))
+        return (order, search or None, bool(available_only)) + prices + tuple(sorted(filters.items()))
+
+    def __len__(self):
+        return len(self._entries)
+
+    def take(self, key):
+        """Забирает из кэша актуальный пейджер или возвращает None."""
+        entry = self._entries.pop(key, None)
+        if entry is not None and entry.seq < self.db.last_change_seq():
+            self.invalidations += 1
+            entry = None
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry.pager
+
+    def put(self, key, pager, seq):
+        """Возвращает пейджер в кэш; seq — последняя примененная к нему запись журнала."""
+        self._entries[key] = _CacheEntry(pager, seq)
+        self._entries.move_to_end(key)
+        total = sum(entry.pager.memory_size() for entry in self._entries.values())
+        while total > self.max_bytes and len(self._entries) > 1:
+            _, evicted = self._entries.popitem(last=False)
+            total -= evicted.pager.memory_size()
+            self.evictions += 1
+
+    def apply_changes(self, changes):
+        for key, entry in self._entries.items():
+            entry.pager.apply_changes(changes, _ignore_change, _ignore_change)
+            self._entries[key] = _CacheEntry(entry.pager, max(entry.seq, changes[-1].seq))
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self):
+        return {
+            "entries": len(self._entries), "hits": self.hits, "misses": self.misses,
+            "evictions": self.evictions, "invalidations": self.invalidations,
+            "bytes": sum(entry.pager.memory_size() for entry in self._entries.values()),
+        }
+
+
+def open_pager(db, **options):
+    """Создает пейджер и сразу читает первую страницу; удобно вызывать в фоновом потоке."""
+    pager = KeysetPager(db, **options)
+    pager.page(0)
+    return pager
+
+
+def user_loader(db, prefix=None, role=None):
+    """Функция loader(limit) для UserTableModel: страницы Database.user_page
+    подряд, каждая — по логину последней строки предыдущей."""
+    after = None
+
+    def load(limit):
+        nonlocal after
+        rows = db.user_page(after, limit, prefix, role)
+        if rows:
+            after = rows[-1][1]
+        return rows
+
+    return load
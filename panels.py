@@ -0,0 +1,825 @@
+"""Панели ролей: администратор, продавец и покупатель.
+
+Модуль импортируется при первом входе, а не при запуске приложения:
+окну входа не нужны ни таблицы машин, ни пейджеры и индекс фильтрации.
+"""
+import sqlite3
+from functools import partial
+from itertools import count
+
+from PyQt6.QtCore import Qt, QTimer
+from PyQt6.QtWidgets import (
+    QWidget, QVBoxLayout, QHBoxLayout, QLineEdit, QPushButton, QLabel, QComboBox, QMessageBox,
+    QTableWidget, QTableWidgetItem, QTextEdit, QDialog, QHeaderView, QTableView, QAbstractItemView,
+    QFileDialog, QTabWidget
+)
+
+from analytics import market_report
+from database import ALREADY_BOUGHT, AVAILABLE, NOT_AVAILABLE
+from events import CarChange
+from filter_index import CatalogueIndex, open_filter_pager
+from inventory import export_file, import_file, validate_car
+from models import PagedCarTableModel, UserTableModel, format_price
+from paging import PagerCache, open_pager, user_loader
+from photos import PHOTO_FILES, THUMBNAIL_SIZE, attach_photos
+from profiling import timed
+
+
+INVENTORY_FILES = "CSV и JSONL (*.csv *.jsonl);;Все файлы (*)"
+
+# Столбцы таблицы машин, по которым сортирует база, и поля для car_page
+SORTABLE_COLUMNS = {1: "make", 2: "model", 3: "year", 4: "price"}
+
+# Сколько столбцов участвует в сортировке; равные строки дальше идут по id
+MAX_SORT_KEYS = 2
+
+
+def create_car_table(model, on_sort=None, thumbnails=None):
+    """Таблица машин поверх PagedCarTableModel: строки подгружаются по мере прокрутки.
+
+    Если задан on_sort, щелчок по заголовку вызывает on_sort(столбец, порядок);
+    сама таблица строки не сортирует, их заново читает пейджер. thumbnails —
+    photos.ThumbnailCache для миниатюр обложек; без него таблица без картинок.
+    """
+    table = QTableView()
+    table.setModel(model)
+    if thumbnails is not None:
+        model.thumbnails = thumbnails
+        table.setIconSize(THUMBNAIL_SIZE)
+        # Готовые миниатюры дорисовываются в видимой части таблицы
+        thumbnails.ready.connect(table.viewport().update)
+    table.setSelectionBehavior(QAbstractItemView.SelectionBehavior.SelectRows)
+    table.setSelectionMode(QAbstractItemView.SelectionMode.SingleSelection)
+    # Единая высота строк задается один раз, а не setRowHeight на каждую строку
+    table.verticalHeader().setDefaultSectionSize(100)
+    if on_sort is not None:
+        header = table.horizontalHeader()
+        header.setSectionsClickable(True)
+        header.setSortIndicatorShown(True)
+        header.setSortIndicator(-1, Qt.SortOrder.AscendingOrder)
+        header.sortIndicatorChanged.connect(on_sort)
+    return table
+
+
+def header_sort(sort, column, order):
+    """Ключи сортировки после щелчка по заголовку column или None, если по
+    нему сортировать нельзя. Столбец становится первым ключом, а прежний
+    первый ключ — вторым, поэтому равные значения сохраняют прежний порядок."""
+    field = SORTABLE_COLUMNS.get(column)
+    if field is None:
+        return None
+    direction = "ASC" if order == Qt.SortOrder.AscendingOrder else "DESC"
+    previous = tuple(key for key in sort if key[0] != field)
+    return ((field, direction),) + previous[:MAX_SORT_KEYS - 1]
+
+
+def show_sort(table, sort):
+    """Показывает первый ключ sort стрелкой в заголовке таблицы."""
+    column, order = -1, Qt.SortOrder.AscendingOrder
+    if sort:
+        field, direction = sort[0]
+        column = next(column for column, name in SORTABLE_COLUMNS.items() if name == field)
+        if direction == "DESC":
+            order = Qt.SortOrder.DescendingOrder
+    header = table.horizontalHeader()
+    header.blockSignals(True)
+    header.setSortIndicator(column, order)
+    header.blockSignals(False)
+
+
+def parse_price(text):
+    """Цена из поля ввода или None, если поле пустое или введено не число"""
+    try:
+        return float(text) if text.strip() else None
+    except ValueError:
+        return None
+
+
+class AdminPanel(QWidget):
+    # Задержка перед поиском, чтобы не перечитывать список на каждое нажатие
+    FILTER_DELAY_MS = 150
+
+    ROLE_CHOICES = [("Все роли", None), ("Админ", "Админ"), ("Продавец", "Продавец"), ("Покупатель", "Покупатель")]
+
+    def __init__(self, parent):
+        super().__init__()
+        self.parent = parent
+        self.setup_ui()
+
+    def setup_ui(self):
+        """Создаем интерфейс для управления пользователями"""
+        layout = QVBoxLayout()
+
+        self.search_input = QLineEdit()
+        self.search_input.setPlaceholderText("Поиск по началу логина")
+        self.role_combo = QComboBox()
+        for text, role in self.ROLE_CHOICES:
+            self.role_combo.addItem(text, role)
+
+        # Список читается страницами по мере прокрутки; выбрать можно несколько строк
+        self.users_model = UserTableModel(self)
+        self.users_table = QTableView()
+        self.users_table.setModel(self.users_model)
+        self.users_table.setSelectionBehavior(QAbstractItemView.SelectionBehavior.SelectRows)
+        self.users_table.setSelectionMode(QAbstractItemView.SelectionMode.ExtendedSelection)
+
+        self.filter_timer = QTimer(self)
+        self.filter_timer.setSingleShot(True)
+        self.filter_timer.setInterval(self.FILTER_DELAY_MS)
+        self.filter_timer.timeout.connect(self.load_users)
+        self.search_input.textChanged.connect(self.filter_timer.start)
+        self.role_combo.currentIndexChanged.connect(self.load_users)
+
+        delete_user_button = QPushButton("Удалить выбранных пользователей")
+        show_cars_button = QPushButton("Показать список машин")
+        show_stats_button = QPushButton("Статистика рынка")
+        back_button = QPushButton("Выход")
+
+        delete_user_button.clicked.connect(self.delete_user)
+        show_cars_button.clicked.connect(self.show_cars_list)
+        show_stats_button.clicked.connect(self.show_market_stats)
+        back_button.clicked.connect(self.parent.show_login_window)
+
+        filters_layout = QHBoxLayout()
+        filters_layout.addWidget(self.search_input)
+        filters_layout.addWidget(self.role_combo)
+        layout.addLayout(filters_layout)
+        layout.addWidget(self.users_table)
+        layout.addWidget(delete_user_button)
+        layout.addWidget(show_cars_button)
+        layout.addWidget(show_stats_button)
+        layout.addWidget(back_button)
+
+        self.setLayout(layout)
+
+    def load_users(self):
+        """Показывает пользователей с текущими фильтрами; первая страница читается в фоне."""
+        self.filter_timer.stop()
+        loader = user_loader(self.parent.db, self.search_input.text().strip(), self.role_combo.currentData())
+        self.parent.queries.submit(
+            "admin_users", loader, partial(self.users_model.set_loader, loader), self.users_model.batch_size,
+            error_callback=self.parent.show_query_error,
+        )
+
+    def delete_user(self):
+        rows = sorted(index.row() for index in self.users_table.selectionModel().selectedRows())
+        if not rows:
+            QMessageBox.warning(self, "Ошибка", "Выберите пользователей для удаления.")
+            return
+
+        users = [self.users_model.user(row) for row in rows]
+        if any(user_id == self.parent.current_user[0] for user_id, _, _ in users):
+            QMessageBox.warning(self, "Ошибка", "Вы не можете удалить себя!")
+            return
+        if any(role == "Админ" for _, _, role in users):
+            QMessageBox.warning(self, "Ошибка", "Невозможно удалить админа!")
+            return
+
+        # Все выбранные удаляются одной транзакцией в очереди записей, а после
+        # фиксации из таблицы убираются только их строки, без перечитывания списка
+        ids = [user_id for user_id, _, _ in users]
+        self.parent.writes.submit(
+            [("delete_users", (ids,))], partial(self.users_deleted, users),
+            error_callback=self.parent.show_query_error,
+        )
+
+    def users_deleted(self, users, results):
+        for _, login, _ in users:
+            self.parent.credentials.forget(login)
+        self.users_model.remove_ids([user_id for user_id, _, _ in users])
+
+        if len(users) == 1:
+            QMessageBox.information(self, "Успех", "Пользователь успешно удалён!")
+        else:
+            QMessageBox.information(self, "Успех", f"Удалено пользователей: {len(users)}")
+
+    def show_cars_list(self):
+        self.parent.admin_cars_window.load_car_list()
+        self.parent.central_widget.setCurrentWidget(self.parent.admin_cars_window)
+        self.parent.setWindowTitle("Список машин")
+
+    def show_market_stats(self):
+        self.parent.market_stats_window.load_stats()
+        self.parent.central_widget.setCurrentWidget(self.parent.market_stats_window)
+        self.parent.setWindowTitle("Статистика рынка")
+
+
+class AdminCarsWindow(QWidget):
+    def __init__(self, parent):
+        super().__init__(parent)
+        self.parent = parent
+        self.setup_ui()
+
+    def setup_ui(self):
+        layout = QVBoxLayout()
+
+        # Таблица для списка машин
+        self.car_model = PagedCarTableModel(self)
+        self.car_list_table = create_car_table(self.car_model, thumbnails=self.parent.thumbnails)
+
+        # Автоматическое растягивание столбцов
+        self.car_list_table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Stretch)
+
+        # Устанавливаем минимальные ширины для столбцов
+        self.car_list_table.setColumnWidth(0, 50)  # ID
+        self.car_list_table.setColumnWidth(1, 150)  # Марка
+        self.car_list_table.setColumnWidth(2, 150)  # Модель
+        self.car_list_table.setColumnWidth(4, 100)  # Цена
+
+        # Кнопки "Удалить машину" и "Назад"
+        delete_car_button = QPushButton("Удалить машину")
+        delete_car_button.clicked.connect(self.delete_car)
+
+        back_button = QPushButton("Назад")
+        back_button.clicked.connect(self.parent.show_admin_panel)
+
+        # Добавляем все элементы в layout
+        layout.addWidget(self.car_list_table)
+        layout.addWidget(delete_car_button)
+        layout.addWidget(back_button)
+
+        self.setLayout(layout)
+
+    def apply_changes(self, changes):
+        self.car_model.apply_changes(changes)
+
+    def load_car_list(self):
+        """Загружаем данные о машинах в таблицу"""
+        self.parent.queries.submit(
+            "admin_cars", partial(open_pager, self.parent.db), self.car_model.set_pager,
+            error_callback=self.parent.show_query_error,
+        )
+
+    def delete_car(self):
+        selected_row = self.car_list_table.currentIndex().row()
+        if selected_row == -1:
+            QMessageBox.warning(self, "Ошибка", "Выберите машину для удаления.")
+            return
+
+        car_id = self.car_model.car_id(selected_row)
+
+        # Строка убирается сразу, а удаление ждет блокировку записи в очереди
+        # записей; если оно не прошло, строка возвращается
+        self.car_model.apply_changes([CarChange(0, car_id, "delete", None, None, None)])
+        self.parent.writes.submit(
+            [("delete_car", (car_id,))], self.car_deleted, partial(self.delete_failed, car_id),
+        )
+
+    def car_deleted(self, results):
+        QMessageBox.information(self, "Успех", "Машина успешно удалена!")
+        self.parent.changes.poll(force=True)
+
+    def delete_failed(self, car_id, error):
+        self.car_model.apply_changes([CarChange(0, car_id, "update", None, None, None)])
+        self.parent.show_query_error(error)
+
+
+
+
+class MarketStatsWindow(QWidget):
+    """Статистика рынка: цены по маркам и годам, продажи продавцов."""
+
+    # Изменения машин перечитывают статистику не чаще раза в REFRESH_DELAY_MS
+    REFRESH_DELAY_MS = 1000
+
+    GROUP_HEADERS = ["Марка", "Год", "В продаже", "Продано", "Доля продаж", "Средняя цена", "Медиана", "90%"]
+    SELLER_HEADERS = ["Продавец", "В продаже", "Продано", "Выручка"]
+
+    def __init__(self, parent):
+        super().__init__(parent)
+        self.parent = parent
+        self.setup_ui()
+
+    def setup_ui(self):
+        layout = QVBoxLayout()
+
+        self.totals_label = QLabel()
+        self.makes_table = self._create_table(self.GROUP_HEADERS)
+        self.groups_table = self._create_table(self.GROUP_HEADERS)
+        self.sellers_table = self._create_table(self.SELLER_HEADERS)
+
+        tabs = QTabWidget()
+        tabs.addTab(self.makes_table, "По маркам")
+        tabs.addTab(self.groups_table, "По маркам и годам")
+        tabs.addTab(self.sellers_table, "Продавцы")
+
+        self.refresh_timer = QTimer(self)
+        self.refresh_timer.setSingleShot(True)
+        self.refresh_timer.setInterval(self.REFRESH_DELAY_MS)
+        self.refresh_timer.timeout.connect(self.load_stats)
+
+        back_button = QPushButton("Назад")
+        back_button.clicked.connect(self.parent.show_admin_panel)
+
+        layout.addWidget(self.totals_label)
+        layout.addWidget(tabs)
+        layout.addWidget(back_button)
+
+        self.setLayout(layout)
+
+    @staticmethod
+    def _create_table(headers):
+        table = QTableWidget()
+        table.setColumnCount(len(headers))
+        table.setHorizontalHeaderLabels(headers)
+        table.setEditTriggers(QAbstractItemView.EditTrigger.NoEditTriggers)
+        table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Stretch)
+        return table
+
+    @staticmethod
+    def _fill_table(table, rows):
+        table.setRowCount(len(rows))
+        for row_num, row in enumerate(rows):
+            for col_num, value in enumerate(row):
+                table.setItem(row_num, col_num, QTableWidgetItem(value))
+
+    @staticmethod
+    def _group_row(group):
+        cars = group.available + group.sold
+        return [
+            group.make, "" if group.year is None else str(group.year), str(group.available), str(group.sold),
+            f"{group.sold / cars:.0%}" if cars else "", format_price(round(group.average)),
+            format_price(round(group.median or 0)), format_price(round(group.p90 or 0)),
+        ]
+
+    def apply_changes(self, changes):
+        if self.isVisible():
+            self.refresh_timer.start()
+
+    def load_stats(self):
+        self.parent.queries.submit(
+            "market_stats", market_report, self.show_report, self.parent.db,
+            error_callback=self.parent.show_query_error,
+        )
+
+    @timed("render")
+    def show_report(self, report):
+        self.totals_label.setText(
+            f"Машин: {report.cars}. В продаже: {report.available}. "
+            f"Продано: {report.sold} ({report.sold_share:.0%})."
+        )
+        self._fill_table(self.makes_table, [self._group_row(group) for group in report.makes])
+        self._fill_table(self.groups_table, [self._group_row(group) for group in report.groups])
+        self._fill_table(self.sellers_table, [
+            [seller.login, str(seller.on_sale), str(seller.sold), format_price(round(seller.revenue))]
+            for seller in report.sellers
+        ])
+
+
+class SellerPanel(QWidget):
+    def __init__(self, parent):
+        super().__init__()
+        self.parent = parent
+        self.sort = ()
+        # Отрицательные id предварительных строк машин, ждущих фиксации
+        self._provisional_ids = count(-1, -1)
+        self.setup_ui()
+
+    def setup_ui(self):
+        layout = QVBoxLayout()
+
+        self.car_model = PagedCarTableModel(self)
+        self.car_list_table = create_car_table(self.car_model, self.sort_by_header, self.parent.thumbnails)
+        # Удалить можно сразу несколько машин
+        self.car_list_table.setSelectionMode(QAbstractItemView.SelectionMode.ExtendedSelection)
+
+        self.car_list_table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Stretch)
+        self.car_list_table.setHorizontalScrollBarPolicy(Qt.ScrollBarPolicy.ScrollBarAlwaysOff)
+
+        add_car_button = QPushButton("Добавить машину")
+        import_button = QPushButton("Импорт из CSV/JSONL")
+        export_button = QPushButton("Экспорт в CSV/JSONL")
+        delete_car_button = QPushButton("Удалить машину")
+        back_button = QPushButton("Выход")
+
+        add_car_button.clicked.connect(self.show_add_car_window)
+        import_button.clicked.connect(self.import_cars)
+        export_button.clicked.connect(self.export_cars)
+        delete_car_button.clicked.connect(self.delete_car)
+        back_button.clicked.connect(self.parent.show_login_window)
+
+        layout.addWidget(self.car_list_table)
+        layout.addWidget(add_car_button)
+        layout.addWidget(import_button)
+        layout.addWidget(export_button)
+        layout.addWidget(delete_car_button)
+        layout.addWidget(back_button)
+
+        self.setLayout(layout)
+
+    def apply_changes(self, changes):
+        self.car_model.apply_changes(changes)
+
+    def load_car_list(self):
+        self.parent.queries.submit(
+            "seller_cars",
+            partial(open_pager, self.parent.db, order=self.sort or None, seller_login=self.parent.current_user[1]),
+            self.car_model.set_pager, error_callback=self.parent.show_query_error,
+        )
+
+    def sort_by_header(self, column, order):
+        sort = header_sort(self.sort, column, order)
+        if sort is None:
+            show_sort(self.car_list_table, self.sort)
+            return
+        self.sort = sort
+        self.load_car_list()
+
+    def delete_car(self):
+        rows = sorted(index.row() for index in self.car_list_table.selectionModel().selectedRows())
+        if not rows:
+            QMessageBox.warning(self, "Ошибка", "Выберите машину для удаления.")
+            return
+
+        # Строки убираются из таблицы сразу, а удаления уходят в очередь записей
+        # и фиксируются одной транзакцией; проверка владельца — в той же транзакции
+        car_ids = [self.car_model.car_id(row) for row in rows]
+        if any(car_id < 0 for car_id in car_ids):
+            QMessageBox.warning(self, "Ошибка", "Машина еще сохраняется, попробуйте позже.")
+            return
+        self.car_model.apply_changes([CarChange(0, car_id, "delete", None, None, None) for car_id in car_ids])
+        seller_login = self.parent.current_user[1]
+        self.parent.writes.submit(
+            [("delete_seller_car", (car_id, seller_login)) for car_id in car_ids],
+            partial(self.cars_deleted, car_ids), partial(self.delete_failed, car_ids),
+        )
+
+    def restore_cars(self, car_ids):
+        """Возвращает в таблицу строки машин, удаление которых не прошло."""
+        self.car_model.apply_changes([CarChange(0, car_id, "update", None, None, None) for car_id in car_ids])
+
+    def cars_deleted(self, car_ids, results):
+        refused = [car_id for car_id, result in zip(car_ids, results) if result is not True]
+        if refused:
+            self.restore_cars(refused)
+            QMessageBox.warning(self, "Ошибка", "Вы не можете удалить машину другого продавца!")
+        elif len(car_ids) == 1:
+            QMessageBox.information(self, "Успех", "Машина успешно удалена!")
+        else:
+            QMessageBox.information(self, "Успех", f"Удалено машин: {len(car_ids)}")
+
+    def delete_failed(self, car_ids, error):
+        self.restore_cars(car_ids)
+        self.parent.show_query_error(error)
+
+    def inventory_running(self):
+        # Новый запрос в канале отменил бы идущий импорт на середине, поэтому
+        # следующий импорт или экспорт ждет окончания текущего
+        if self.parent.queries.running("inventory"):
+            QMessageBox.warning(self, "Ошибка", "Дождитесь окончания импорта или экспорта.")
+            return True
+        return False
+
+    def import_cars(self):
+        if self.inventory_running():
+            return
+        path, _ = QFileDialog.getOpenFileName(self, "Импорт машин", "", INVENTORY_FILES)
+        if not path:
+            return
+        # Файл разбирается и вставляется пачками в фоне, окно не блокируется
+        self.parent.queries.submit(
+            "inventory", import_file, self.import_finished, self.parent.db, path, self.parent.current_user[1],
+            error_callback=self.parent.show_query_error,
+        )
+
+    def import_finished(self, report):
+        self.parent.changes.poll(force=True)
+        if report.failed:
+            QMessageBox.warning(self, "Импорт", report.summary())
+        else:
+            QMessageBox.information(self, "Импорт", report.summary())
+
+    def export_cars(self):
+        if self.inventory_running():
+            return
+        path, _ = QFileDialog.getSaveFileName(self, "Экспорт машин", "cars.csv", INVENTORY_FILES)
+        if not path:
+            return
+        self.parent.queries.submit(
+            "inventory", export_file,
+            lambda count: QMessageBox.information(self, "Экспорт", f"Выгружено машин: {count}."),
+            self.parent.db, path, self.parent.current_user[1],
+            error_callback=self.parent.show_query_error,
+        )
+
+    def show_add_car_window(self):
+        self.add_car_window = AddCarWindow(self)
+        self.add_car_window.show()
+
+    def add_car(self, car, photo_files):
+        """Ставит машину (поля add_car) в очередь записей. До фиксации она видна
+        в таблице предварительной строкой с отрицательным id; после фиксации
+        ее сменяет настоящая строка из шины изменений."""
+        provisional_id = next(self._provisional_ids)
+        self.car_model.insert_rows([(provisional_id, *car, AVAILABLE, None)])
+        self.parent.writes.submit(
+            [("add_car", car)], partial(self.car_added, provisional_id, photo_files),
+            partial(self.add_failed, provisional_id),
+        )
+
+    def drop_provisional(self, provisional_id):
+        self.car_model.apply_changes([CarChange(0, provisional_id, "delete", None, None, None)])
+
+    def car_added(self, provisional_id, photo_files, results):
+        car_id = results[0]
+        if isinstance(car_id, Exception):
+            self.add_failed(provisional_id, car_id)
+            return
+        self.drop_provisional(provisional_id)
+        QMessageBox.information(self, "Успех", "Машина успешно добавлена!")
+        if photo_files:
+            app = self.parent
+            app.queries.submit(
+                f"photos:{car_id}", attach_photos, app.thumbnails.forget,
+                app.db, app.photos, car_id, photo_files,
+                error_callback=app.show_query_error,
+            )
+
+    def add_failed(self, provisional_id, error):
+        self.drop_provisional(provisional_id)
+        QMessageBox.warning(self, "Ошибка", f"Ошибка при добавлении машины: {error}")
+
+
+
+class BuyerPanel(QWidget):
+    # Задержка перед фильтрацией, чтобы не пересчитывать результат на каждое нажатие
+    FILTER_DELAY_MS = 150
+
+    # Пункты выбора сортировки и соответствующие им ключи; последний пункт
+    # выбирается сам при сортировке щелчком по заголовку таблицы
+    SORT_CHOICES = [
+        ("Без сортировки", ()),
+        ("Цена: по возрастанию", (("price", "ASC"),)),
+        ("Цена: по убыванию", (("price", "DESC"),)),
+        ("По столбцам таблицы", None),
+    ]
+
+    def __init__(self, parent):
+        super().__init__()
+        self.parent = parent
+        self.filter_index = None
+        self.sort = ()
+        # Пейджеры уже выбиравшихся фильтров; catalogue_key — ключ показанного
+        # пейджера из базы или None для пейджера индекса в памяти
+        self.results = PagerCache(parent.db)
+        self.catalogue_key = None
+        self.setup_ui()
+
+    def setup_ui(self):
+        layout = QVBoxLayout()
+
+        self.min_price_input = QLineEdit()
+        self.min_price_input.setPlaceholderText("Мин. цена")
+        self.max_price_input = QLineEdit()
+        self.max_price_input.setPlaceholderText("Макс. цена")
+        self.make_input = QLineEdit()
+        self.make_input.setPlaceholderText("Поиск: марка, модель, описание")
+        self.sort_combo = QComboBox()
+        self.sort_combo.addItems([text for text, _ in self.SORT_CHOICES])
+
+        apply_filters_button = QPushButton("Применить фильтры")
+        apply_filters_button.clicked.connect(self.apply_filters)
+
+        # Фильтры применяются по мере ввода, после паузы FILTER_DELAY_MS
+        self.filter_timer = QTimer(self)
+        self.filter_timer.setSingleShot(True)
+        self.filter_timer.setInterval(self.FILTER_DELAY_MS)
+        self.filter_timer.timeout.connect(self.apply_filters)
+        self.make_input.textChanged.connect(self.filter_timer.start)
+        self.min_price_input.textChanged.connect(self.filter_timer.start)
+        self.max_price_input.textChanged.connect(self.filter_timer.start)
+        self.sort_combo.currentIndexChanged.connect(self.sort_by_choice)
+
+        filters_layout = QVBoxLayout()
+        filters_layout.addWidget(QLabel("Фильтры"))
+        filters_layout.addWidget(self.make_input)
+        filters_layout.addWidget(self.min_price_input)
+        filters_layout.addWidget(self.max_price_input)
+        filters_layout.addWidget(QLabel("Сортировка"))
+        filters_layout.addWidget(self.sort_combo)
+        filters_layout.addWidget(apply_filters_button)
+
+        self.car_model = PagedCarTableModel(self)
+        self.car_list_table = create_car_table(self.car_model, self.sort_by_header, self.parent.thumbnails)
+
+
+        buy_car_button = QPushButton("Купить машину")
+        buy_car_button.clicked.connect(self.buy_car)
+
+        back_button = QPushButton("Выход")
+        back_button.clicked.connect(self.parent.show_login_window)
+
+        layout.addLayout(filters_layout)
+        layout.addWidget(self.car_list_table)
+        layout.addWidget(buy_car_button)
+        layout.addWidget(back_button)
+
+        self.setLayout(layout)
+
+    def load_car_list(self):
+        self.open_catalogue(order=self.sort or None)
+        self.load_trends()
+        # Индекс для живой фильтрации читается из снимка или строится в фоне;
+        # до его готовности фильтры идут в базу
+        self.parent.queries.submit(
+            "catalogue_index", CatalogueIndex.load, self.set_filter_index, self.parent.db,
+            error_callback=self.parent.show_query_error,
+        )
+
+    def set_filter_index(self, index):
+        # Изменения, которые шина опубликовала, пока индекс загружался, в него не попали
+        seq = self.parent.changes.seq
+        if index.seq < seq:
+            changes = [CarChange(*row) for row in self.parent.db.car_changes_since(index.seq)]
+            index.apply_changes([change for change in changes if change.seq <= seq], self.parent.db)
+        self.filter_index = index
+
+    def refresh(self):
+        """Перечитывает каталог с текущими фильтрами (после сброса шины изменений)."""
+        self.filter_index = None
+        self.results.clear()
+        self.catalogue_key = None
+        self.apply_filters()
+        self.load_trends()
+        self.parent.queries.submit(
+            "catalogue_index", CatalogueIndex.load, self.set_filter_index, self.parent.db,
+            error_callback=self.parent.show_query_error,
+        )
+
+    def load_trends(self):
+        """Читает в фоне средние цены марок за последний месяц (сводка price_days);
+        столбец тренда считается по ним при отрисовке строк. При ошибке
+        запроса столбец остается пустым."""
+        self.parent.queries.submit("price_trends", self.parent.db.make_average_prices, self.car_model.set_trends)
+
+    def apply_changes(self, changes):
+        if self.filter_index is not None:
+            self.filter_index.apply_changes(changes, self.parent.db)
+        self.results.apply_changes(changes)
+        self.car_model.apply_changes(changes)
+
+    def open_catalogue(self, **options):
+        """Показывает каталог с параметрами open_pager: из кэша или запросом в фоне."""
+        key = PagerCache.key(**options)
+        # Новый фильтр отменяет еще не завершенный запрос
+        if key == self.catalogue_key:
+            self.parent.queries.cancel("catalogue")
+            return
+        pager = self.results.take(key)
+        if pager is not None:
+            self.parent.queries.cancel("catalogue")
+            self.set_catalogue(key, pager)
+            return
+        self.parent.queries.submit(
+            "catalogue", partial(open_pager, self.parent.db, **options), partial(self.set_catalogue, key),
+            error_callback=self.parent.show_query_error,
+        )
+
+    def set_catalogue(self, key, pager):
+        # Прежний пейджер из базы остается в кэше, уже с примененными изменениями
+        if self.catalogue_key is not None:
+            self.results.put(self.catalogue_key, self.car_model.pager, self.parent.changes.seq)
+        self.catalogue_key = key
+        self.car_model.set_pager(pager)
+
+    def sort_by_choice(self, index):
+        sort = self.SORT_CHOICES[index][1]
+        if sort is None:
+            return
+        self.sort = sort
+        show_sort(self.car_list_table, sort)
+        self.filter_timer.start()
+
+    def sort_by_header(self, column, order):
+        sort = header_sort(self.sort, column, order)
+        if sort is None:
+            show_sort(self.car_list_table, self.sort)
+            return
+        self.sort = sort
+        choices = [choice for _, choice in self.SORT_CHOICES]
+        self.sort_combo.blockSignals(True)
+        self.sort_combo.setCurrentIndex(choices.index(sort) if sort in choices else len(choices) - 1)
+        self.sort_combo.blockSignals(False)
+        self.apply_filters()
+
+    def apply_filters(self):
+        self.filter_timer.stop()
+        min_price = parse_price(self.min_price_input.text())
+        max_price = parse_price(self.max_price_input.text())
+        order = self.sort or None
+
+        # Диапазон цен и слово из марки считаются по индексу в памяти прямо
+        # в GUI-потоке; индекс упорядочен только по цене
+        text = self.make_input.text()
+        if self.filter_index is not None and self.sort in ((), (("price", "ASC"),), (("price", "DESC"),)):
+            result = self.filter_index.query(text, min_price, max_price, descending=self.sort == (("price", "DESC"),))
+            if result is not None:
+                self.parent.queries.cancel("catalogue")
+                self.set_catalogue(None, open_filter_pager(self.parent.db, result))
+                return
+
+        # Остальной текст (модель, описание, несколько слов, опечатки) ищется
+        # в базе в фоне или берется из кэша
+        self.open_catalogue(order=order, available_only=True, search=self.make_input.text(),
+                            min_price=min_price, max_price=max_price)
+
+    def buy_car(self):
+        selected_row = self.car_list_table.currentIndex().row()
+        if selected_row == -1:
+            QMessageBox.warning(self, "Ошибка", "Выберите машину для покупки.")
+            return
+
+        car_id = self.car_model.car_id(selected_row)
+        buyer_login = self.parent.current_user[1]
+
+        # Покупка ждет блокировку записи (до нескольких секунд повторов), поэтому
+        # идет через очередь записей, а не в GUI-потоке
+        self.parent.writes.submit([("buy_car", (car_id, buyer_login))], self.car_bought, self.buy_failed)
+
+    def car_bought(self, results):
+        result = results[0]
+        if result == ALREADY_BOUGHT:
+            QMessageBox.warning(self, "Ошибка", "Вы уже купили эту машину!")
+            return
+        if result == NOT_AVAILABLE:
+            # Машину купили в другом окне или процессе — убираем ее из каталога
+            self.parent.changes.poll(force=True)
+            QMessageBox.warning(self, "Ошибка", "Эта машина уже продана.")
+            return
+
+        self.parent.changes.poll(force=True)
+        QMessageBox.information(self, "Успех", "Машина успешно куплена!")
+
+    def buy_failed(self, error):
+        if isinstance(error, sqlite3.OperationalError):
+            QMessageBox.warning(self, "Ошибка", "База данных занята, попробуйте еще раз.")
+        else:
+            self.parent.show_query_error(error)
+
+
+class AddCarWindow(QDialog):
+    def __init__(self, parent):
+        super().__init__(parent)
+        self.parent = parent
+        self.setWindowTitle("Добавить машину")
+
+        # Поля ввода с подсказками
+        self.make_input = QLineEdit(self)
+        self.make_input.setPlaceholderText("Введите марку автомобиля")
+
+        self.model_input = QLineEdit(self)
+        self.model_input.setPlaceholderText("Введите модель автомобиля")
+
+        self.year_input = QLineEdit(self)
+        self.year_input.setPlaceholderText("Введите год выпуска")
+
+        # Поле для ввода цены
+        self.price_input = QLineEdit(self)
+        self.price_input.setPlaceholderText("Введите цену автомобиля")
+
+        self.description_input = QTextEdit(self)
+        self.description_input.setPlaceholderText("Введите описание машины")
+        self.description_input.setMaximumHeight(100)
+
+        # Фотографии копируются в хранилище после добавления машины, в фоне
+        self.photo_files = []
+        self.photos_button = QPushButton("Выбрать фотографии", self)
+        self.photos_button.clicked.connect(self.choose_photos)
+        self.photos_button.setVisible(self.parent.parent.photos is not None)
+
+        self.add_button = QPushButton("Добавить", self)
+        self.add_button.clicked.connect(self.add_car)
+
+        layout = QVBoxLayout(self)
+        layout.addWidget(self.make_input)
+        layout.addWidget(self.model_input)
+        layout.addWidget(self.year_input)
+        layout.addWidget(self.price_input)
+        layout.addWidget(self.description_input)
+        layout.addWidget(self.photos_button)
+        layout.addWidget(self.add_button)
+
+        self.setLayout(layout)
+
+    def choose_photos(self):
+        files, _ = QFileDialog.getOpenFileNames(self, "Фотографии машины", "", PHOTO_FILES)
+        if files:
+            self.photo_files = files
+            self.photos_button.setText(f"Фотографий выбрано: {len(files)}")
+
+    def add_car(self):
+        make = self.make_input.text()
+        model = self.model_input.text()
+        # Те же проверки года и цены выполняет массовый импорт
+        try:
+            year, price = validate_car(self.year_input.text(), self.price_input.text().strip())
+        except ValueError as error:
+            QMessageBox.warning(self, "Ошибка", str(error))
+            return
+
+        # Окно закрывается сразу: машина добавляется в очереди записей вместе с
+        # соседними записями, а до фиксации видна в таблице предварительной строкой
+        seller_login = self.parent.parent.current_user[1]
+        self.parent.add_car((make, model, year, price, self.description_input.toPlainText(), seller_login),
+                            self.photo_files)
+        self.close()
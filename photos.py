@@ -0,0 +1,255 @@
+"""Фотографии машин: файлы вне базы и миниатюры для таблиц.
+
+Фотографии лежат в каталоге рядом с файлом базы (users.db.photos) под
+именем из хеша содержимого: одинаковые файлы хранятся один раз, а имя
+никогда не указывает на другое содержимое. В базе (car_photos) — только
+хеши и порядок фотографий машины.
+
+Миниатюры строятся в фоне и тоже хранятся файлами. В таблицах они
+декодируются только для строк, которые представление рисует, и держатся
+в LRU-кэше QPixmap ограниченного размера.
+"""
+import hashlib
+import os
+import shutil
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from PyQt6.QtCore import QObject, QSize, Qt, pyqtSignal
+from PyQt6.QtGui import QImage, QImageReader, QPixmap
+
+
+PHOTOS_SUFFIX = ".photos"
+PHOTO_FILES = "Изображения (*.jpg *.jpeg *.png *.bmp *.webp);;Все файлы (*)"
+
+# Файлы моложе этого (в секундах) не удаляются при уборке, даже если на них
+# нет ссылок: фотография копируется в хранилище до записи ее хеша в базу
+SWEEP_AFTER = 3600
+
+# Миниатюра вписывается в этот размер; строки таблиц машин высотой 100 пикселей
+THUMBNAIL_SIZE = QSize(96, 72)
+THUMBNAIL_QUALITY = 85
+
+# Сколько байт QPixmap держит кэш миниатюр
+THUMBNAIL_CACHE_BYTES = 32 * 2 ** 20
+# Сколько машин без фотографий помнить, чтобы не спрашивать о них базу снова
+MISSING_LIMIT = 100000
+# Сколько запрошенных миниатюр ждать в очереди; более старые запросы
+# вытесняются — это строки, которые при прокрутке уже ушли с экрана
+PENDING_LIMIT = 64
+# Сколько миниатюр декодировать за один заход потока
+THUMBNAIL_BATCH = 16
+THUMBNAIL_WORKERS = 2
+
+
+class PhotoStore:
+    """Каталог фотографий по адресу от содержимого: originals/ и thumbnails/."""
+
+    def __init__(self, root):
+        self.root = root
+
+    @classmethod
+    def for_database(cls, db):
+        """Хранилище рядом с файлом базы; у RemoteDatabase файла нет — тогда None."""
+        path = getattr(db, "path", None)
+        return cls(path + PHOTOS_SUFFIX) if path else None
+
+    def _path(self, kind, digest):
+        return os.path.join(self.root, kind, digest[:2], digest)
+
+    def original_path(self, digest):
+        return self._path("originals", digest)
+
+    def thumbnail_path(self, digest):
+        return self._path("thumbnails", digest)
+
+    def add(self, source):
+        """Копирует файл source в хранилище и возвращает хеш его содержимого."""
+        digest = hashlib.blake2b(digest_size=16)
+        with open(source, "rb") as file:
+            for chunk in iter(lambda: file.read(2 ** 20), b""):
+                digest.update(chunk)
+        digest = digest.hexdigest()
+        path = self.original_path(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            partial = f"{path}.{threading.get_ident()}.partial"
+            shutil.copyfile(source, partial)
+            os.replace(partial, path)
+        return digest
+
+    def sweep(self, referenced, older_than=SWEEP_AFTER):
+        """Удаляет оригиналы и миниатюры, хешей которых нет в referenced, и
+        брошенные недописанные файлы. Возвращает число удаленных файлов."""
+        cutoff = time.time() - older_than
+        removed = 0
+        for kind in ("originals", "thumbnails"):
+            for directory, _, names in os.walk(os.path.join(self.root, kind)):
+                for name in names:
+                    if name in referenced:
+                        continue
+                    path = os.path.join(directory, name)
+                    try:
+                        if os.path.getmtime(path) < cutoff:
+                            os.remove(path)
+                            removed += 1
+                    except OSError:
+                        pass
+        return removed
+
+    def thumbnail(self, digest):
+        """Миниатюра фотографии (QImage); строится и сохраняется при первом
+        обращении. Пустой QImage — если исходного файла нет или он не читается."""
+        image = QImage(self.thumbnail_path(digest))
+        if image.isNull():
+            image = self._make_thumbnail(digest)
+        return image
+
+    def _make_thumbnail(self, digest):
+        reader = QImageReader(self.original_path(digest))
+        size = reader.size()
+        if size.isValid():
+            # JPEG декодируется сразу в уменьшенном размере, без полного кадра в памяти
+            reader.setScaledSize(size.scaled(THUMBNAIL_SIZE, Qt.AspectRatioMode.KeepAspectRatio))
+        image = reader.read()
+        if image.isNull():
+            return image
+        path = self.thumbnail_path(digest)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        partial = f"{path}.{threading.get_ident()}.partial"
+        if image.save(partial, "JPG", THUMBNAIL_QUALITY):
+            os.replace(partial, path)
+        return image
+
+
+def attach_photos(db, store, car_id, sources):
+    """Сохраняет файлы sources как фотографии машины car_id и сразу строит
+    миниатюры. Выполняется в пуле: копирование и хеширование файлов не
+    задерживают GUI. Возвращает car_id."""
+    digests = [store.add(source) for source in sources]
+    for digest in digests:
+        store.thumbnail(digest)
+    db.add_car_photos(car_id, digests)
+    return car_id
+
+
+class ThumbnailCache(QObject):
+    """Миниатюры обложек машин для таблиц: LRU-кэш QPixmap по id машины.
+
+    pixmap(car_id) возвращает готовую миниатюру или None. При промахе id
+    встает в очередь, и миниатюра декодируется в фоновом пуле. Очередь
+    обрабатывается с конца и ограничена PENDING_LIMIT: при быстрой
+    прокрутке запросы строк, ушедших с экрана, вытесняются, а если строка
+    покажется снова, представление запросит ее еще раз. Готовые
+    миниатюры превращаются в QPixmap в GUI-потоке, после чего выходит
+    сигнал ready.
+    """
+
+    ready = pyqtSignal()
+    _loaded = pyqtSignal(object)
+
+    def __init__(self, store, db, parent=None, max_bytes=THUMBNAIL_CACHE_BYTES, workers=THUMBNAIL_WORKERS):
+        super().__init__(parent)
+        self.store = store
+        self.db = db
+        self.max_bytes = max_bytes
+        self.workers = workers
+        self._pixmaps = OrderedDict()
+        self._bytes = 0
+        self._missing = OrderedDict()
+        self._pending = OrderedDict()
+        # id, которые уже декодируются: повторная отрисовка строки не ставит их в очередь
+        self._loading = set()
+        self._running = 0
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(workers, thread_name_prefix="thumbnails")
+        self._loaded.connect(self._store)
+
+    @property
+    def memory_size(self):
+        """Байт в QPixmap кэша."""
+        return self._bytes
+
+    def pixmap(self, car_id):
+        pixmap = self._pixmaps.get(car_id)
+        if pixmap is not None:
+            self._pixmaps.move_to_end(car_id)
+            return pixmap
+        if car_id not in self._missing:
+            self._request(car_id)
+        return None
+
+    def forget(self, car_id):
+        """Забывает миниатюру машины (например, после добавления фотографий)."""
+        self._missing.pop(car_id, None)
+        pixmap = self._pixmaps.pop(car_id, None)
+        if pixmap is not None:
+            self._bytes -= _pixmap_bytes(pixmap)
+        self.ready.emit()
+
+    def wait(self):
+        """Дожидается декодирования всех запрошенных миниатюр (для бенчмарков);
+        в кэш они попадут при следующей обработке событий GUI."""
+        while True:
+            with self._lock:
+                if not self._running and not self._pending:
+                    return
+            time.sleep(0.005)
+
+    def _request(self, car_id):
+        with self._lock:
+            if car_id in self._loading:
+                return
+            self._pending[car_id] = None
+            self._pending.move_to_end(car_id)
+            while len(self._pending) > PENDING_LIMIT:
+                self._pending.popitem(last=False)
+            if self._running >= self.workers:
+                return
+            self._running += 1
+        self._pool.submit(self._work)
+
+    def _work(self):
+        while True:
+            with self._lock:
+                ids = []
+                while self._pending and len(ids) < THUMBNAIL_BATCH:
+                    ids.append(self._pending.popitem()[0])
+                if not ids:
+                    self._running -= 1
+                    return
+                self._loading.update(ids)
+            try:
+                covers = self.db.cover_photos(ids)
+                self._loaded.emit([(car_id, self.store.thumbnail(covers[car_id]) if car_id in covers else None)
+                                   for car_id in ids])
+            except Exception:
+                # Миниатюры необязательны: строка останется без картинки
+                with self._lock:
+                    self._loading.difference_update(ids)
+
+    def _store(self, results):
+        with self._lock:
+            self._loading.difference_update(car_id for car_id, _ in results)
+        for car_id, image in results:
+            if image is None or image.isNull():
+                self._missing[car_id] = None
+                if len(self._missing) > MISSING_LIMIT:
+                    self._missing.popitem(last=False)
+                continue
+            pixmap = QPixmap.fromImage(image)
+            previous = self._pixmaps.pop(car_id, None)
+            if previous is not None:
+                self._bytes -= _pixmap_bytes(previous)
+            self._pixmaps[car_id] = pixmap
+            self._bytes += _pixmap_bytes(pixmap)
+        while self._bytes > self.max_bytes and len(self._pixmaps) > 1:
+            _, evicted = self._pixmaps.popitem(last=False)
+            self._bytes -= _pixmap_bytes(evicted)
+        self.ready.emit()
+
+
+def _pixmap_bytes(pixmap):
+    return pixmap.width() * pixmap.height() * max(pixmap.depth(), 8) // 8
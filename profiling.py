@@ -0,0 +1,285 @@
+"""Необязательная инструментовка: время SQL-запросов и заполнения таблиц.
+
+Включается переменной окружения AVTOSELL_PROFILE=путь или флагом
+--profile путь у main.py. Тогда соединения Database открываются как
+ProfiledConnection и замеряют каждый запрос (выполнение и чтение строк) по
+отпечатку SQL, а функции с декоратором @timed — время заполнения таблиц.
+По каждому отпечатку считаются число вызовов, строки, суммарное время и
+p50/p95/p99; запросы дольше AVTOSELL_SLOW_MS (по умолчанию SLOW_QUERY_MS)
+попадают в журнал медленных запросов. При выходе результаты пишутся в файл:
+в текстовом формате Prometheus, если путь оканчивается на .prom, иначе в JSON.
+
+Выключенная инструментовка стоит одной проверки profiler is None в функциях
+с @timed; запросы к базе идут через обычный sqlite3.Connection.
+"""
+import atexit
+import functools
+import os
+import random
+import re
+import sqlite3
+import threading
+import time
+from array import array
+from collections import deque
+
+
+PROFILE_ENV = "AVTOSELL_PROFILE"
+SLOW_ENV = "AVTOSELL_SLOW_MS"
+
+# Порог медленного запроса в мс и сколько последних медленных запросов хранить
+SLOW_QUERY_MS = 100
+SLOW_LOG_SIZE = 200
+
+# Сколько замеров на отпечаток хранить для перцентилей (случайная выборка)
+SAMPLE_LIMIT = 10000
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+# Текущий Profiler или None, если инструментовка выключена
+profiler = None
+
+# Модуль импортируется вместе с database при каждом запуске, поэтому
+# регулярные выражения компилируются (и кэшируются re) при первом замере
+_STRING_PATTERN = r"'(?:[^']|'')*'"
+_NUMBER_PATTERN = r"\b\d+(?:\.\d+)?\b"
+_LIST_PATTERN = r"\(\s*\?(?:\s*,\s*\?)+\s*\)"
+
+
+@functools.lru_cache(maxsize=1024)
+def fingerprint(sql):
+    """SQL без литералов и лишних пробелов; списки IN (?, ?, ...) сворачиваются в (...)."""
+    sql = re.sub(_STRING_PATTERN, "?", sql)
+    sql = re.sub(_NUMBER_PATTERN, "?", sql)
+    sql = re.sub(_LIST_PATTERN, "(...)", sql)
+    return " ".join(sql.split())
+
+
+class Metric:
+    """Замеры одного отпечатка: счетчики и выборка для перцентилей."""
+
+    def __init__(self):
+        self.count = 0
+        self.rows = 0
+        self.total = 0.0
+        self.maximum = 0.0
+        self.samples = array("d")
+
+    def observe(self, seconds, rows):
+        self.count += 1
+        self.rows += rows
+        self.total += seconds
+        self.maximum = max(self.maximum, seconds)
+        if len(self.samples) < SAMPLE_LIMIT:
+            self.samples.append(seconds)
+        else:
+            # Резервуарная выборка: каждый замер остается с вероятностью SAMPLE_LIMIT / count
+            slot = random.randrange(self.count)
+            if slot < SAMPLE_LIMIT:
+                self.samples[slot] = seconds
+
+    def quantiles(self):
+        ordered = sorted(self.samples)
+        return [ordered[min(len(ordered) - 1, int(quantile * len(ordered)))] if ordered else 0.0
+                for quantile in QUANTILES]
+
+
+class Profiler:
+    """Замеры по видам ('query', 'fetch', 'render') и отпечаткам."""
+
+    def __init__(self, slow_ms=SLOW_QUERY_MS):
+        self.slow_seconds = slow_ms / 1000
+        self.metrics = {}
+        self.slow_queries = deque(maxlen=SLOW_LOG_SIZE)
+        self._lock = threading.Lock()
+
+    def observe(self, kind, name, seconds, rows=0):
+        with self._lock:
+            metric = self.metrics.get((kind, name))
+            if metric is None:
+                metric = self.metrics[kind, name] = Metric()
+            metric.observe(seconds, rows)
+            if seconds >= self.slow_seconds:
+                self.slow_queries.append({
+                    "time": time.time(), "kind": kind, "name": name, "ms": seconds * 1000, "rows": rows,
+                })
+
+    def report(self):
+        """Замеры в виде словаря для JSON; отпечатки по убыванию суммарного времени."""
+        with self._lock:
+            metrics = []
+            for (kind, name), metric in self.metrics.items():
+                p50, p95, p99 = metric.quantiles()
+                metrics.append({
+                    "kind": kind, "name": name, "count": metric.count, "rows": metric.rows,
+                    "total_ms": metric.total * 1000, "max_ms": metric.maximum * 1000,
+                    "p50_ms": p50 * 1000, "p95_ms": p95 * 1000, "p99_ms": p99 * 1000,
+                })
+            slow_queries = list(self.slow_queries)
+        metrics.sort(key=lambda metric: metric["total_ms"], reverse=True)
+        return {"metrics": metrics, "slow_queries": slow_queries}
+
+    def prometheus(self):
+        """Замеры в текстовом формате Prometheus: summary времени и счетчик строк."""
+        lines = []
+        report = self.report()
+        for kind in sorted({metric["kind"] for metric in report["metrics"]}):
+            metrics = [metric for metric in report["metrics"] if metric["kind"] == kind]
+            lines.append(f"# TYPE avtosell_{kind}_seconds summary")
+            for metric in metrics:
+                label = f'name="{_escape(metric["name"])}"'
+                for quantile, key in zip(QUANTILES, ("p50_ms", "p95_ms", "p99_ms")):
+                    lines.append(f'avtosell_{kind}_seconds{{{label},quantile="{quantile}"}} {metric[key] / 1000:.6g}')
+                lines.append(f"avtosell_{kind}_seconds_sum{{{label}}} {metric['total_ms'] / 1000:.6g}")
+                lines.append(f"avtosell_{kind}_seconds_count{{{label}}} {metric['count']}")
+            lines.append(f"# TYPE avtosell_{kind}_rows_total counter")
+            for metric in metrics:
+                lines.append(f'avtosell_{kind}_rows_total{{name="{_escape(metric["name"])}"}} {metric["rows"]}')
+        lines.append("# TYPE avtosell_slow_queries gauge")
+        lines.append(f"avtosell_slow_queries {len(report['slow_queries'])}")
+        return "\n".join(lines) + "\n"
+
+    def dump(self, path):
+        import json
+        with open(path, "w", encoding="utf-8") as file:
+            if path.endswith(".prom"):
+                file.write(self.prometheus())
+            else:
+                json.dump(self.report(), file, ensure_ascii=False, indent=2)
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def enable(path=None, slow_ms=None):
+    """Включает инструментовку; при выходе результаты пишутся в path.
+
+    Действует на соединения, открытые после вызова.
+    """
+    global profiler
+    if slow_ms is None:
+        slow_ms = float(os.environ.get(SLOW_ENV, SLOW_QUERY_MS))
+    profiler = Profiler(slow_ms)
+    if path:
+        atexit.register(profiler.dump, path)
+    return profiler
+
+
+def configure(argv):
+    """Включает инструментовку по флагу --profile путь (убирая его из argv)
+    или по переменной окружения AVTOSELL_PROFILE."""
+    path = os.environ.get(PROFILE_ENV)
+    if "--profile" in argv:
+        position = argv.index("--profile")
+        path = argv[position + 1] if position + 1 < len(argv) else "profile.json"
+        del argv[position:position + 2]
+    if path and profiler is None:
+        enable(path)
+
+
+def timed(kind, name=None):
+    """Декоратор: замеряет вызовы функции как kind/name, если инструментовка включена."""
+    def decorator(func):
+        label = name or func.__qualname__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if profiler is None:
+                return func(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                profiler.observe(kind, label, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+class ProfiledCursor(sqlite3.Cursor):
+    """Курсор, замеряющий выполнение запроса ('query') и чтение строк ('fetch')."""
+
+    _name = ""
+    _rows = 0
+    _seconds = 0.0
+
+    def execute(self, sql, parameters=()):
+        self._name = fingerprint(sql)
+        start = time.perf_counter()
+        super().execute(sql, parameters)
+        profiler.observe("query", self._name, time.perf_counter() - start, max(self.rowcount, 0))
+        return self
+
+    def executemany(self, sql, seq_of_parameters):
+        self._name = fingerprint(sql)
+        start = time.perf_counter()
+        super().executemany(sql, seq_of_parameters)
+        profiler.observe("query", self._name, time.perf_counter() - start, max(self.rowcount, 0))
+        return self
+
+    def _fetched(self, start, rows):
+        profiler.observe("fetch", self._name, time.perf_counter() - start, rows)
+
+    def fetchone(self):
+        start = time.perf_counter()
+        row = super().fetchone()
+        self._fetched(start, row is not None)
+        return row
+
+    def fetchmany(self, size=None):
+        start = time.perf_counter()
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        self._fetched(start, len(rows))
+        return rows
+
+    def fetchall(self):
+        start = time.perf_counter()
+        rows = super().fetchall()
+        self._fetched(start, len(rows))
+        return rows
+
+    def __next__(self):
+        # Построчное чтение копится и записывается одним замером, когда строки кончатся
+        start = time.perf_counter()
+        try:
+            row = super().__next__()
+        except StopIteration:
+            self._seconds += time.perf_counter() - start
+            profiler.observe("fetch", self._name, self._seconds, self._rows)
+            self._seconds, self._rows = 0.0, 0
+            raise
+        self._seconds += time.perf_counter() - start
+        self._rows += 1
+        return row
+
+
+class ProfiledConnection(sqlite3.Connection):
+    """Соединение, все запросы которого идут через ProfiledCursor."""
+
+    def execute(self, sql, parameters=()):
+        return self.cursor(ProfiledCursor).execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor(ProfiledCursor).executemany(sql, seq_of_parameters)
+
+    def commit(self):
+        start = time.perf_counter()
+        super().commit()
+        profiler.observe("query", "COMMIT", time.perf_counter() - start)
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # Блок with фиксирует транзакцию в C, минуя commit
+        start = time.perf_counter()
+        try:
+            return super().__exit__(exc_type, exc_value, traceback)
+        finally:
+            profiler.observe("query", "COMMIT" if exc_type is None else "ROLLBACK", time.perf_counter() - start)
+
+
+def connection_factory():
+    """Класс соединения для sqlite3.connect с учетом того, включена ли инструментовка."""
+    return sqlite3.Connection if profiler is None else ProfiledConnection
+
+
+if os.environ.get(PROFILE_ENV):
+    enable(os.environ[PROFILE_ENV])
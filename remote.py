@@ -0,0 +1,369 @@
+"""Клиент HTTP/JSON API сервера (server.py) с интерфейсом Database.
+
+Приложение переключается на него флагом --server URL или переменной
+окружения AVTOSELL_SERVER. Панели работают с RemoteDatabase так же, как с
+Database: методы с теми же именами и результатами, занятый логин приходит
+как sqlite3.IntegrityError, занятая база — как sqlite3.OperationalError.
+Списки, которые Database возвращает курсором, читаются с сервера
+страницами по мере перебора.
+
+GET-ответы запоминаются вместе с ETag; повторный запрос идет с
+If-None-Match, и неизменившийся ответ сервер не передает заново.
+Каждый поток держит свое keep-alive соединение с сервером, как Database —
+свое соединение с базой.
+"""
+import http.client
+import json
+import os
+import socket
+import sqlite3
+import threading
+from collections import OrderedDict
+from urllib.parse import urlencode, urlsplit
+
+from database import PRICE_TREND_DAYS, SORTED_SEARCH_MATCHES, WRITE_OPERATIONS
+
+
+SERVER_ENV = "AVTOSELL_SERVER"
+
+# Сколько секунд ждать ответа сервера
+TIMEOUT = 30
+
+# Сколько строк читать за запрос при переборе длинных списков
+LIST_PAGE = 5000
+
+# Сколько байт ответов с ETag помнить для условных запросов
+ETAG_CACHE_BYTES = 8 * 2 ** 20
+
+# Записи очереди, которые выполняет сервер. add_user получает готовый хеш
+# пароля, а сервер хеширует пароль сам (RemoteCredentials.register);
+# фотографии хранятся только рядом с файлом базы
+REMOTE_WRITES = WRITE_OPERATIONS - {"add_user", "add_car_photos"}
+
+
+def server_url(argv):
+    """Адрес сервера из флага --server URL (убирая его из argv) или
+    переменной окружения AVTOSELL_SERVER; None — работать с файлом базы."""
+    url = os.environ.get(SERVER_ENV)
+    if "--server" in argv:
+        position = argv.index("--server")
+        url = argv[position + 1] if position + 1 < len(argv) else None
+        del argv[position:position + 2]
+    return url or None
+
+
+class RemoteError(Exception):
+    """Ошибка, которую вернул сервер."""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def _error(status, message):
+    if status == 409:
+        return sqlite3.IntegrityError(message)
+    if status == 503:
+        return sqlite3.OperationalError(message)
+    return RemoteError(status, message)
+
+
+class ApiConnection:
+    """Keep-alive соединение потока с сервером."""
+
+    def __init__(self, host, port, timeout):
+        self.http = http.client.HTTPConnection(host, port, timeout=timeout)
+
+    def request(self, method, path, body, headers):
+        """(статус, ETag, тело) ответа. GET, сорвавшийся на соединении, которое
+        сервер успел закрыть по простою, повторяется на новом."""
+        for attempt in range(2):
+            try:
+                self.http.request(method, path, body, headers)
+                response = self.http.getresponse()
+                return response.status, response.getheader("ETag"), response.read()
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                self.http.close()
+                if method != "GET" or attempt:
+                    raise
+            except BaseException:
+                self.http.close()
+                raise
+
+    def interrupt(self):
+        """Обрывает текущий запрос из другого потока (отмена запроса в QueryExecutor)."""
+        sock = self.http.sock
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def close(self):
+        self.http.close()
+
+
+class RemoteDatabase:
+    """Database, запросы которой выполняет сервер API."""
+
+    def __init__(self, url, timeout=TIMEOUT):
+        parts = urlsplit(url)
+        self.url = url
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.prefix = parts.path.rstrip("/")
+        self.timeout = timeout
+        # Токен сессии; его выдает вход (RemoteCredentials.authenticate)
+        self.token = None
+        self._connections = {}
+        self._lock = threading.Lock()
+        # путь GET-запроса -> (ETag, ответ, размер тела)
+        self._etags = OrderedDict()
+        self._etag_bytes = 0
+
+    @property
+    def connection(self):
+        thread_id = threading.get_ident()
+        connection = self._connections.get(thread_id)
+        if connection is None:
+            connection = ApiConnection(self.host, self.port, self.timeout)
+            with self._lock:
+                self._connections[thread_id] = connection
+        return connection
+
+    def close(self):
+        with self._lock:
+            for connection in self._connections.values():
+                connection.close()
+            self._connections.clear()
+
+    def request(self, method, path, params=None, body=None):
+        """Ответ сервера в виде JSON; ошибки сервера — исключениями (см. _error)."""
+        if params:
+            path += "?" + urlencode({name: value for name, value in params.items() if value is not None})
+        headers = {}
+        if self.token:
+            headers["Authorization"] = f"Bearer {self.token}"
+        cached = None
+        if method == "GET":
+            with self._lock:
+                cached = self._etags.get(path)
+            if cached is not None:
+                headers["If-None-Match"] = cached[0]
+        if body is not None:
+            body = json.dumps(body, ensure_ascii=False).encode("utf-8")
+            headers["Content-Type"] = "application/json"
+
+        status, tag, data = self.connection.request(method, self.prefix + path, body, headers)
+        if status == 304 and cached is not None:
+            with self._lock:
+                if path in self._etags:
+                    self._etags.move_to_end(path)
+            return cached[1]
+        result = json.loads(data) if data else None
+        if status >= 400:
+            raise _error(status, (result or {}).get("error", f"HTTP {status}"))
+        if tag is not None:
+            self._remember(path, tag, result, len(data))
+        return result
+
+    def _remember(self, path, tag, result, size):
+        with self._lock:
+            previous = self._etags.pop(path, None)
+            if previous is not None:
+                self._etag_bytes -= previous[2]
+            self._etags[path] = (tag, result, size)
+            self._etag_bytes += size
+            while self._etag_bytes > ETAG_CACHE_BYTES and len(self._etags) > 1:
+                _, (_, _, evicted) = self._etags.popitem(last=False)
+                self._etag_bytes -= evicted
+
+    # Схема и обслуживание выполняются на сервере
+
+    def initialize(self):
+        return None
+
+    def maintain(self, photos=None):
+        return 0, 0
+
+    # Пользователи
+
+    def list_users(self):
+        users, after = [], None
+        while True:
+            rows = self.user_page(after, LIST_PAGE)
+            users += rows
+            if len(rows) < LIST_PAGE:
+                return users
+            after = rows[-1][1]
+
+    def user_page(self, after=None, limit=256, prefix=None, role=None):
+        params = {"after": after, "limit": limit, "prefix": prefix or None, "role": role}
+        return [tuple(row) for row in self.request("GET", "/users", params)]
+
+    def delete_user(self, user_id):
+        self.request("DELETE", f"/users/{int(user_id)}")
+
+    def delete_users(self, user_ids):
+        return self.request("POST", "/users/delete", body={"ids": [int(user_id) for user_id in user_ids]})["deleted"]
+
+    # Машины
+
+    def list_cars(self):
+        return self._all_pages()
+
+    def cars_by_seller(self, seller_login):
+        return self._all_pages(seller_login=seller_login)
+
+    def _all_pages(self, **filters):
+        after = None
+        while True:
+            rows = self.car_page(after, LIST_PAGE, **filters)
+            yield from rows
+            if len(rows) < LIST_PAGE:
+                return
+            after = (rows[-1][0],)
+
+    @staticmethod
+    def _filters(filters):
+        params = {}
+        for name, value in filters.items():
+            if name == "available_only":
+                value = "1" if value else None
+            params[name] = value
+        return params
+
+    def car_page(self, after=None, limit=256, order=None, search=None, frequent=None, **filters):
+        params = self._filters(filters)
+        params.update({
+            "after": None if after is None else json.dumps(list(after), ensure_ascii=False),
+            "limit": limit,
+            "order": order if order is None or isinstance(order, str) else json.dumps([list(key) for key in order]),
+            "search": search or None,
+            "frequent": None if frequent is None else int(frequent),
+        })
+        return [tuple(row) for row in self.request("GET", "/cars", params)]
+
+    def cars_by_ids(self, ids, search=None, **filters):
+        ids = list(ids)
+        if not ids:
+            return []
+        params = self._filters(filters)
+        params.update({"ids": ",".join(map(str, ids)), "search": search or None})
+        return [tuple(row) for row in self.request("GET", "/cars/by-ids", params)]
+
+    def count_matches(self, search, limit):
+        return self.request("GET", "/cars/matches", {"search": search, "limit": limit})[0]
+
+    def frequent_search(self, search):
+        return self.count_matches(search, SORTED_SEARCH_MATCHES + 1) > SORTED_SEARCH_MATCHES
+
+    def available_price_index(self):
+        after = None
+        while True:
+            params = {"limit": LIST_PAGE, "after": None if after is None else json.dumps(after)}
+            rows = self.request("GET", "/cars/price-index", params)
+            yield from (tuple(row) for row in rows)
+            if len(rows) < LIST_PAGE:
+                return
+            after = [rows[-1][2], rows[-1][0]]
+
+    def add_car(self, make, model, year, price, description, seller_login):
+        # Продавца сервер берет из сессии
+        car = {"make": make, "model": model, "year": year, "price": price, "description": description}
+        return self.request("POST", "/cars", body=car)["id"]
+
+    def add_cars(self, cars):
+        records = [{"make": make, "model": model, "year": year, "price": price, "description": description}
+                   for make, model, year, price, description, _ in cars]
+        return self.request("POST", "/cars/import", body={"cars": records})["added"]
+
+    def delete_car(self, car_id):
+        self.request("DELETE", f"/cars/{int(car_id)}")
+
+    def delete_seller_car(self, car_id, seller_login):
+        return self.request("DELETE", f"/cars/{int(car_id)}")["deleted"]
+
+    def buy_car(self, car_id, buyer_login):
+        return self.request("POST", f"/cars/{int(car_id)}/buy")["result"]
+
+    def write_batch(self, operations):
+        """Записи по одной, с результатами как у Database.write_batch. В одну
+        транзакцию записи разных клиентов собирает сервер (WriteBatcher)."""
+        for name, _ in operations:
+            if name not in WRITE_OPERATIONS:
+                raise ValueError(f"Неизвестная запись: {name}")
+            if name not in REMOTE_WRITES:
+                raise ValueError(f"Запись не поддерживается сервером: {name}")
+        results = []
+        for name, args in operations:
+            try:
+                results.append(getattr(self, name)(*args))
+            except sqlite3.IntegrityError as error:
+                results.append(error)
+        return results
+
+    # История цен
+
+    def price_history(self, car_id):
+        return [tuple(row) for row in self.request("GET", f"/cars/{int(car_id)}/history")]
+
+    def make_average_prices(self, days=PRICE_TREND_DAYS):
+        return dict(self.request("GET", "/prices/averages", {"days": days}))
+
+    def make_average_price(self, make, days=PRICE_TREND_DAYS):
+        return self.make_average_prices(days).get(make)
+
+    # Статистика
+
+    def market_summary(self, seller_limit=200):
+        return tuple([tuple(row) for row in rows]
+                     for rows in self.request("GET", "/stats", {"seller_limit": seller_limit}))
+
+    # Журнал изменений
+
+    def data_version(self):
+        # Номер последней записи журнала меняется при любом изменении машин
+        return self.last_change_seq()
+
+    def last_change_seq(self):
+        return self.request("GET", "/changes/last")["seq"]
+
+    def car_changes_since(self, seq):
+        return [tuple(row) for row in self.request("GET", "/changes", {"since": seq})]
+
+    def prune_car_changes(self, up_to_seq):
+        # Журнал чистит сервер
+        pass
+
+
+class RemoteCredentials:
+    """Регистрация и вход через сервер: пароли проверяет и хранит сервер."""
+
+    def __init__(self, db):
+        self.db = db
+        self.login = None
+
+    def register(self, login, password, role):
+        """Добавляет пользователя. При занятом логине бросает sqlite3.IntegrityError."""
+        self.db.request("POST", "/users", body={"login": login, "password": password, "role": role})
+
+    def authenticate(self, login, password):
+        """Строка пользователя (id, login, None, role) или None при неверном пароле.
+        Токен сессии запоминается в RemoteDatabase."""
+        try:
+            result = self.db.request("POST", "/login", body={"login": login, "password": password})
+        except RemoteError as error:
+            if error.status == 401:
+                return None
+            raise
+        self.db.token = result["token"]
+        self.login = login
+        user_id, login, role = result["user"]
+        return user_id, login, None, role
+
+    def forget(self, login=None):
+        """Забывает сессию, если она принадлежит login (или любую при login=None)."""
+        if login is None or login == self.login:
+            self.db.token = None
+            self.login = None
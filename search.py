@@ -0,0 +1,98 @@
+"""Построение FTS5-запросов для поиска по марке, модели и описанию."""
+import re
+import sqlite3
+
+
+TOKEN_RE = re.compile(r"\w+")
+
+# Токенизатор cars_fts (migrations.add_cars_fts)
+TOKENIZER = "unicode61 remove_diacritics 2"
+
+
+def edit_distance(left, right, limit):
+    """Расстояние Дамерау-Левенштейна (перестановка соседних букв — одна правка).
+
+    Возвращает limit + 1, как только становится ясно, что расстояние больше limit.
+    """
+    if abs(len(left) - len(right)) > limit:
+        return limit + 1
+    before_previous = None
+    previous = list(range(len(right) + 1))
+    for i, left_char in enumerate(left, start=1):
+        current = [i]
+        for j, right_char in enumerate(right, start=1):
+            distance = min(
+                previous[j] + 1,
+                current[j - 1] + 1,
+                previous[j - 1] + (left_char != right_char),
+            )
+            if i > 1 and j > 1 and left_char == right[j - 2] and left[i - 2] == right_char:
+                distance = min(distance, before_previous[j - 2] + 1)
+            current.append(distance)
+        if min(current) > limit:
+            return limit + 1
+        before_previous, previous = previous, current
+    return previous[-1]
+
+
+def _prefix_end(prefix):
+    """Наименьшая строка, которая больше всех строк с данным префиксом."""
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+def similar_terms(connection, token, limit=None):
+    """Термины словаря cars_fts_vocab, отличающиеся от token не больше чем на limit правок.
+
+    Первая буква считается верной: так кандидаты выбираются диапазоном
+    по словарю, а не его полным перебором.
+    """
+    if limit is None:
+        limit = 1 if len(token) <= 5 else 2
+    terms = connection.execute(
+        "SELECT term FROM cars_fts_vocab WHERE term >= ? AND term < ? AND length(term) BETWEEN ? AND ?",
+        (token[0], _prefix_end(token[0]), len(token) - limit, len(token) + limit),
+    ).fetchall()
+    return [term for term, in terms if edit_distance(token, term, limit) <= limit]
+
+
+def has_prefix(connection, token):
+    return connection.execute(
+        "SELECT 1 FROM cars_fts_vocab WHERE term >= ? AND term < ? LIMIT 1",
+        (token, _prefix_end(token)),
+    ).fetchone() is not None
+
+
+def match_expression(connection, text):
+    """Преобразует ввод пользователя в выражение MATCH для cars_fts.
+
+    Каждое слово ищется как префикс. Если в словаре нет терминов с таким
+    префиксом, слово заменяется на близкие по написанию термины.
+    Возвращает None, если в тексте нет слов.
+    """
+    groups = []
+    for token in TOKEN_RE.findall(text.lower()):
+        variants = [f'"{token}"*']
+        if not has_prefix(connection, token):
+            variants += [f'"{term}"' for term in similar_terms(connection, token)]
+        groups.append(variants[0] if len(variants) == 1 else f"({' OR '.join(variants)})")
+    return " AND ".join(groups) or None
+
+
+def tokenize(texts):
+    """Множества терминов, на которые токенизатор cars_fts разбивает тексты.
+
+    Текст разбирает сам FTS5 во временной таблице в памяти, поэтому термины
+    совпадают с терминами индекса, включая снятие диакритики.
+    """
+    texts = list(texts)
+    connection = sqlite3.connect(":memory:")
+    try:
+        connection.execute(f"CREATE VIRTUAL TABLE texts USING fts5(text, tokenize = '{TOKENIZER}')")
+        connection.execute("CREATE VIRTUAL TABLE terms USING fts5vocab(texts, 'instance')")
+        connection.executemany("INSERT INTO texts (rowid, text) VALUES (?, ?)", enumerate(texts))
+        result = [set() for _ in texts]
+        for term, doc in connection.execute("SELECT term, doc FROM terms"):
+            result[doc].add(term)
+    finally:
+        connection.close()
+    return result
@@ -0,0 +1,566 @@
+"""HTTP/JSON API поверх базы: несколько копий приложения работают с одной базой по сети.
+
+Запуск: python server.py [--host 127.0.0.1] [--port 8765] [--db users.db]
+        [--readers N] [--batch-limit N] [--synchronous NORMAL|FULL]
+
+Сервер однопоточный на asyncio; запросы к базе выполняются в пулах потоков:
+чтения — в --readers потоках, каждый со своим соединением (Database выдает
+соединение на поток), записи — в одном потоке. Записи, пришедшие, пока
+выполнялась предыдущая пачка, выполняются следующей пачкой в одной
+транзакции (Database.write_batch): чем больше клиентов пишет одновременно,
+тем больше записей приходится на одну фиксацию.
+
+Ответы на GET снабжаются ETag; на запрос с совпавшим If-None-Match сервер
+отвечает 304 без тела. Ответы о машинах, кроме того, кэшируются на сервере
+до следующей записи журнала car_changes, которую оставляет любое изменение
+cars, в том числе из других процессов.
+
+Вход (POST /login) возвращает токен сессии; остальные запросы передают его
+в заголовке Authorization: Bearer <токен>. Продавец, покупатель и
+администратор определяются по сессии, а не по логину в запросе.
+
+Клиент — remote.RemoteDatabase; приложение переключается на него флагом
+--server URL или переменной окружения AVTOSELL_SERVER.
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import re
+import secrets
+import sqlite3
+import sys
+import time
+import traceback
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from urllib.parse import parse_qsl, urlsplit
+
+from credentials import Credentials, hash_password
+from database import CHANGE_LOG_KEEP, DB_PATH, PRICE_TREND_DAYS, SORT_COLUMNS, SYNCHRONOUS, SYNCHRONOUS_MODES, Database
+from inventory import car_row
+
+
+HOST = "127.0.0.1"
+PORT = 8765
+
+# Потоки чтения и сколько записей не больше выполнять одной транзакцией
+READERS = 4
+BATCH_LIMIT = 256
+
+# Ограничения запроса: размер тела (импорт пачки машин) и строк на страницу
+MAX_BODY = 16 * 2 ** 20
+MAX_PAGE = 10000
+
+# Сколько ответов о машинах кэшировать на сервере (по объему тел)
+RESPONSE_CACHE_BYTES = 64 * 2 ** 20
+
+# Сколько секунд живет сессия без запросов и сколько ждать следующего
+# запроса на keep-alive соединении
+SESSION_TTL = 12 * 3600
+KEEPALIVE_TIMEOUT = 60
+
+# Как часто переносить проданные машины в архив, сжимать файл и чистить журнал
+MAINTENANCE_INTERVAL = 15 * 60
+
+ROLES = ("Админ", "Продавец", "Покупатель")
+ADMIN, SELLER, BUYER = ROLES
+
+# Маршруты: метод, путь (регулярное выражение) и имя обработчика handle_<имя>
+ROUTES = [(method, re.compile(pattern), name) for method, pattern, name in (
+    ("POST", r"/login", "login"),
+    ("POST", r"/users", "register"),
+    ("GET", r"/users", "list_users"),
+    ("DELETE", r"/users/(\d+)", "delete_user"),
+    ("POST", r"/users/delete", "delete_users"),
+    ("GET", r"/cars", "car_page"),
+    ("GET", r"/cars/by-ids", "cars_by_ids"),
+    ("GET", r"/cars/matches", "count_matches"),
+    ("GET", r"/cars/price-index", "price_index"),
+    ("POST", r"/cars", "add_car"),
+    ("POST", r"/cars/import", "add_cars"),
+    ("DELETE", r"/cars/(\d+)", "delete_car"),
+    ("POST", r"/cars/(\d+)/buy", "buy_car"),
+    ("GET", r"/cars/(\d+)/history", "price_history"),
+    ("GET", r"/prices/averages", "average_prices"),
+    ("GET", r"/changes", "changes"),
+    ("GET", r"/changes/last", "last_change"),
+    ("GET", r"/stats", "market_summary"),
+)]
+
+Request = namedtuple("Request", "method target path query headers body")
+Session = namedtuple("Session", "user expires")
+
+
+class HttpError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def encode(payload):
+    return json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def etag(body):
+    return f'"{hashlib.blake2b(body, digest_size=12).hexdigest()}"'
+
+
+def parse_json(value, name):
+    try:
+        return json.loads(value)
+    except ValueError:
+        raise HttpError(400, f"Некорректное значение {name}") from None
+
+
+def parse_order(value):
+    """order для car_page из параметра запроса: 'ASC', 'DESC', 'RANK' или JSON [[поле, направление], ...]."""
+    if value is None or value in ("ASC", "DESC", "RANK"):
+        return value
+    # Поля и направления попадают в текст SQL, поэтому допускаются только известные
+    order = parse_json(value, "order")
+    if (not isinstance(order, list) or not order
+            or not all(isinstance(key, list) and len(key) == 2 and key[0] in SORT_COLUMNS
+                       and key[1] in ("ASC", "DESC") for key in order)):
+        raise HttpError(400, "Некорректная сортировка")
+    return tuple(tuple(key) for key in order)
+
+
+def parse_filters(query):
+    """Фильтры car_page и cars_by_ids из параметров запроса."""
+    filters = {}
+    if query.get("available_only") == "1":
+        filters["available_only"] = True
+    for name in ("make", "seller_login"):
+        if query.get(name):
+            filters[name] = query[name]
+    for name in ("min_price", "max_price"):
+        if query.get(name):
+            try:
+                filters[name] = float(query[name])
+            except ValueError:
+                raise HttpError(400, f"Некорректное значение {name}") from None
+    return filters
+
+
+def parse_int(query, name, default, maximum=None):
+    try:
+        value = int(query.get(name, default))
+    except ValueError:
+        raise HttpError(400, f"Некорректное значение {name}") from None
+    return value if maximum is None else min(value, maximum)
+
+
+async def read_request(reader):
+    """Читает запрос HTTP/1.1; None, если клиент закрыл соединение."""
+    line = await reader.readline()
+    if not line:
+        return None
+    try:
+        method, target, _ = line.decode("latin-1").split()
+    except ValueError:
+        raise HttpError(400, "Некорректная строка запроса") from None
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    try:
+        length = int(headers.get("content-length", 0))
+    except ValueError:
+        raise HttpError(400, "Некорректный Content-Length") from None
+    if length > MAX_BODY:
+        raise HttpError(413, "Слишком большой запрос")
+    body = await reader.readexactly(length) if length else b""
+    url = urlsplit(target)
+    return Request(method, target, url.path.rstrip("/") or "/", dict(parse_qsl(url.query)), headers, body)
+
+
+class WriteBatcher:
+    """Очередь записей в базу с group commit.
+
+    Записи выполняются в одном потоке; все записи, накопившиеся, пока шла
+    предыдущая пачка, уходят следующей пачкой одной транзакцией (не больше
+    limit). Одиночная запись не ждет: пачка начинается сразу, как только
+    освободился поток записи.
+    """
+
+    def __init__(self, db, limit=BATCH_LIMIT):
+        self.db = db
+        self.limit = limit
+        self.executor = ThreadPoolExecutor(1, thread_name_prefix="writer")
+        self.batches = 0
+        self.writes = 0
+        self._queue = asyncio.Queue()
+
+    async def submit(self, name, *args):
+        """Результат записи или исключение, которым она завершилась (как в Database.write_batch)."""
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((name, args, future))
+        return await future
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            while len(batch) < self.limit and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            operations = [(name, args) for name, args, _ in batch]
+            try:
+                results = await loop.run_in_executor(self.executor, self.db.write_batch, operations)
+            except Exception as error:
+                # Пачка откатилась целиком: записи повторяются по одной, чтобы
+                # ошибка одной из них не отменила остальные
+                if len(batch) == 1:
+                    results = [error]
+                else:
+                    results = [await self._write_one(loop, operation) for operation in operations]
+            for (_, _, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+            self.batches += 1
+            self.writes += len(batch)
+
+    async def run_in_writer(self, func, *args):
+        """Выполняет func в потоке записи, не пересекаясь с пачками (обслуживание базы)."""
+        return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+
+    async def _write_one(self, loop, operation):
+        try:
+            return (await loop.run_in_executor(self.executor, self.db.write_batch, [operation]))[0]
+        except Exception as error:
+            return error
+
+
+class ApiServer:
+    """Обработчики API и соединения с клиентами."""
+
+    def __init__(self, db, readers=READERS, batch_limit=BATCH_LIMIT):
+        self.db = db
+        self.credentials = Credentials(db)
+        self.readers = ThreadPoolExecutor(readers, thread_name_prefix="reader")
+        self.writer = WriteBatcher(db, batch_limit)
+        self.sessions = {}
+        self.requests = 0
+        self.not_modified = 0
+        # target запроса -> (seq журнала, тело, ETag)
+        self._responses = OrderedDict()
+        self._response_bytes = 0
+
+    async def serve(self, host=HOST, port=PORT):
+        server = await asyncio.start_server(self.handle_connection, host, port)
+        host, port = server.sockets[0].getsockname()[:2]
+        print(f"Сервер AvtoSell: http://{host}:{port}", flush=True)
+        tasks = [asyncio.create_task(self.writer.run()), asyncio.create_task(self.maintain())]
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def maintain(self):
+        while True:
+            await asyncio.sleep(MAINTENANCE_INTERVAL)
+            # Журнал изменений при работе через сервер читают только клиенты
+            # сервера, поэтому чистит его сервер, а не шины изменений клиентов
+            seq = await self.read(self.db.last_change_seq)
+            await self.writer.run_in_writer(self.db.prune_car_changes, seq - CHANGE_LOG_KEEP)
+            await self.writer.run_in_writer(self.db.maintain)
+            now = time.monotonic()
+            self.sessions = {token: session for token, session in self.sessions.items() if session.expires > now}
+
+    async def read(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.readers, func, *args)
+
+    async def write(self, name, *args):
+        result = await self.writer.submit(name, *args)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    # Соединения
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                try:
+                    request = await asyncio.wait_for(read_request(reader), KEEPALIVE_TIMEOUT)
+                except HttpError as error:
+                    # Тело запроса не прочитано, поэтому соединение дальше не годится
+                    self.respond(writer, error.status, encode({"error": str(error)}), close=True)
+                    break
+                if request is None:
+                    break
+                self.requests += 1
+                status, body, headers = await self.dispatch(request)
+                close = request.headers.get("connection", "").lower() == "close"
+                self.respond(writer, status, body, headers, close)
+                await writer.drain()
+                if close:
+                    break
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError, ValueError):
+            # Простой дольше KEEPALIVE_TIMEOUT, обрыв соединения или слишком длинная строка
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    def respond(writer, status, body, headers=(), close=False):
+        lines = [f"HTTP/1.1 {status} {HTTPStatus(status).phrase}", f"Content-Length: {len(body)}"]
+        if body:
+            lines.append("Content-Type: application/json; charset=utf-8")
+        lines += [f"{name}: {value}" for name, value in headers]
+        if close:
+            lines.append("Connection: close")
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + body)
+
+    async def dispatch(self, request):
+        """(статус, тело, заголовки) ответа на запрос."""
+        allowed = False
+        for method, pattern, name in ROUTES:
+            match = pattern.fullmatch(request.path)
+            if match is None:
+                continue
+            allowed = True
+            if method == request.method:
+                break
+        else:
+            status, message = (405, "Метод не поддерживается") if allowed else (404, "Нет такого ресурса")
+            return status, encode({"error": message}), ()
+
+        try:
+            payload = await getattr(self, f"handle_{name}")(request, *match.groups())
+        except HttpError as error:
+            return error.status, encode({"error": str(error)}), ()
+        except sqlite3.IntegrityError as error:
+            return 409, encode({"error": str(error)}), ()
+        except sqlite3.OperationalError as error:
+            # Ошибки занятой базы клиент показывает как свои; остальные — ошибки сервера
+            busy = error.sqlite_errorcode & 0xFF in (sqlite3.SQLITE_BUSY, sqlite3.SQLITE_LOCKED)
+            return (503 if busy else 500), encode({"error": str(error)}), ()
+        except (ValueError, TypeError, KeyError, sqlite3.ProgrammingError) as error:
+            return 400, encode({"error": f"Некорректный запрос: {error}"}), ()
+        except Exception as error:
+            traceback.print_exc()
+            return 500, encode({"error": str(error)}), ()
+
+        body, tag = payload if isinstance(payload, tuple) else (encode(payload), None)
+        if request.method != "GET":
+            return 200, body, ()
+        tag = tag or etag(body)
+        if request.headers.get("if-none-match") == tag:
+            self.not_modified += 1
+            return 304, b"", (("ETag", tag),)
+        return 200, body, (("ETag", tag),)
+
+    def session(self, request, *roles):
+        """Пользователь (id, login, password, role) сессии запроса; roles — допустимые роли."""
+        scheme, _, token = request.headers.get("authorization", "").partition(" ")
+        session = self.sessions.get(token) if scheme == "Bearer" else None
+        now = time.monotonic()
+        if session is None or session.expires < now:
+            raise HttpError(401, "Требуется вход")
+        self.sessions[token] = Session(session.user, now + SESSION_TTL)
+        if roles and session.user[3] not in roles:
+            raise HttpError(403, "Недостаточно прав")
+        return session.user
+
+    async def car_response(self, request, func, *args):
+        """(тело, ETag) ответа о машинах: из кэша, если журнал car_changes не менялся."""
+        # seq читается до запроса: изменение между ними лишь сбросит кэш раньше
+        seq = await self.read(self.db.last_change_seq)
+        entry = self._responses.get(request.target)
+        if entry is not None and entry[0] == seq:
+            self._responses.move_to_end(request.target)
+            return entry[1], entry[2]
+        result = await self.read(func, *args)
+        body = encode(result if isinstance(result, list) else list(result))
+        tag = etag(body)
+        if entry is not None:
+            self._response_bytes -= len(entry[1])
+        self._responses[request.target] = (seq, body, tag)
+        self._response_bytes += len(body)
+        while self._response_bytes > RESPONSE_CACHE_BYTES and len(self._responses) > 1:
+            _, (_, evicted, _) = self._responses.popitem(last=False)
+            self._response_bytes -= len(evicted)
+        return body, tag
+
+    # Пользователи
+
+    async def handle_login(self, request):
+        data = json.loads(request.body or b"{}")
+        user = await self.read(self.credentials.authenticate, str(data["login"]), str(data["password"]))
+        if user is None:
+            raise HttpError(401, "Неверный логин или пароль.")
+        token = secrets.token_urlsafe(24)
+        self.sessions[token] = Session(user, time.monotonic() + SESSION_TTL)
+        return {"token": token, "user": [user[0], user[1], user[3]]}
+
+    async def handle_register(self, request):
+        data = json.loads(request.body or b"{}")
+        login, password, role = str(data["login"]), str(data["password"]), data["role"]
+        if not login or not password or role not in ROLES:
+            raise HttpError(400, "Укажите логин, пароль и роль")
+        # Без сессии регистрируются только покупатели и продавцы; админа создает админ
+        if role == ADMIN:
+            self.session(request, ADMIN)
+        # scrypt вычисляется в потоке чтения, а в очередь записей идет готовый хеш
+        stored = await self.read(hash_password, password)
+        await self.write("add_user", login, stored, role)
+        return {"login": login}
+
+    async def handle_list_users(self, request):
+        self.session(request, ADMIN)
+        query = request.query
+        limit = parse_int(query, "limit", 256, MAX_PAGE)
+        role = query.get("role")
+        if role is not None and role not in ROLES:
+            raise HttpError(400, "Некорректная роль")
+        return await self.read(self.db.user_page, query.get("after"), limit, query.get("prefix"), role)
+
+    async def handle_delete_user(self, request, user_id):
+        user = self.session(request, ADMIN)
+        user_id = int(user_id)
+        if user_id == user[0]:
+            raise HttpError(403, "Вы не можете удалить себя!")
+        if await self.read(self.db.admin_ids, [user_id]):
+            raise HttpError(403, "Невозможно удалить админа!")
+        await self.write("delete_user", user_id)
+        self.sessions = {token: session for token, session in self.sessions.items()
+                         if session.user[0] != user_id}
+        return {"deleted": True}
+
+    async def handle_delete_users(self, request):
+        user = self.session(request, ADMIN)
+        ids = json.loads(request.body or b"{}").get("ids")
+        if not isinstance(ids, list) or not all(isinstance(user_id, int) for user_id in ids):
+            raise HttpError(400, "Укажите список id пользователей")
+        if user[0] in ids:
+            raise HttpError(403, "Вы не можете удалить себя!")
+        if await self.read(self.db.admin_ids, ids):
+            raise HttpError(403, "Невозможно удалить админа!")
+        deleted = await self.write("delete_users", ids)
+        removed = set(ids)
+        self.sessions = {token: session for token, session in self.sessions.items()
+                         if session.user[0] not in removed}
+        return {"deleted": deleted}
+
+    # Машины
+
+    async def handle_car_page(self, request):
+        self.session(request)
+        query = request.query
+        after = parse_json(query["after"], "after") if "after" in query else None
+        if after is not None and not isinstance(after, list):
+            raise HttpError(400, "Некорректное значение after")
+        frequent = {"1": True, "0": False}.get(query.get("frequent"))
+        # Параметры разбираются до похода в пул, чтобы ошибка в них не стоила запроса к базе
+        page_limit = parse_int(query, "limit", 256, MAX_PAGE)
+        order = parse_order(query.get("order"))
+        filters = parse_filters(query)
+        return await self.car_response(
+            request, lambda: self.db.car_page(after, page_limit, order, query.get("search"), frequent, **filters)
+        )
+
+    async def handle_cars_by_ids(self, request):
+        self.session(request)
+        query = request.query
+        ids = [int(car_id) for car_id in query.get("ids", "").split(",") if car_id][:MAX_PAGE]
+        filters = parse_filters(query)
+        return await self.car_response(
+            request, lambda: self.db.cars_by_ids(ids, query.get("search"), **filters)
+        )
+
+    async def handle_count_matches(self, request):
+        self.session(request)
+        query = request.query
+        limit = parse_int(query, "limit", MAX_PAGE)
+        return await self.car_response(request, lambda: [self.db.count_matches(query.get("search", ""), limit)])
+
+    async def handle_price_index(self, request):
+        self.session(request)
+        query = request.query
+        after = parse_json(query["after"], "after") if "after" in query else None
+        if after is not None and (not isinstance(after, list) or len(after) != 2):
+            raise HttpError(400, "Некорректное значение after")
+        limit = parse_int(query, "limit", MAX_PAGE, MAX_PAGE)
+        return await self.car_response(
+            request, lambda: self.db.available_price_index(after, limit).fetchall()
+        )
+
+    async def handle_add_car(self, request):
+        user = self.session(request, SELLER)
+        car = car_row(json.loads(request.body or b"{}"), user[1])
+        return {"id": await self.write("add_car", *car)}
+
+    async def handle_add_cars(self, request):
+        user = self.session(request, SELLER)
+        cars = [car_row(record, user[1]) for record in json.loads(request.body or b"{}")["cars"]]
+        return {"added": await self.write("add_cars", cars)}
+
+    async def handle_delete_car(self, request, car_id):
+        user = self.session(request, ADMIN, SELLER)
+        if user[3] == ADMIN:
+            await self.write("delete_car", int(car_id))
+            return {"deleted": True}
+        return {"deleted": await self.write("delete_seller_car", int(car_id), user[1])}
+
+    async def handle_buy_car(self, request, car_id):
+        user = self.session(request, BUYER)
+        return {"result": await self.write("buy_car", int(car_id), user[1])}
+
+    # Журнал изменений и статистика
+
+    async def handle_changes(self, request):
+        self.session(request)
+        since = parse_int(request.query, "since", 0)
+        return await self.car_response(request, self.db.car_changes_since, since)
+
+    async def handle_last_change(self, request):
+        self.session(request)
+        return {"seq": await self.read(self.db.last_change_seq)}
+
+    async def handle_price_history(self, request, car_id):
+        self.session(request)
+        return await self.car_response(request, self.db.price_history, int(car_id))
+
+    async def handle_average_prices(self, request):
+        self.session(request)
+        days = parse_int(request.query, "days", PRICE_TREND_DAYS, 3660)
+        return await self.car_response(request, lambda: list(self.db.make_average_prices(days).items()))
+
+    async def handle_market_summary(self, request):
+        self.session(request, ADMIN)
+        seller_limit = parse_int(request.query, "seller_limit", 200, MAX_PAGE)
+        return await self.car_response(request, self.db.market_summary, seller_limit)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="HTTP API AvtoSell")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--db", default=DB_PATH)
+    parser.add_argument("--readers", type=int, default=READERS)
+    parser.add_argument("--batch-limit", type=int, default=BATCH_LIMIT)
+    parser.add_argument("--synchronous", choices=SYNCHRONOUS_MODES, default=SYNCHRONOUS)
+    args = parser.parse_args()
+
+    db = Database(args.db, synchronous=args.synchronous)
+    db.initialize()
+    server = ApiServer(db, args.readers, args.batch_limit)
+    try:
+        asyncio.run(server.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(f"Запросов: {server.requests}, из них 304: {server.not_modified}; "
+              f"записей: {server.writer.writes} в {server.writer.batches} транзакциях", file=sys.stderr)
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,36 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench import fill_database  # noqa: E402
+from database import Database  # noqa: E402
+
+
+@pytest.fixture
+def db(tmp_path):
+    """Пустая база последней версии схемы."""
+    database = Database(str(tmp_path / "test.db"))
+    database.initialize()
+    yield database
+    database.close()
+
+
+@pytest.fixture(scope="session")
+def qapp():
+    """QApplication без экрана — для шины изменений, очередей и панелей."""
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    from PyQt6.QtWidgets import QApplication
+    return QApplication.instance() or QApplication([])
+
+
+@pytest.fixture(scope="session")
+def catalogue(tmp_path_factory):
+    """Путь к небольшой базе с синтетическим каталогом (как в bench.py)."""
+    path = str(tmp_path_factory.mktemp("catalogue") / "catalogue.db")
+    database = Database(path)
+    fill_database(database, 2000)
+    database.close()
+    return path
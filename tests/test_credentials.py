@@ -0,0 +1,73 @@
+import pytest
+
+import credentials
+from credentials import SCRYPT_N, Credentials, hash_password
+
+
+@pytest.fixture
+def scrypt_calls(monkeypatch):
+    """Счетчик проверок пароля через scrypt."""
+    calls = []
+    verify = credentials.verify_password
+
+    def counted(stored, password):
+        calls.append(password)
+        return verify(stored, password)
+
+    monkeypatch.setattr(credentials, "verify_password", counted)
+    return calls
+
+
+def stored_password(db, login):
+    return db.get_user(login)[2]
+
+
+def test_plain_text_password_is_rehashed_on_login(db):
+    db.add_user("old", "secret", "Покупатель")
+    accounts = Credentials(db)
+    assert accounts.authenticate("old", "wrong") is None
+    assert stored_password(db, "old") == "secret"
+
+    user = accounts.authenticate("old", "secret")
+    assert user[2] == stored_password(db, "old")
+    assert stored_password(db, "old").startswith(f"scrypt${SCRYPT_N}$")
+    assert Credentials(db).authenticate("old", "secret") is not None
+
+
+def test_outdated_cost_is_rehashed_on_login(db):
+    db.add_user("cheap", hash_password("secret", n=2 ** 10), "Продавец")
+    assert Credentials(db).authenticate("cheap", "secret") is not None
+    assert stored_password(db, "cheap").startswith(f"scrypt${SCRYPT_N}$8$1$")
+
+
+def test_repeated_login_uses_session_cache(db, scrypt_calls):
+    accounts = Credentials(db)
+    accounts.register("user", "secret", "Покупатель")
+    assert accounts.authenticate("user", "secret") is not None
+    assert accounts.authenticate("user", "secret") is not None
+    assert scrypt_calls == ["secret"]
+
+    # Другой пароль кэшем не проверяется
+    assert accounts.authenticate("user", "wrong") is None
+    assert scrypt_calls == ["secret", "wrong"]
+
+
+def test_session_cache_is_invalidated(db, scrypt_calls):
+    accounts = Credentials(db)
+    accounts.register("user", "secret", "Покупатель")
+    accounts.authenticate("user", "secret")
+
+    accounts.forget("user")
+    accounts.authenticate("user", "secret")
+    assert len(scrypt_calls) == 2
+
+    # Пароль сменили в другом месте: старый пароль больше не подходит
+    assert db.set_password("user", hash_password("new"), stored_password(db, "user"))
+    assert accounts.authenticate("user", "secret") is None
+    assert accounts.authenticate("user", "new") is not None
+    assert len(scrypt_calls) == 4
+
+    expired = Credentials(db, session_ttl=0)
+    expired.authenticate("user", "new")
+    expired.authenticate("user", "new")
+    assert len(scrypt_calls) == 6
@@ -0,0 +1,180 @@
+import math
+import sqlite3
+
+import pytest
+
+from database import ALREADY_BOUGHT, AVAILABLE, NOT_AVAILABLE, PURCHASED, SOLD, Database, keyset_condition
+from migrations import MIGRATIONS, PRICE_BUCKET_SCALE, schema_version
+
+
+def add_car(db, seller="seller"):
+    return db.add_car("BMW", "X5", 2015, 1500000, "один владелец", seller)
+
+
+def test_buy_car_outcomes(db):
+    car_id = add_car(db)
+    assert db.buy_car(car_id, "first") == PURCHASED
+    assert db.buy_car(car_id, "first") == ALREADY_BOUGHT
+    assert db.buy_car(car_id, "second") == NOT_AVAILABLE
+    assert db.buy_car(car_id + 1, "first") == NOT_AVAILABLE
+    assert db.fetchone("SELECT status, buyer_login FROM cars WHERE id = ?", (car_id,)) == (SOLD, "first")
+
+
+def test_buy_deleted_car(db):
+    car_id = add_car(db)
+    db.delete_car(car_id)
+    assert db.buy_car(car_id, "first") == NOT_AVAILABLE
+
+
+def test_migrate_from_v0(tmp_path):
+    # База первой версии приложения: схема без user_version, статус — текст
+    path = str(tmp_path / "users.db")
+    connection = sqlite3.connect(path)
+    connection.executescript("""
+        CREATE TABLE cars (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            make TEXT NOT NULL,
+            model TEXT NOT NULL,
+            year INTEGER NOT NULL,
+            price REAL NOT NULL,
+            description TEXT,
+            seller_login TEXT NOT NULL,
+            status TEXT DEFAULT 'Доступно',
+            buyer_login TEXT
+        );
+        CREATE TABLE users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            login TEXT UNIQUE NOT NULL,
+            password TEXT NOT NULL,
+            role TEXT NOT NULL
+        );
+        INSERT INTO users (login, password, role) VALUES ('admin', 'admin', 'Администратор');
+        INSERT INTO cars (make, model, year, price, description, seller_login)
+        VALUES ('Lada', 'Vesta', 2019, 900000, 'торг', 'seller');
+        INSERT INTO cars (make, model, year, price, description, seller_login, status)
+        VALUES ('Kia', 'Rio', 2017, 800000, 'срочно', 'seller', 'Куплено покупателем (buyer)');
+    """)
+    connection.close()
+
+    db = Database(path)
+    try:
+        assert db.initialize() == len(MIGRATIONS)
+        assert schema_version(db.connection) == len(MIGRATIONS)
+        assert db.fetchall("SELECT make, status, buyer_login FROM cars ORDER BY id") == [
+            ("Lada", AVAILABLE, None), ("Kia", SOLD, "buyer"),
+        ]
+        assert db.get_user("admin")[1] == "admin"
+        assert [row[1] for row in db.car_page(available_only=True, search="vesta")] == ["Lada"]
+        # Повторный запуск ничего не меняет
+        assert db.initialize() == len(MIGRATIONS)
+    finally:
+        db.close()
+
+
+def test_write_batch_isolates_failed_write(db):
+    db.add_user("taken", "1", "Покупатель")
+    results = db.write_batch([
+        ("add_user", ("first", "1", "Покупатель")),
+        ("add_user", ("taken", "2", "Продавец")),
+        ("add_user", ("second", "1", "Покупатель")),
+    ])
+    assert results[0] is None and results[2] is None
+    assert isinstance(results[1], sqlite3.IntegrityError)
+    assert [row[1] for row in db.user_page()] == ["first", "second", "taken"]
+    assert db.get_user("taken")[2] == "1"
+
+
+def test_write_batch_rejects_unknown_write(db):
+    with pytest.raises(ValueError):
+        db.write_batch([("add_user", ("first", "1", "Покупатель")), ("drop_table", ())])
+    assert db.get_user("first") is None
+
+
+def ln_bucket(price):
+    # round() в SQLite округляет половины от нуля
+    value = math.log(price) * PRICE_BUCKET_SCALE
+    return int(math.copysign(math.floor(abs(value) + 0.5), value))
+
+
+def test_price_bucket_table_matches_ln(db):
+    prices = [0.5, 1, 999, 1000, 123456, 1500000, 2.5e7] + [1000 * 1.01 ** step for step in range(500)]
+    for price in prices:
+        expected = db.fetchone("SELECT bucket FROM price_buckets WHERE low <= ? ORDER BY low DESC LIMIT 1", (price,))
+        assert expected == (ln_bucket(price),), price
+    assert db.fetchone("SELECT bucket FROM price_buckets WHERE low <= 0 ORDER BY low DESC LIMIT 1") is None
+
+
+def test_plain_connection_can_write_cars(db):
+    assert not db.fetchall("SELECT name FROM sqlite_master WHERE sql LIKE '%ln(%' OR sql LIKE '%price_bucket(%'")
+    car_id = add_car(db)
+    db.close()
+
+    # Соединение без функций приложения: триггеры сводок должны работать и в нем
+    connection = sqlite3.connect(db.path)
+    connection.execute("UPDATE cars SET price = 1600000 WHERE id = ?", (car_id,))
+    assert connection.execute("SELECT bucket, cars_count FROM market_prices").fetchall() == [(ln_bucket(1600000), 1)]
+    connection.execute("DELETE FROM cars WHERE id = ?", (car_id,))
+    connection.commit()
+    assert connection.execute("SELECT count(*) FROM market_prices").fetchone() == (0,)
+    connection.close()
+
+
+def keyset_pages(fetch, limit):
+    """Все строки, прочитанные страницами по ключу последней строки."""
+    rows, after = [], None
+    while True:
+        page = fetch(after, limit)
+        rows.extend(page)
+        if len(page) < limit:
+            return rows
+        after = page[-1]
+
+
+@pytest.mark.parametrize("directions", [
+    ("ASC", "ASC"), ("DESC", "DESC"), ("ASC", "DESC"), ("DESC", "ASC"),
+])
+def test_keyset_condition_orders_nulls_like_sqlite(directions):
+    connection = sqlite3.connect(":memory:")
+    connection.execute("CREATE TABLE t (id INTEGER PRIMARY KEY, price REAL, year INTEGER NOT NULL)")
+    connection.executemany("INSERT INTO t VALUES (?, ?, ?)", [
+        (number, None if number % 4 == 0 else float(number % 5), 2000 + number % 3) for number in range(1, 41)
+    ])
+    columns = ["price", "year", "id"]
+    directions = list(directions) + [directions[0]]
+    ordering = ", ".join(f"{column} {direction}" for column, direction in zip(columns, directions))
+
+    def fetch(after, limit):
+        where, params = "", []
+        if after is not None:
+            condition, params = keyset_condition(columns, directions, after, nullable=("price",))
+            where = f"WHERE {condition}"
+        return connection.execute(f"SELECT price, year, id FROM t {where} ORDER BY {ordering} LIMIT ?",
+                                  (*params, limit)).fetchall()
+
+    expected = connection.execute(f"SELECT price, year, id FROM t ORDER BY {ordering}").fetchall()
+    assert any(price is None for price, _, _ in expected)
+    for limit in (1, 3, 7):
+        assert keyset_pages(fetch, limit) == expected
+    connection.close()
+
+
+@pytest.mark.parametrize("order", [
+    (("price", "DESC"), ("year", "ASC")), (("year", "ASC"), ("make", "DESC"), ("price", "ASC")),
+])
+def test_car_page_mixed_directions(catalogue, order):
+    db = Database(catalogue)
+    try:
+        def fetch(after, limit):
+            key = None if after is None else [after[{"make": 1, "year": 3, "price": 4}[field]] for field, _ in order]
+            return db.car_page(None if key is None else key + [after[0]], limit, order, available_only=True)
+
+        expected = db.car_page(None, 10 ** 6, order, available_only=True)
+        assert keyset_pages(fetch, 97) == expected
+    finally:
+        db.close()
+
+
+def test_car_prices_are_never_null(db):
+    # keyset_condition для столбцов cars рассчитывает на NOT NULL
+    with pytest.raises(sqlite3.IntegrityError):
+        db.add_car("BMW", "X5", 2015, None, "", "seller")
@@ -0,0 +1,92 @@
+import pytest
+
+from database import Database
+from events import CarChange
+from filter_index import CatalogueIndex, open_filter_pager, snapshot_path
+from search import match_expression
+
+
+def database_ids(db, min_price, max_price, descending):
+    direction = "DESC" if descending else "ASC"
+    return [car_id for car_id, in db.fetchall(
+        f"SELECT id FROM cars WHERE status = 0 AND price BETWEEN ? AND ? "
+        f"ORDER BY price {direction}, id {direction}", (min_price, max_price))]
+
+
+@pytest.mark.parametrize("min_price, max_price, descending", [
+    (0, 10 ** 9, False), (500000, 1500000, False), (500000, 1500000, True), (10 ** 8, 10 ** 9, False),
+])
+def test_index_matches_database(catalogue, min_price, max_price, descending):
+    db = Database(catalogue)
+    try:
+        index = CatalogueIndex.build(db)
+        result = index.query("", min_price, max_price, descending)
+        assert list(result.ids()) == database_ids(db, min_price, max_price, descending)
+        assert len(result) == len(database_ids(db, min_price, max_price, descending))
+    finally:
+        db.close()
+
+
+def search_ids(db, text, min_price=None, max_price=None):
+    """id машин, которые находит полнотекстовый поиск, по возрастанию (цена, id)."""
+    return [car_id for car_id, in db.fetchall(
+        "SELECT id FROM cars WHERE status = 0 AND price BETWEEN ? AND ? "
+        "AND id IN (SELECT rowid FROM cars_fts WHERE cars_fts MATCH ?) ORDER BY price, id",
+        (min_price or 0, max_price or 10 ** 12, match_expression(db.connection, text)))]
+
+
+def test_make_words_match_full_text_search(catalogue):
+    db = Database(catalogue)
+    try:
+        index = CatalogueIndex.build(db)
+        terms = [term for term, in db.fetchall("SELECT term FROM cars_fts_vocab")]
+        prefixes = {term[:length] for term in terms for length in range(1, len(term) + 1)}
+        answered = 0
+        for prefix in sorted(prefixes) + ["BMW", "Bm", "bmw x5", "бмв"]:
+            for min_price, max_price in ((None, None), (500000, 1500000)):
+                result = index.query(prefix, min_price, max_price)
+                if result is None:
+                    continue
+                answered += 1
+                expected = search_ids(db, prefix, min_price, max_price)
+                assert list(result.ids()) == expected, prefix
+                assert len(result) == len(expected), prefix
+        assert answered
+        # С "c" начинаются и модели (camry, corolla): такой текст ищет база
+        assert index.query("c") is None
+        assert index.query("bmw x5") is None
+        assert index.query("bm") is not None
+    finally:
+        db.close()
+
+
+def test_make_terms_follow_fts_tokenizer(db):
+    skoda = db.add_car("Škoda", "Octavia", 2015, 900000, "", "seller")
+    lada = db.add_car("Лада", "Веста", 2019, 1100000, "", "seller")
+    index = CatalogueIndex.build(db)
+    assert list(index.query("skod").ids()) == [skoda] == search_ids(db, "skod")
+    assert list(index.query("лад").ids()) == [lada] == search_ids(db, "лад")
+    assert index.query("вес") is None
+
+    # Описание новой машины начинается с того же слова, что и марка: индекс
+    # больше не может отвечать за поиск, иначе пропустит эту машину
+    third = db.add_car("Kia", "Rio", 2017, 800000, "ладная машина", "seller")
+    index.apply_changes([CarChange(*row) for row in db.car_changes_since(index.seq)], db)
+    assert index.query("лад") is None
+    assert third in search_ids(db, "лад")
+
+
+def test_snapshot_catch_up(db):
+    first = db.add_car("BMW", "X5", 2015, 1500000, "", "seller")
+    index = CatalogueIndex.load(db)
+    second = db.add_car("Kia", "Rio", 2017, 800000, "", "seller")
+    db.buy_car(first, "buyer")
+
+    loaded = CatalogueIndex.load(db)
+    assert list(loaded.query().ids()) == [second]
+    assert list(loaded.query("ki").ids()) == [second]
+    assert loaded.text_terms == db.text_terms() == ["rio", "x5"]
+    assert list(index.query().ids()) == [first]
+    pager = open_filter_pager(db, loaded.query())
+    assert pager.total == 1
+    assert snapshot_path(db) == db.path + ".catalogue"
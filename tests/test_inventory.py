@@ -0,0 +1,98 @@
+import threading
+
+from inventory import export_file, import_file
+
+
+def test_csv_import_reports_row_errors(db, tmp_path):
+    path = tmp_path / "cars.csv"
+    path.write_text(
+        "make,model,year,price,description\n"
+        "BMW,X5,2015,1500000,один владелец\n"
+        "Kia,Rio,год,800000,\n"
+        ",Vesta,2019,1100000,\n"
+        "Lada,Granta,2020,-5,\n"
+        "Toyota,Camry,2018,2100000,\n",
+        encoding="utf-8",
+    )
+    report = import_file(db, str(path), "seller")
+    assert (report.imported, report.failed) == (2, 3)
+    assert report.errors == [
+        (3, "Введите корректный год!"),
+        (4, "Не указаны марка или модель."),
+        (5, "Цена должна быть положительным числом."),
+    ]
+    assert sorted(make for make, in db.fetchall("SELECT make FROM cars WHERE seller_login = 'seller'")) == [
+        "BMW", "Toyota",
+    ]
+
+
+def test_jsonl_import_reports_row_errors(db, tmp_path):
+    path = tmp_path / "cars.jsonl"
+    path.write_text(
+        '{"make": "BMW", "model": "X5", "year": 2015, "price": 1500000}\n'
+        '{"make": "Kia", "model": \n'
+        "\n"
+        '["Lada", "Vesta"]\n'
+        '{"make": "Kia", "model": "Rio", "year": 1900, "price": 800000}\n',
+        encoding="utf-8",
+    )
+    report = import_file(db, str(path), "seller")
+    assert (report.imported, report.failed) == (1, 3)
+    assert [line for line, _ in report.errors] == [2, 4, 5]
+    assert report.errors[0][1].startswith("Некорректный JSON")
+    assert report.errors[1][1] == "Ожидался объект JSON."
+
+
+def test_second_import_or_export_is_refused(qapp, db, tmp_path, monkeypatch):
+    import main
+    import panels
+
+    source = tmp_path / "cars.csv"
+    source.write_text("make,model,year,price\nBMW,X5,2015,1500000\n", encoding="utf-8")
+    target = tmp_path / "export.csv"
+    monkeypatch.setattr(panels.QFileDialog, "getOpenFileName", lambda *args: (str(source), ""))
+    monkeypatch.setattr(panels.QFileDialog, "getSaveFileName", lambda *args: (str(target), ""))
+    messages = []
+    monkeypatch.setattr(panels.QMessageBox, "warning", lambda *args: messages.append(("warning", args[2])))
+    monkeypatch.setattr(panels.QMessageBox, "information", lambda *args: messages.append(("information", args[2])))
+
+    # Импорт держится, пока тест его не отпустит
+    started, release = threading.Event(), threading.Event()
+
+    def slow_import(*args):
+        started.set()
+        release.wait(5)
+        return import_file(*args)
+
+    monkeypatch.setattr(panels, "import_file", slow_import)
+
+    window = main.AuthRegApp(db)
+    window.current_user = (1, "seller", None, "Продавец")
+    panel = window.seller_panel
+    panel.import_cars()
+    assert started.wait(5)
+    panel.import_cars()
+    panel.export_cars()
+    assert messages == [("warning", "Дождитесь окончания импорта или экспорта.")] * 2
+
+    release.set()
+    window.queries.wait()
+    qapp.processEvents()
+    assert messages[-1] == ("information", "Импортировано машин: 1. Строк с ошибками: 0.")
+    assert db.fetchone("SELECT count(*) FROM cars") == (1,)
+
+    panel.export_cars()
+    window.queries.wait()
+    qapp.processEvents()
+    assert messages[-1] == ("information", "Выгружено машин: 1.")
+    assert target.read_text(encoding="utf-8").splitlines()[1].startswith("1,BMW,X5,2015")
+    window.writes.wait()
+    window.close()
+
+
+def test_export_writes_every_seller_car(db, tmp_path):
+    db.add_car("BMW", "X5", 2015, 1500000, "", "seller")
+    db.add_car("Kia", "Rio", 2017, 800000, "", "other")
+    path = tmp_path / "cars.jsonl"
+    assert export_file(db, str(path), "seller") == 1
+    assert '"make": "BMW"' in path.read_text(encoding="utf-8")
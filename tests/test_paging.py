@@ -0,0 +1,143 @@
+import random
+
+import pytest
+
+from events import CHANGE_BATCH_LIMIT, CarChange, ChangeBus
+from paging import KeysetPager, PagerCache, open_pager
+
+
+MAKES = ["BMW", "Kia", "Lada", "Toyota"]
+
+
+def fill(db, rows=60, seed=3):
+    rng = random.Random(seed)
+    for number in range(rows):
+        db.add_car(rng.choice(MAKES), f"M{number % 7}", rng.randrange(2000, 2024),
+                   rng.randrange(10, 40) * 10000, "", f"seller{number % 3}")
+
+
+def all_ids(pager):
+    """id всех строк пейджера по порядку, с дочитыванием до конца каталога."""
+    ids, number = [], 0
+    while number < pager.loaded_pages or not pager.exhausted:
+        ids.extend(pager.page(number).ids)
+        number += 1
+    return ids
+
+
+def ignore(op, number, offset):
+    pass
+
+
+def change_cars(db, rng):
+    """Покупки, удаления, новые машины и смена цен и годов, как у других процессов."""
+    ids = [car_id for car_id, in db.fetchall("SELECT id FROM cars WHERE status = 0")]
+    for car_id in rng.sample(ids, 6):
+        db.buy_car(car_id, "buyer")
+    for car_id in rng.sample(ids, 4):
+        db.delete_car(car_id)
+    with db.transaction() as connection:
+        for car_id in rng.sample(ids, 10):
+            connection.execute("UPDATE cars SET price = ?, year = ? WHERE id = ?",
+                               (rng.randrange(10, 40) * 10000, rng.randrange(2000, 2024), car_id))
+    for _ in range(5):
+        db.add_car(rng.choice(MAKES), "New", rng.randrange(2000, 2024), rng.randrange(10, 40) * 10000, "", "seller9")
+
+
+@pytest.mark.parametrize("order", [
+    None, "ASC", "DESC", (("year", "DESC"), ("price", "ASC")), (("make", "ASC"), ("year", "DESC")),
+])
+def test_applied_changes_match_fresh_pager(qapp, db, order):
+    fill(db)
+    bus = ChangeBus(db)
+    published = []
+    bus.cars_changed.connect(published.append)
+    bus.reset.connect(lambda: published.append("reset"))
+    pager = KeysetPager(db, page_size=7, order=order, available_only=True)
+    all_ids(pager)
+
+    change_cars(db, random.Random(11))
+    bus.poll(force=True)
+    assert len(published) == 1 and published[0] != "reset"
+    pager.apply_changes(published[0], ignore, ignore)
+
+    fresh = KeysetPager(db, page_size=7, order=order, available_only=True)
+    assert all_ids(pager) == all_ids(fresh)
+
+
+def test_bus_publishes_each_change_once(qapp, db):
+    fill(db, rows=3)
+    bus = ChangeBus(db)
+    published = []
+    bus.cars_changed.connect(published.append)
+    car_id = db.add_car("Kia", "Rio", 2017, 800000, "", "seller")
+    bus.poll(force=True)
+    bus.poll(force=True)
+    assert [[(change.car_id, change.op) for change in changes] for changes in published] == [[(car_id, "insert")]]
+    assert bus.seq == db.last_change_seq()
+
+
+def test_bus_resets_after_import_or_many_changes(qapp, db):
+    bus = ChangeBus(db)
+    resets = []
+    bus.reset.connect(lambda: resets.append(bus.seq))
+    db.add_cars([("Kia", "Rio", 2017, 800000, "", "seller")] * 3)
+    bus.poll(force=True)
+    for _ in range(CHANGE_BATCH_LIMIT + 1):
+        db.add_car("Kia", "Rio", 2017, 800000, "", "seller")
+    bus.poll(force=True)
+    assert len(resets) == 2
+
+
+def test_cache_drops_pager_behind_the_change_log(db):
+    fill(db, rows=10)
+    cache = PagerCache(db)
+    key = PagerCache.key(order="ASC", available_only=True)
+    pager = open_pager(db, order="ASC", available_only=True)
+    cache.put(key, pager, db.last_change_seq())
+    assert cache.take(key) is pager
+    cache.put(key, pager, db.last_change_seq())
+
+    # Запись, которую шина еще не применила к пейджеру (например, другой процесс)
+    db.add_car("Kia", "Rio", 2017, 800000, "", "seller")
+    assert cache.take(key) is None
+    assert (cache.hits, cache.misses, cache.invalidations) == (1, 1, 1)
+
+
+def test_cache_applies_changes_to_cached_pagers(db):
+    fill(db, rows=10)
+    cache = PagerCache(db)
+    key = PagerCache.key(order="ASC", available_only=True)
+    cache.put(key, open_pager(db, order="ASC", available_only=True), db.last_change_seq())
+
+    seq = db.last_change_seq()
+    car_id = db.add_car("Kia", "Rio", 2017, 1, "", "seller")
+    cache.apply_changes([CarChange(*row) for row in db.car_changes_since(seq)])
+    pager = cache.take(key)
+    assert pager is not None
+    assert pager.page(0).ids[0] == car_id
+
+
+def test_cache_evicts_least_recently_used(db):
+    fill(db, rows=10)
+    pagers = {price: open_pager(db, available_only=True, max_price=price) for price in (200000, 300000, 400000)}
+    sizes = {price: pager.memory_size() for price, pager in pagers.items()}
+    cache = PagerCache(db, max_bytes=sizes[200000] + sizes[300000] + sizes[400000] - 1)
+    seq = db.last_change_seq()
+    keys = {price: PagerCache.key(available_only=True, max_price=price) for price in pagers}
+    cache.put(keys[200000], pagers[200000], seq)
+    cache.put(keys[300000], pagers[300000], seq)
+    # Повторное использование делает пейджер самым свежим
+    cache.put(keys[200000], cache.take(keys[200000]), seq)
+    cache.put(keys[400000], pagers[400000], seq)
+
+    assert cache.evictions == 1
+    assert cache.take(keys[300000]) is None
+    assert cache.take(keys[200000]) is pagers[200000]
+    assert cache.take(keys[400000]) is pagers[400000]
+
+
+def test_cache_key_normalizes_filters():
+    assert PagerCache.key(search="  BMW,  x5 ", min_price=100) == PagerCache.key(search="bmw x5", min_price=100.0)
+    assert PagerCache.key(order=[("year", "ASC")]) == PagerCache.key(order=(("year", "ASC"),))
+    assert PagerCache.key(available_only=True) != PagerCache.key()
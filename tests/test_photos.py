@@ -0,0 +1,41 @@
+import os
+import time
+
+from photos import SWEEP_AFTER, PhotoStore
+
+
+def make_photo(tmp_path, store, content):
+    source = tmp_path / f"{content}.jpg"
+    source.write_bytes(content.encode())
+    digest = store.add(str(source))
+    # Уборка не трогает только что скопированные файлы
+    old = time.time() - SWEEP_AFTER - 60
+    os.utime(store.original_path(digest), (old, old))
+    return digest
+
+
+def test_archived_car_photos_are_swept(tmp_path, db):
+    store = PhotoStore(str(tmp_path / "photos"))
+    kept_car = db.add_car("BMW", "X5", 2015, 1500000, "", "seller")
+    deleted_car = db.add_car("Kia", "Rio", 2017, 800000, "", "seller")
+    shared = make_photo(tmp_path, store, "shared")
+    own = make_photo(tmp_path, store, "own")
+    db.add_car_photos(kept_car, [shared])
+    db.add_car_photos(deleted_car, [shared, own])
+
+    db.delete_car(deleted_car)
+    assert db.cover_photos([kept_car, deleted_car]) == {kept_car: shared}
+    assert db.photo_digests() == {shared}
+
+    db.maintain(store)
+    assert os.path.exists(store.original_path(shared))
+    assert not os.path.exists(store.original_path(own))
+
+
+def test_fresh_unreferenced_photo_is_kept(tmp_path, db):
+    store = PhotoStore(str(tmp_path / "photos"))
+    source = tmp_path / "new.jpg"
+    source.write_bytes(b"new")
+    digest = store.add(str(source))
+    assert store.sweep(db.photo_digests()) == 0
+    assert os.path.exists(store.original_path(digest))
@@ -0,0 +1,59 @@
+import time
+
+from database import AVAILABLE, PRICE_TREND_DAYS, SOLD
+
+
+def set_price(db, car_id, price):
+    with db.transaction() as connection:
+        connection.execute("UPDATE cars SET price = ? WHERE id = ?", (price, car_id))
+
+
+def age_history(db, car_id, seconds):
+    """Сдвигает записи истории машины в прошлое, как будто они сделаны раньше."""
+    with db.transaction() as connection:
+        connection.execute("UPDATE price_history SET at = at - ? WHERE car_id = ?", (seconds, car_id))
+
+
+def test_history_stores_deltas_and_decodes_prices(db):
+    car_id = db.add_car("BMW", "X5", 2015, 1500000.5, "", "seller")
+    age_history(db, car_id, 200)
+    set_price(db, car_id, 1400000)
+    age_history(db, car_id, 100)
+    db.buy_car(car_id, "buyer")
+
+    assert db.fetchall("SELECT price_delta, status FROM price_history WHERE car_id = ? ORDER BY at", (car_id,)) == [
+        (150000050, AVAILABLE), (-10000050, AVAILABLE), (0, SOLD),
+    ]
+    history = db.price_history(car_id)
+    assert [(price, status) for _, price, status in history] == [
+        (1500000.5, AVAILABLE), (1400000, AVAILABLE), (1400000, SOLD),
+    ]
+    assert history[0][0] < history[1][0] < history[2][0]
+
+
+def test_changes_within_a_second_merge_into_one_record(db):
+    car_id = db.add_car("Kia", "Rio", 2017, 800000, "", "seller")
+    age_history(db, car_id, 10)
+    # Обе смены цены должны попасть в одну секунду
+    time.sleep(1 - time.time() % 1)
+    set_price(db, car_id, 790000)
+    set_price(db, car_id, 780000)
+    assert [price for _, price, _ in db.price_history(car_id)] == [800000, 780000]
+
+
+def test_daily_make_average(db):
+    db.add_car("BMW", "X5", 2015, 1000000, "", "seller")
+    bmw = db.add_car("BMW", "X3", 2016, 2000000, "", "seller")
+    db.add_car("Kia", "Rio", 2017, 500000, "", "seller")
+    # Новая цена — еще одно предложение марки
+    set_price(db, bmw, 3000000)
+    db.add_cars([("Kia", "Ceed", 2018, 700000, "", "seller")])
+    # Предложения старше PRICE_TREND_DAYS в среднее не входят
+    with db.transaction() as connection:
+        connection.execute("INSERT INTO price_days VALUES ('BMW', ?, 5, 1.0)",
+                           (int(time.time()) // 86400 - PRICE_TREND_DAYS - 5,))
+
+    assert db.make_average_prices() == {"BMW": 2000000, "Kia": 600000}
+    assert db.make_average_price("BMW") == 2000000
+    assert db.make_average_price("Lada") is None
+    assert db.fetchone("SELECT sum(offers) FROM price_days WHERE make = 'BMW'") == (8,)
@@ -0,0 +1,92 @@
+"""EXPLAIN QUERY PLAN запросов панелей: каждый должен идти по индексу."""
+import pytest
+
+from database import Database
+
+
+def panel_queries(db):
+    """Операции панелей: (название, функция, допустим ли полный проход по таблице)."""
+    return [
+        ("AuthRegApp.login", lambda: db.get_user("bench"), False),
+        # Первая страница — проход по индексу логина, прерванный на LIMIT
+        ("AdminPanel.load_users", lambda: db.user_page(), True),
+        ("AdminPanel.load_users (page 2, prefix)", lambda: db.user_page("bench", prefix="b"), False),
+        ("AdminPanel.load_users (role)", lambda: db.user_page("a", role="Покупатель"), False),
+        ("AdminCarsWindow.load_car_list", lambda: db.list_cars().fetchmany(1), True),
+        ("SellerPanel.load_car_list", lambda: db.cars_by_seller("seller1").fetchmany(1), False),
+        ("SellerPanel.delete_car", lambda: db.delete_seller_car(-1, "seller1"), False),
+        ("BuyerPanel.load_car_list", lambda: db.car_page(), True),
+        ("BuyerPanel.load_car_list (page 2)", lambda: db.car_page(after=(100,)), False),
+        ("BuyerPanel.apply_filters", lambda: db.car_page(available_only=True), False),
+        ("BuyerPanel.apply_filters (price)", lambda: db.car_page(
+            order="ASC", available_only=True, min_price=150000, max_price=500000), False),
+        # Редкое слово: совпадения (не больше SORTED_SEARCH_MATCHES) берутся из
+        # индекса поиска и сортируются; частое — проход по индексу цены
+        ("BuyerPanel.apply_filters (page 2)", lambda: db.car_page(
+            after=(200000.0, 10), order="DESC", available_only=True, search="bmw"), True),
+        ("BuyerPanel.apply_filters (frequent, page 2)", lambda: db.car_page(
+            after=(200000.0, 10), order="DESC", available_only=True, search="bmw", frequent=True), False),
+        ("BuyerPanel.apply_filters (search, page 2)", lambda: db.car_page(
+            after=(100,), available_only=True, search="toyota"), False),
+        # Ранжирование по bm25 сортирует все совпадения; их число ограничено RANK_LIMIT
+        ("BuyerPanel.apply_filters (search)", lambda: db.car_page(
+            order="RANK", available_only=True, search="bmw x5"), True),
+        # Сортировка по заголовку таблицы: первая страница и следующая по ключу
+        ("BuyerPanel.sort_by_header (year)", lambda: db.car_page(
+            order=(("year", "DESC"),), available_only=True), False),
+        ("BuyerPanel.sort_by_header (make, page 2)", lambda: db.car_page(
+            after=("BMW", "X5", 100), order=(("make", "ASC"), ("model", "ASC")), available_only=True), False),
+        ("BuyerPanel.sort_by_header (model, page 2)", lambda: db.car_page(
+            after=("X5", 100), order=(("model", "DESC"),), available_only=True), False),
+        # Разные направления ключей индекс не покрывает: ищется начало по первому
+        # ключу, а хвост досортировывается во временном B-дереве
+        ("BuyerPanel.sort_by_header (year, price)", lambda: db.car_page(
+            after=(2015, 300000.0, 100), order=(("year", "DESC"), ("price", "ASC")), available_only=True), True),
+        ("CatalogueIndex.catch_up (import)", lambda: db.available_cars_after(10 ** 9).fetchall(), False),
+        ("ChangeBus.cars_changed", lambda: db.cars_by_ids(
+            range(1, 257), available_only=True, min_price=150000, search="bmw"), False),
+        ("BuyerPanel.buy_car", lambda: db.buy_car(-1, "bench"), False),
+        # Дневная сводка цен невелика (марки на дни) и читается целиком
+        ("BuyerPanel.load_trends", lambda: db.make_average_prices(), True),
+        ("Database.price_history", lambda: db.price_history(1), False),
+        ("Database.make_average_price", lambda: db.make_average_price("BMW"), False),
+    ]
+
+
+def full_scans(db, operation):
+    """Строки планов запросов операции с полным проходом или сортировкой
+    во временном B-дереве."""
+    statements = []
+    db.connection.set_trace_callback(statements.append)
+    operation()
+    db.connection.set_trace_callback(None)
+
+    scans = []
+    for statement in statements:
+        # Внутренние запросы FTS5 к своим служебным таблицам не проверяем
+        if not statement.lstrip().upper().startswith("SELECT") or "'main'." in statement:
+            continue
+        # Проход по частичному индексу машин в продаже читает только их и по порядку
+        scans += [line for line in db.query_plan(statement)
+                  if line.startswith("SCAN") and "VIRTUAL TABLE" not in line
+                  and "USING INDEX idx_cars_available" not in line or "TEMP B-TREE" in line]
+    return scans
+
+
+@pytest.mark.parametrize("name", [name for name, _, _ in panel_queries(None)])
+def test_panel_query_uses_index(catalogue, name):
+    db = Database(catalogue)
+    try:
+        operation, expect_scan = {item[0]: item[1:] for item in panel_queries(db)}[name]
+        scans = full_scans(db, operation)
+    finally:
+        db.close()
+    assert expect_scan or not scans, scans
+
+
+def test_full_scan_is_detected(catalogue):
+    db = Database(catalogue)
+    try:
+        assert full_scans(db, lambda: db.list_cars().fetchmany(1))
+    finally:
+        db.close()
@@ -0,0 +1,77 @@
+import sqlite3
+
+import pytest
+
+from workers import WriteQueue
+
+
+@pytest.fixture
+def batches(db, monkeypatch):
+    """Пачки, которые очередь передала в Database.write_batch."""
+    calls = []
+    write_batch = db.write_batch
+
+    def counted(operations):
+        calls.append([name for name, _ in operations])
+        return write_batch(operations)
+
+    monkeypatch.setattr(db, "write_batch", counted)
+    return calls
+
+
+def car(number):
+    return ("Kia", "Rio", 2000 + number, 800000 + number, "", "seller")
+
+
+def test_writes_in_one_window_share_one_commit(qapp, db, batches):
+    queue = WriteQueue(db, window_ms=50)
+    results = []
+    for number in range(10):
+        queue.submit([("add_car", car(number))], results.append)
+    queue.wait()
+
+    assert batches == [["add_car"] * 10]
+    assert (queue.batches, queue.writes) == (1, 10)
+    ids = [car_id for car_id, in db.fetchall("SELECT id FROM cars ORDER BY id")]
+    assert results == [[car_id] for car_id in ids]
+
+
+def test_failed_write_rolls_back_only_its_savepoint(qapp, db, batches):
+    db.add_user("taken", "1", "Покупатель")
+    queue = WriteQueue(db, window_ms=50)
+    results = []
+    queue.submit([("add_user", ("first", "1", "Покупатель"))], results.append)
+    queue.submit([("add_user", ("taken", "2", "Продавец")), ("add_car", car(1))], results.append)
+    queue.submit([("add_user", ("second", "1", "Покупатель"))], results.append)
+    queue.wait()
+
+    assert len(batches) == 1
+    assert results[0] == [None] and results[2] == [None]
+    assert isinstance(results[1][0], sqlite3.IntegrityError) and isinstance(results[1][1], int)
+    assert [row[1] for row in db.user_page()] == ["first", "second", "taken"]
+    assert db.get_user("taken")[2] == "1"
+    assert db.fetchone("SELECT count(*) FROM cars") == (1,)
+
+
+def test_failed_batch_is_retried_group_by_group(qapp, db, batches):
+    queue = WriteQueue(db, window_ms=50)
+    results, errors = [], []
+    queue.submit([("add_car", car(1))], results.append, errors.append)
+    # Ошибка не ограничения, а самого запроса откатывает всю транзакцию
+    queue.submit([("delete_car", (object(),))], results.append, errors.append)
+    queue.submit([("add_car", car(2))], results.append, errors.append)
+    queue.wait()
+
+    assert batches == [["add_car", "delete_car", "add_car"], ["add_car"], ["delete_car"], ["add_car"]]
+    assert len(results) == 2 and len(errors) == 1
+    assert isinstance(errors[0], sqlite3.Error)
+    assert db.fetchone("SELECT count(*) FROM cars") == (2,)
+
+
+def test_queue_splits_writes_over_the_limit(qapp, db, batches):
+    queue = WriteQueue(db, window_ms=50, limit=4)
+    for number in range(10):
+        queue.submit([("add_car", car(number))])
+    queue.wait()
+    assert [len(batch) for batch in batches] == [4, 4, 2]
+    assert db.fetchone("SELECT count(*) FROM cars") == (10,)
@@ -0,0 +1,241 @@
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from PyQt6.QtCore import QCoreApplication, QObject, QThreadPool, QTimer, pyqtSignal
+
+from database import WRITE_OPERATIONS
+
+
+# Сколько миллисекунд копить записи из GUI перед фиксацией и сколько
+# записей фиксировать одной транзакцией
+WRITE_WINDOW_MS = 20
+WRITE_BATCH_LIMIT = 500
+
+
+class QueryTask:
+    """Запрос, выполняемый в потоке пула на собственном соединении потока."""
+
+    def __init__(self, executor, channel, request_id, func, args):
+        self.executor = executor
+        self.channel = channel
+        self.request_id = request_id
+        self.func = func
+        self.args = args
+        self.cancelled = False
+        self._connection = None
+        self._lock = threading.Lock()
+
+    def cancel(self):
+        """Отменяет запрос; если он уже выполняется, прерывает его через sqlite3 interrupt."""
+        with self._lock:
+            self.cancelled = True
+            if self._connection is not None:
+                self._connection.interrupt()
+
+    def run(self):
+        with self._lock:
+            if self.cancelled:
+                return
+            self._connection = self.executor.db.connection
+        try:
+            result = self.func(*self.args)
+        except sqlite3.OperationalError as error:
+            if not self.cancelled:
+                self.executor.failed.emit(self.channel, self.request_id, error)
+            return
+        except Exception as error:
+            self.executor.failed.emit(self.channel, self.request_id, error)
+            return
+        finally:
+            with self._lock:
+                self._connection = None
+        if not self.cancelled:
+            self.executor.finished.emit(self.channel, self.request_id, result)
+
+
+class QueryExecutor(QObject):
+    """Выполняет запросы вне GUI-потока и возвращает результат через сигналы.
+
+    Запросы группируются по каналам (например, "catalogue"): новый запрос
+    в канале отменяет предыдущий, а в GUI попадает только результат
+    самого последнего запроса канала.
+    """
+
+    finished = pyqtSignal(str, int, object)
+    failed = pyqtSignal(str, int, object)
+
+    def __init__(self, db, parent=None, max_threads=2):
+        super().__init__(parent)
+        self.db = db
+        self.pool = QThreadPool(self)
+        self.pool.setMaxThreadCount(max_threads)
+        # Потоки не завершаются по простою, чтобы их соединения с базой переиспользовались
+        self.pool.setExpiryTimeout(-1)
+        self._tasks = {}
+        self._callbacks = {}
+        self._request_id = 0
+        self.finished.connect(self._on_finished)
+        self.failed.connect(self._on_failed)
+
+    def submit(self, channel, func, callback, *args, error_callback=None):
+        """Запускает func(*args) в пуле; callback(result) вызывается в GUI-потоке."""
+        self.cancel(channel)
+        self._request_id += 1
+        task = QueryTask(self, channel, self._request_id, func, args)
+        self._tasks[channel] = task
+        self._callbacks[channel] = (callback, error_callback)
+        self.pool.start(task.run)
+        return self._request_id
+
+    def cancel(self, channel):
+        task = self._tasks.pop(channel, None)
+        if task is not None:
+            task.cancel()
+        self._callbacks.pop(channel, None)
+
+    def running(self, channel):
+        """Есть ли в канале запрос, результат которого еще не доставлен."""
+        return channel in self._tasks
+
+    def wait(self, msecs=-1):
+        """Дожидается завершения всех запросов (для тестов и бенчмарков)."""
+        return self.pool.waitForDone(msecs)
+
+    @property
+    def busy(self):
+        """Есть ли запросы, результат которых еще не доставлен в GUI."""
+        return bool(self._tasks)
+
+    def _take(self, channel, request_id):
+        task = self._tasks.get(channel)
+        if task is None or task.request_id != request_id:
+            return None
+        del self._tasks[channel]
+        return self._callbacks.pop(channel)
+
+    def _on_finished(self, channel, request_id, result):
+        callbacks = self._take(channel, request_id)
+        if callbacks is not None:
+            callbacks[0](result)
+
+    def _on_failed(self, channel, request_id, error):
+        callbacks = self._take(channel, request_id)
+        if callbacks is not None and callbacks[1] is not None:
+            callbacks[1](error)
+
+
+class WriteQueue(QObject):
+    """Очередь записей из GUI с group commit.
+
+    Записи копятся WRITE_WINDOW_MS миллисекунд и фиксируются одной
+    транзакцией (Database.write_batch) в отдельном потоке записи; записи,
+    пришедшие, пока фиксировалась пачка, уходят следующей. Так десяток
+    удалений подряд стоит одной фиксации, а при synchronous = FULL — одного
+    fsync вместо десяти.
+
+    Панели не ждут фиксации: они сразу показывают изменение, а если запись
+    не прошла, откатывают его в callback или error_callback. После каждой
+    пачки выходит сигнал committed.
+    """
+
+    committed = pyqtSignal()
+    _written = pyqtSignal(object, object)
+
+    def __init__(self, db, parent=None, window_ms=WRITE_WINDOW_MS, limit=WRITE_BATCH_LIMIT):
+        super().__init__(parent)
+        self.db = db
+        self.limit = limit
+        self.batches = 0
+        self.writes = 0
+        # [(записи, callback, error_callback), ...] в порядке submit
+        self._pending = []
+        self._running = False
+        self._executor = ThreadPoolExecutor(1, thread_name_prefix="writer")
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(window_ms)
+        self.timer.timeout.connect(self.flush)
+        self._written.connect(self._deliver)
+
+    def submit(self, operations, callback=None, error_callback=None):
+        """Ставит записи [(имя, аргументы), ...] в очередь.
+
+        callback(results) получает в GUI-потоке их результаты, как от
+        Database.write_batch (запись, нарушившая ограничение базы, — исключение
+        sqlite3.IntegrityError на ее месте); error_callback(error) — ошибку,
+        из-за которой записи не выполнились совсем.
+        """
+        operations = list(operations)
+        for name, _ in operations:
+            if name not in WRITE_OPERATIONS:
+                raise ValueError(f"Неизвестная запись: {name}")
+        self._pending.append((operations, callback, error_callback))
+        if sum(len(pending[0]) for pending in self._pending) >= self.limit:
+            self.flush()
+        elif not self._running and not self.timer.isActive():
+            self.timer.start()
+
+    @property
+    def busy(self):
+        """Есть ли записи, результат которых еще не доставлен в GUI."""
+        return bool(self._pending) or self._running
+
+    def flush(self):
+        """Отправляет накопленные записи на фиксацию, не дожидаясь конца окна."""
+        self.timer.stop()
+        if self._running or not self._pending:
+            return
+        batch, count = [], 0
+        while self._pending and (not batch or count + len(self._pending[0][0]) <= self.limit):
+            batch.append(self._pending.pop(0))
+            count += len(batch[-1][0])
+        self._running = True
+        self._executor.submit(self._write, batch)
+
+    def wait(self):
+        """Фиксирует все записи и доставляет их результаты (при выходе из
+        приложения и в бенчмарках)."""
+        while self.busy:
+            self.flush()
+            QCoreApplication.processEvents()
+            time.sleep(0.001)
+
+    def _write(self, batch):
+        operations = [operation for operations, _, _ in batch for operation in operations]
+        try:
+            results = self.db.write_batch(operations)
+        except Exception as error:
+            # Пачка откатилась целиком: группы записей повторяются по
+            # отдельности, чтобы ошибка одной не отменила остальные
+            outcomes = [error] if len(batch) == 1 else [self._write_one(operations) for operations, _, _ in batch]
+        else:
+            outcomes, position = [], 0
+            for operations, _, _ in batch:
+                outcomes.append(results[position:position + len(operations)])
+                position += len(operations)
+        self._written.emit(batch, outcomes)
+
+    def _write_one(self, operations):
+        try:
+            return self.db.write_batch(operations)
+        except Exception as error:
+            return error
+
+    def _deliver(self, batch, outcomes):
+        self._running = False
+        self.batches += 1
+        self.writes += sum(len(operations) for operations, _, _ in batch)
+        # Следующая пачка фиксируется, пока вызываются callback (они могут
+        # показывать модальные сообщения)
+        if self._pending:
+            self.flush()
+        if not all(isinstance(outcome, Exception) for outcome in outcomes):
+            self.committed.emit()
+        for (_, callback, error_callback), outcome in zip(batch, outcomes):
+            if isinstance(outcome, Exception):
+                if error_callback is not None:
+                    error_callback(outcome)
+            elif callback is not None:
+                callback(outcome)